@@ -172,10 +172,10 @@ def main():
     influx_client = InfluxDBClient(INFLUX_HOST, INFLUX_PORT, INFLUX_USER, INFLUX_PASSWORD, INFLUX_DATABASE)	
     	
     for device_uuid in os.listdir(devices_dir):
-        if device_uuid not in devices:
+        device_tags = devices.get(device_uuid)
+        if device_tags is None:
                 print "Device uuid " + device_uuid + " not in mio tree. Skipping..."
                 continue
-        device_tags = devices[device_uuid]
         device_meta = mio.meta_query(device_uuid)
         transducer_tags = mio_meta_utils.get_transducer_names_from_meta(device_meta)
         for transducer in os.listdir(devices_dir+"/"+device_uuid):
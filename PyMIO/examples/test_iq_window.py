@@ -0,0 +1,99 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+################################################################################
+## @package tests
+#  Mortar IO (MIO) Python2 Library
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+# IqFuture and IqWindow test
+
+import unittest
+
+from sleekxmpp.exceptions import IqTimeout
+
+from mio_future import IqFuture, IqWindow, gather
+
+
+class TestIqWindow(unittest.TestCase):
+
+	def setUp(self):
+		# Futures started by the window, completed by the test as replies
+		self.started = list()
+
+	def start(self, future):
+		self.started.append(future)
+
+	def test_limit(self):
+		window = IqWindow(2)
+		futures = [window.submit(self.start) for index in range(5)]
+		self.assertEqual(len(self.started), 2)
+		self.assertEqual(window.stats()["waiting"], 3)
+
+		# Every reply starts one waiting request, in submission order
+		self.started[0].set_result(0)
+		self.assertEqual(len(self.started), 3)
+		self.assertIs(self.started[2], futures[2])
+		for index in range(1, 5):
+			self.started[index].set_result(index)
+		self.assertEqual([future.result(0) for future in futures], range(5))
+		stats = window.stats()
+		self.assertEqual((stats["outstanding"], stats["waiting"], stats["high_watermark"]),
+			(0, 0, 2))
+
+	def test_unbounded(self):
+		window = IqWindow(0)
+		for index in range(10):
+			window.submit(self.start)
+		self.assertEqual(len(self.started), 10)
+
+	def test_failed_start(self):
+		def fail(future):
+			raise ValueError("not sent")
+		window = IqWindow(1)
+		failed = window.submit(fail)
+		waiting = window.submit(self.start)
+		self.assertIsInstance(failed.exception(0), ValueError)
+		# The slot of the failed request is released
+		self.assertEqual(self.started, [waiting])
+
+	def test_future_timeout(self):
+		self.assertRaises(IqTimeout, IqFuture().result, 0.01)
+
+	def test_then_and_gather(self):
+		first = IqFuture()
+		second = IqFuture()
+		gathered = gather([first.then(lambda result: result * 2), second])
+		first.set_result(2)
+		self.assertFalse(gathered.done())
+		second.set_result(5)
+		self.assertEqual(gathered.result(0), [4, 5])
+
+	def test_gather_exception(self):
+		first = IqFuture()
+		second = IqFuture()
+		first.set_exception(ValueError("failed"))
+		second.set_result(1)
+		self.assertIsInstance(gather([first, second]).exception(0), ValueError)
+		self.assertIsInstance(gather([first, second], True).result(0)[0], ValueError)
+
+if __name__ == '__main__':
+
+	suite = unittest.TestLoader().loadTestsFromTestCase(TestIqWindow)
+	unittest.TextTestRunner(verbosity=2).run(suite)
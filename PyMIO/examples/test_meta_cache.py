@@ -0,0 +1,88 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+################################################################################
+## @package tests
+#  Mortar IO (MIO) Python2 Library
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+# MetaCache expiration and eviction test
+
+import time
+import unittest
+
+from mio_cache import MetaCache
+
+
+class TestMetaCache(unittest.TestCase):
+
+	def test_get_put(self):
+		cache = MetaCache(4, 60)
+		self.assertIsNone(cache.get("a"))
+		cache.put("a", {"name": "A"})
+		self.assertEqual(cache.get("a"), {"name": "A"})
+		stats = cache.stats()
+		self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 1, 1))
+
+	def test_values_are_copied(self):
+		cache = MetaCache(4, 60)
+		meta = {"transducers": [{"name": "t"}]}
+		cache.put("a", meta)
+		meta["transducers"].append({"name": "u"})
+		cached = cache.get("a")
+		self.assertEqual(len(cached["transducers"]), 1)
+		cached["transducers"].append({"name": "v"})
+		self.assertEqual(len(cache.get("a")["transducers"]), 1)
+
+	def test_ttl(self):
+		cache = MetaCache(4, 0.1)
+		cache.put("a", {"name": "A"})
+		self.assertIsNotNone(cache.get("a"))
+		time.sleep(0.15)
+		self.assertIsNone(cache.get("a"))
+		self.assertEqual(cache.stats()["expirations"], 1)
+
+	def test_lru_eviction(self):
+		cache = MetaCache(2, 60)
+		cache.put("a", 1)
+		cache.put("b", 2)
+		# a becomes the most recently used, b is evicted
+		cache.get("a")
+		cache.put("c", 3)
+		self.assertIsNone(cache.get("b"))
+		self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+		self.assertEqual(cache.stats()["evictions"], 1)
+
+	def test_invalidate(self):
+		cache = MetaCache(4, 60)
+		cache.put("a", 1)
+		cache.invalidate("a")
+		cache.invalidate("b")
+		self.assertIsNone(cache.get("a"))
+		self.assertEqual(cache.stats()["invalidations"], 1)
+
+	def test_disabled(self):
+		cache = MetaCache(0, 60)
+		cache.put("a", 1)
+		self.assertIsNone(cache.get("a"))
+
+if __name__ == '__main__':
+
+	suite = unittest.TestLoader().loadTestsFromTestCase(TestMetaCache)
+	unittest.TextTestRunner(verbosity=2).run(suite)
@@ -66,7 +66,8 @@ class TestMetaData(unittest.TestCase):
 		self.mio.publish_data(self.PUBLISH_EX1, "random","123 %", "123")
 		self.mio.publish_data(self.PUBLISH_EX2, "volts","220 volts", "220")
 
-		real = self.mio.grab_cache_values()
+		real = dict((node, [sample.to_dict() for sample in samples])
+			for node, samples in self.mio.grab_cache_values().items())
 		expected = {
 			self.PUBLISH_EX2 : [{
 				'timestamp': '2015-03-04T00:38:27.756638',
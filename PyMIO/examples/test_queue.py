@@ -0,0 +1,100 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+################################################################################
+## @package tests
+#  Mortar IO (MIO) Python2 Library
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+# BoundedQueue overflow policy test
+
+import threading
+import time
+import unittest
+
+from mio_queue import BoundedQueue
+from mio_types import OverflowPolicy
+
+
+class TestBoundedQueue(unittest.TestCase):
+
+	def fill(self, queue, keys):
+		return [queue.put(key, index) for index, key in enumerate(keys)]
+
+	def test_unbounded(self):
+		queue = BoundedQueue()
+		self.assertEqual(self.fill(queue, "abcdef"), [True] * 6)
+		self.assertEqual(queue.depth(), 6)
+		self.assertEqual(queue.stats()["dropped"], 0)
+
+	def test_drop_oldest(self):
+		queue = BoundedQueue(3, OverflowPolicy.DROP_OLDEST)
+		self.assertEqual(self.fill(queue, "abcde"), [True] * 5)
+		self.assertEqual(queue.drain(), [("c", 2), ("d", 3), ("e", 4)])
+		self.assertEqual(queue.stats()["dropped"], 2)
+
+	def test_drop_newest(self):
+		queue = BoundedQueue(3, OverflowPolicy.DROP_NEWEST)
+		self.assertEqual(self.fill(queue, "abcde"), [True, True, True, False, False])
+		self.assertEqual(queue.drain(), [("a", 0), ("b", 1), ("c", 2)])
+		self.assertEqual(queue.stats()["dropped"], 2)
+
+	def test_keep_latest(self):
+		queue = BoundedQueue(3, OverflowPolicy.KEEP_LATEST)
+		self.fill(queue, "abcb")
+		# The older item of key b is replaced
+		self.assertEqual(queue.drain(), [("a", 0), ("c", 2), ("b", 3)])
+		self.fill(queue, "abcd")
+		# No item with key d, the oldest one is dropped
+		self.assertEqual(queue.drain(), [("b", 1), ("c", 2), ("d", 3)])
+
+	def test_block_timeout(self):
+		queue = BoundedQueue(1, OverflowPolicy.BLOCK, block_timeout=0.1)
+		self.assertTrue(queue.put("a", 0))
+		started = time.time()
+		self.assertFalse(queue.put("b", 1))
+		self.assertTrue(time.time() - started >= 0.1)
+		stats = queue.stats()
+		self.assertEqual((stats["blocked"], stats["dropped"]), (1, 1))
+		self.assertEqual(queue.drain(), [("a", 0)])
+
+	def test_block_until_drained(self):
+		queue = BoundedQueue(1, OverflowPolicy.BLOCK)
+		queue.put("a", 0)
+		producer = threading.Thread(target=queue.put, args=("b", 1))
+		producer.start()
+		time.sleep(0.1)
+		self.assertTrue(producer.is_alive())
+		self.assertEqual(queue.drain(), [("a", 0)])
+		producer.join(1)
+		self.assertFalse(producer.is_alive())
+		self.assertEqual(queue.drain(), [("b", 1)])
+
+	def test_high_watermark(self):
+		queue = BoundedQueue(10)
+		self.fill(queue, "abcd")
+		queue.drain()
+		self.fill(queue, "ab")
+		stats = queue.stats()
+		self.assertEqual((stats["depth"], stats["high_watermark"], stats["enqueued"]), (2, 4, 6))
+
+if __name__ == '__main__':
+
+	suite = unittest.TestLoader().loadTestsFromTestCase(TestBoundedQueue)
+	unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+################################################################################
+## @package tests
+#  Mortar IO (MIO) Python2 Library
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+# Bridge consistent hash ring test
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+'/../../bridge/')
+from sharding import HashRing, Shard
+
+
+class TestHashRing(unittest.TestCase):
+
+	KEYS = ["node-%d" % index for index in range(3000)]
+
+	def owners(self, ring):
+		return dict((key, ring.get_member(key)) for key in self.KEYS)
+
+	def test_empty(self):
+		self.assertIsNone(HashRing([]).get_member("node"))
+
+	def test_stable(self):
+		self.assertEqual(self.owners(HashRing([0, 1, 2])), self.owners(HashRing([2, 0, 1])))
+
+	def test_spread(self):
+		owners = self.owners(HashRing([0, 1, 2, 3]))
+		for member in range(4):
+			share = owners.values().count(member) / float(len(self.KEYS))
+			self.assertTrue(0.15 < share < 0.35, "member %d owns %.2f" % (member, share))
+
+	def test_removed_member_only_moves_its_keys(self):
+		ring = HashRing([0, 1, 2, 3])
+		before = self.owners(ring)
+		ring.set_members([0, 1, 3])
+		after = self.owners(ring)
+		for key in self.KEYS:
+			if before[key] != 2:
+				self.assertEqual(after[key], before[key])
+			else:
+				self.assertNotEqual(after[key], 2)
+
+	def test_shards_partition_keys(self):
+		shards = [Shard(shard_id, [0, 1, 2]) for shard_id in range(3)]
+		for key in self.KEYS:
+			self.assertEqual(sum(shard.owns(key) for shard in shards), 1)
+
+if __name__ == '__main__':
+
+	suite = unittest.TestLoader().loadTestsFromTestCase(TestHashRing)
+	unittest.TextTestRunner(verbosity=2).run(suite)
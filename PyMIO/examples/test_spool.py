@@ -0,0 +1,112 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+################################################################################
+## @package tests
+#  Mortar IO (MIO) Python2 Library
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+# Bridge DiskSpool test
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+'/../../bridge/')
+from spool import DiskSpool
+
+
+class TestDiskSpool(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.replayed = list()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def handler(self, record):
+		self.replayed.append(record["index"])
+		return True
+
+	def fill(self, spool, start, count):
+		for index in range(start, start + count):
+			spool.append({"index": index, "message": "x" * 40})
+
+	def test_segment_rollover(self):
+		spool = DiskSpool(self.directory, segment_bytes=200)
+		self.fill(spool, 0, 10)
+		self.assertTrue(len(spool.segments) > 1)
+		for segment in spool.segments:
+			self.assertTrue(spool.sizes[segment] <= 200)
+		self.assertEqual(spool.pending(), 10)
+
+	def test_replay_limit_and_order(self):
+		spool = DiskSpool(self.directory, segment_bytes=200)
+		self.fill(spool, 0, 10)
+		# Nothing was appended since the previous replay, so max_records holds
+		spool.replay_appended = spool.appended
+		self.assertEqual(spool.replay(self.handler, 4), 4)
+		self.assertEqual(spool.replay(self.handler, 100), 6)
+		self.assertEqual(self.replayed, range(10))
+		self.assertEqual(spool.pending(), 0)
+		# Fully replayed segments are deleted, the one being written is kept
+		self.assertEqual(len(spool.segments), 1)
+
+	def test_replay_keeps_up_with_appends(self):
+		spool = DiskSpool(self.directory)
+		self.fill(spool, 0, 30)
+		# 30 records appended since the last replay raise the limit to 60
+		self.assertEqual(spool.replay(self.handler, 5), 30)
+
+	def test_handler_failure_stops_replay(self):
+		spool = DiskSpool(self.directory)
+		self.fill(spool, 0, 5)
+		def fail_third(record):
+			return record["index"] < 2
+		self.assertEqual(spool.replay(fail_third, 10), 2)
+		self.assertEqual(spool.pending(), 3)
+
+	def test_cursor_survives_restart(self):
+		spool = DiskSpool(self.directory, segment_bytes=200)
+		self.fill(spool, 0, 10)
+		spool.replay_appended = spool.appended
+		spool.replay(self.handler, 3)
+		spool.write_file.close()
+
+		reopened = DiskSpool(self.directory, segment_bytes=200)
+		self.assertEqual(reopened.pending(), 7)
+		reopened.replay(self.handler, 100)
+		self.assertEqual(self.replayed, range(10))
+
+	def test_size_cap(self):
+		spool = DiskSpool(self.directory, segment_bytes=200, max_bytes=400)
+		self.fill(spool, 0, 20)
+		self.assertTrue(spool.total_bytes() <= 400)
+		self.assertEqual(spool.pending() + spool.stats()["dropped"], 20)
+		spool.replay(self.handler, 100)
+		# The newest records are kept
+		self.assertEqual(self.replayed[-1], 19)
+
+if __name__ == '__main__':
+
+	suite = unittest.TestLoader().loadTestsFromTestCase(TestDiskSpool)
+	unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+################################################################################
+## @package tests
+#  Mortar IO (MIO) Python2 Library
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+# Bridge TopicRouter test
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+'/../../bridge/')
+from xmpp_mqtt_bridge import TopicRouter
+
+
+class TestTopicRouter(unittest.TestCase):
+
+	def setUp(self):
+		self.router = TopicRouter()
+		self.router.add_route('application/{appEUI}/node/{devEUI}/rx', 'rx')
+		self.router.add_route('gateway/+/stats', 'stats')
+		self.router.add_route('application/{appEUI}/#', 'any')
+		self.router.add_route('application/1/node/2/rx', 'literal')
+
+	def handler(self, topic):
+		match = self.router.match(topic)
+		return match and match[0].handler
+
+	def test_captures(self):
+		route, fields = self.router.match('application/70b3/node/00a1/rx')
+		self.assertEqual(route.handler, 'rx')
+		self.assertEqual(fields, {'appEUI': '70b3', 'devEUI': '00a1'})
+
+	def test_single_level_wildcard(self):
+		route, fields = self.router.match('gateway/0101/stats')
+		self.assertEqual((route.handler, fields), ('stats', {}))
+		self.assertIsNone(self.router.match('gateway/0101/rx/stats'))
+		self.assertEqual(self.handler('application/a/node/b/join'), 'any')
+
+	def test_multi_level_wildcard(self):
+		route, fields = self.router.match('application/a/node/b/tx/extra')
+		self.assertEqual(route.handler, 'any')
+		self.assertEqual(fields, {'appEUI': 'a'})
+		self.assertEqual(self.handler('application/a'), 'any')
+
+	def test_literal_precedence(self):
+		self.assertEqual(self.handler('application/1/node/2/rx'), 'literal')
+		self.assertEqual(self.handler('application/1/node/3/rx'), 'rx')
+
+	def test_no_match(self):
+		self.assertIsNone(self.router.match('gateway/1/rx'))
+		self.assertIsNone(self.router.match('gateway/1'))
+		self.assertIsNone(self.router.match('application'))
+
+	def test_invalid_patterns(self):
+		self.assertRaises(ValueError, self.router.add_route, 'a/#/b', 'bad')
+		self.assertRaises(ValueError, self.router.add_route,
+			'application/{other}/node/{devEUI}/rx', 'bad')
+		self.assertRaises(ValueError, self.router.add_route,
+			'application/+/node/+/join', 'bad')
+
+if __name__ == '__main__':
+
+	suite = unittest.TestLoader().loadTestsFromTestCase(TestTopicRouter)
+	unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+################################################################################
+## @package tests
+#  Mortar IO (MIO) Python2 Library
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+# TransducerSample parsing test
+
+import unittest
+import xml.etree.ElementTree as ET
+
+from mio_types import TransducerSample, parse_number, format_number, parse_timestamp
+
+
+class TestTransducerSample(unittest.TestCase):
+
+	def sample(self, attributes):
+		element = ET.Element("transducerData", attributes)
+		return TransducerSample.from_element("node", element)
+
+	def test_round_trip(self):
+		published = [
+			{"name": "temperature", "value": "21.5", "timestamp": "2016-03-01T10:00:00.123456"},
+			{"name": "count", "value": "42", "raw_value": "0x2a"},
+			{"name": "padded", "value": "1.50"},
+			{"name": "state", "value": "on", "timestamp": "2016-03-01T10:00:00Z"},
+			{"name": "offset", "value": "-3", "timestamp": "2016-03-01T10:00:00+05:30"},
+			{"name": "broken", "value": "1", "timestamp": "yesterday"},
+		]
+		for attributes in published:
+			self.assertEqual(self.sample(attributes).to_dict(), attributes)
+
+	def test_parsed_fields(self):
+		sample = self.sample({"name": "t", "value": "21.5",
+			"timestamp": "2016-03-01T10:00:00Z"})
+		self.assertEqual(sample.value, 21.5)
+		self.assertEqual(sample.timestamp, 1456826400.0)
+		self.assertEqual(sample.node, "node")
+		self.assertIsNotNone(sample.received_at)
+
+		# Text that does not format back the same way stays text
+		self.assertEqual(self.sample({"name": "t", "value": "1.50"}).value, "1.50")
+		self.assertIsNone(self.sample({"name": "t", "timestamp": "yesterday"}).timestamp)
+
+	def test_other_attributes(self):
+		meta = {"name": "Lamp", "type": "device", "info": "Philips Hue"}
+		sample = self.sample(meta)
+		self.assertIsNone(sample.value)
+		self.assertEqual(sample.to_dict(), meta)
+
+	def test_numbers(self):
+		for text in ["0", "-7", "3.25", "1e+20", "abc", "", "1.0"]:
+			self.assertEqual(format_number(parse_number(text)), text)
+		self.assertEqual(parse_timestamp("2016-03-01T10:00:00-01:00"),
+			parse_timestamp("2016-03-01T11:00:00Z"))
+
+if __name__ == '__main__':
+
+	suite = unittest.TestLoader().loadTestsFromTestCase(TestTransducerSample)
+	unittest.TextTestRunner(verbosity=2).run(suite)
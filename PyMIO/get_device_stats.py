@@ -90,12 +90,12 @@ def main():
 	mio = MIO(user,server,opts.password)
 	devices = mio_tree.scan_root(mio)	
 	
-	print "Discovered " +str(len(devices.keys())) + " device nodes"
+	print "Discovered " +str(len(devices)) + " device nodes"
 	
 	i =0 
 	influx_client = InfluxDBClient(INFLUX_HOST, INFLUX_PORT, INFLUX_USER, INFLUX_PASSWORD, INFLUX_DATABASE)
 	points = list()
-	for device in devices.values():
+	for device in devices.iter_devices():
 		uuid = device["node"]
 		device_meta = mio.meta_query(uuid);		
 		if not device_meta:
@@ -34,7 +34,6 @@
 
 
 import re
-import sys
 import logging
 import coloredlogs
 
@@ -42,12 +41,11 @@ from logging import getLogger
 from datetime import datetime
 
 from xml.etree import ElementTree
-from xml.dom.minidom import parseString
 
 from threading import Lock
 from time import sleep
+from itertools import count
 
-from sleekxmpp import ClientXMPP
 from sleekxmpp.xmlstream import ET
 from sleekxmpp.exceptions import IqError, IqTimeout
 
@@ -55,8 +53,17 @@ from sleekxmpp.plugins.xep_0004.stanza.form import Form
 from sleekxmpp.plugins.xep_0060.stanza.pubsub_owner import OwnerAffiliations
 from sleekxmpp.plugins.xep_0060.stanza.pubsub_owner import OwnerAffiliation
 from sleekxmpp.plugins.xep_0060.stanza.pubsub import Options
+from sleekxmpp.plugins.xep_0060.stanza.pubsub import Item
 
 from mio_types import MetaType, ReferenceType, Unit, AffiliationType
+from mio_types import OverflowPolicy, TransducerSample, monotonic
+from mio_queue import BoundedQueue
+from mio_future import IqFuture, IqWindow, wait_all, gather
+from mio_cache import MetaCache
+from mio_pool import SessionPool
+from mio_reconnect import Backoff, ReconnectManager
+import mio_trace
+from mio_trace import SEND, RECV
 
 # Initialize the logger and handler.
 logger = getLogger('coloredlogs')
@@ -69,8 +76,12 @@ class MIO():
 	RUNNING 			= False
 	## Is the Client in the connecting State
 	CONNECTING 			= False
-	## SleekXMPP instance used to connect to the server
+	## Is the session with the server established
+	CONNECTED			= False
+	## SleekXMPP instance of the first session of the pool
 	CLIENT 				= None
+	## Number of XMPP sessions opened for the user
+	SESSIONS			= 1
 	## Username to connect to the XMPP Server
 	USERNAME 			= None
 	## Password to connect to the XMPP Server
@@ -79,10 +90,47 @@ class MIO():
 	SERVER 				= None
 	## Time in seconds for the connection timeout
 	TIMEOUT 			= 10
-	## Variable used to store incoming objects from the server
-	CACHE_VALUES		= dict()
-	## Number of tries before assuming that the server is not reachable
+	## Queue used to store incoming objects from the server
+	CACHE_VALUES		= None
+	## Maximum number of objects kept in the cache, zero for unbounded
+	CACHE_CAPACITY		= 0
+	## What to do with incoming objects when the cache is full
+	CACHE_POLICY		= OverflowPolicy.DROP_OLDEST
+	## Seconds an incoming object waits for room with the BLOCK policy before
+	#  it is discarded. Objects are cached from the SleekXMPP event thread,
+	#  which also completes the replies of the *_async methods, so a consumer
+	#  waiting for one of them would never drain the cache if it waited forever.
+	CACHE_BLOCK_TIMEOUT	= 1.0
+	## Maximum number of IQs sent with the *_async methods that are waiting for
+	#  a reply at the same time, zero for unbounded
+	IQ_CONCURRENCY		= 32
+	## Maximum number of event nodes with cached meta information, zero to
+	#  disable the cache
+	META_CACHE_CAPACITY	= 1024
+	## Seconds after which cached meta information is fetched again, zero to
+	#  keep it until it is invalidated
+	META_CACHE_TTL		= 300
+	## Maximum number of publications sent with the *_async methods that are
+	#  waiting for an acknowledgement at the same time
+	PUBLISH_WINDOW		= 256
+	## Number of publications waiting for a free slot in the window after which
+	#  the publishing thread is blocked, zero for unbounded
+	PUBLISH_MAX_WAITING	= 4096
+	## Number of times an asynchronous publication that timed out is sent again
+	PUBLISH_RETRIES		= 2
+	## Are several values published as the items of one request. Current
+	#  versions of XEP-0060 allow one item per publish request, only servers
+	#  that still accept several items save requests, see publish_data_batch.
+	BATCH_PUBLISH		= True
+	## Wire tracer of the stanzas sent and received, disabled by default
+	TRACER				= mio_trace.TRACER
+	## Number of reconnection attempts before giving up on the server
 	SOCK_RETRY			= 0		# Zero for infinity
+	## Maximum number of seconds between two reconnection attempts
+	RECONNECT_MAX_DELAY	= 30
+	## Number of times the subscriptions of a reconnected session are checked
+	#  and backfilled before giving up
+	RECOVERY_ATTEMPTS	= 5
 
 	## Variable used to identify if the Client is listening for pub_sub messages
 	CLIENT_LISTENING	= False
@@ -90,11 +138,11 @@ class MIO():
 	## Default number of maximum Items in a node
 	MAX_ITEMS_DEFAULT	= 1000
 
-	## Lock used to synchronize access to the CACHE_VALUES variable
-	CACHE_LOCK			= Lock()
-
 	## The constructor.
-	def __init__(self, username, server, password, log_level=logging.ERROR):
+	def __init__(self, username, server, password, log_level=logging.ERROR,
+		cache_capacity=None, cache_policy=None, iq_concurrency=None,
+		meta_cache_capacity=None, meta_cache_ttl=None, publish_window=None,
+		sessions=None, accounts=None):
 
 		coloredlogs.set_level(log_level)
 
@@ -104,65 +152,241 @@ class MIO():
 		self.PASSWORD = password
 		self.SERVER   = "pubsub."+server
 
-		#Socket statistics
-		self.sock_retry = 0
-
-		#XMPPClient
-		self.CLIENT = ClientXMPP(username+"@"+server, password)
-		self.CLIENT.register_plugin('xep_0030')
-		self.CLIENT.register_plugin('xep_0059')
-		self.CLIENT.register_plugin('xep_0060')
-		self.CLIENT.ssl=False
+		#Cache of values received from subscriptions, owned by this instance
+		if cache_capacity is not None:
+			self.CACHE_CAPACITY = cache_capacity
+		if cache_policy is not None:
+			self.CACHE_POLICY = cache_policy
+		self.CACHE_VALUES = BoundedQueue(self.CACHE_CAPACITY, self.CACHE_POLICY,
+			self.CACHE_BLOCK_TIMEOUT)
+
+		#Callbacks executed when a new value is added to the cache
+		self.cache_listeners = list()
+
+		#Timestamp of the last value received for every (node, transducer)
+		self.last_received = dict()
+
+		#Outstanding IQs of the *_async methods
+		if iq_concurrency is not None:
+			self.IQ_CONCURRENCY = iq_concurrency
+		self.iq_window = IqWindow(self.IQ_CONCURRENCY)
+		self.iq_counter = count()
+
+		#Outstanding publications of the *_async methods
+		if publish_window is not None:
+			self.PUBLISH_WINDOW = publish_window
+		self.publish_window = IqWindow(self.PUBLISH_WINDOW,
+			self.PUBLISH_MAX_WAITING)
+		self.publish_lock = Lock()
+		self.publish_counters = {"published": 0, "acked": 0, "errors": 0,
+			"timeouts": 0, "retries": 0}
+
+		#Parsed meta information of event nodes
+		if meta_cache_capacity is not None:
+			self.META_CACHE_CAPACITY = meta_cache_capacity
+		if meta_cache_ttl is not None:
+			self.META_CACHE_TTL = meta_cache_ttl
+		self.meta_cache = MetaCache(self.META_CACHE_CAPACITY, self.META_CACHE_TTL)
+
+		#Event nodes whose meta changed since they were taken by a tree refresh
+		self.meta_changes = set()
+		self.meta_changes_lock = Lock()
+
+		#XMPP sessions, SESSIONS for the user and one for each of the other
+		#(username, password) accounts
+		if sessions is not None:
+			self.SESSIONS = sessions
+		session_accounts = [(username+"@"+server, password)] * max(self.SESSIONS, 1)
+		for account_user, account_password in accounts or list():
+			session_accounts.append((account_user+"@"+server, account_password))
+		self.pool = SessionPool(session_accounts)
+		self.CLIENT = self.pool.sessions[0].client
+
+		#Seconds spent in every stage of start, as (stage, seconds)
+		self.startup = list()
+
+		#Reconnection of the sessions and recovery of their subscriptions
+		self.reconnect = ReconnectManager(self,
+			Backoff(maximum=self.RECONNECT_MAX_DELAY), self.RECOVERY_ATTEMPTS)
 
 		#EventHandlers
-		self.CLIENT.add_event_handler("session_start", self.on_session_start)
-		self.CLIENT.add_event_handler("ssl_invalid_cert", self.on_ssl_invalid_cert)
-		self.CLIENT.add_event_handler("socket_error", self.on_socket_error)
-		self.CLIENT.add_event_handler("stream_error", self.on_socket_error)
-		self.CLIENT.add_event_handler("stream_negotiated", self.on_stream_negotiated)
+		for session in self.pool.sessions:
+			client = session.client
+			self.reconnect.configure(session, self.SOCK_RETRY or None)
+			client.add_event_handler("session_start",
+				lambda event, session=session: self.on_session_start(event, session))
+			client.add_event_handler("ssl_invalid_cert", self.on_ssl_invalid_cert)
+			client.add_event_handler("no_auth",
+				lambda event, session=session: self.on_no_auth(event, session))
+			client.add_event_handler("socket_error",
+				lambda event, session=session: self.on_socket_error(event, session))
+			client.add_event_handler("stream_error",
+				lambda event, session=session: self.on_socket_error(event, session))
+			client.add_event_handler("stream_negotiated",
+				lambda event, session=session: self.on_stream_negotiated(event, session))
+			client.add_event_handler("disconnected",
+				lambda event, session=session: self.on_disconnected(event, session))
+			client.add_event_handler("pubsub_publish", self.on_meta_published)
+			client.add_event_handler("pubsub_retract", self.on_meta_retracted)
 
 		self.start()
 
 	## Routine executed when the connections to the server starts
-	def on_session_start(self, event):
+	def on_session_start(self, event, session=None):
 		#self.CLIENT.send_presence()
 		#self.CLIENT.get_roster()
-		pass
+		if session:
+			restarted = session.started
+			session.started = True
+			session.connected = True
+			session.started_event.set()
+			#The server may have changed, batches are tried again
+			session.batch_publish = True
+			if restarted:
+				self._fail_back(session)
+			self.reconnect.on_session_start(session)
+		self.CONNECTED = True
+
+	## Routine executed when the connection to the server is lost
+	def on_disconnected(self, event, session=None):
+		if session:
+			session.connected = False
+			self.reconnect.on_disconnected(session)
+			self._fail_over(session)
+		self.CONNECTED = self.pool.any_connected()
+
+	## Moves the subscriptions of a lost session to the other sessions
+	def _fail_over(self, session):
+		if not self.RUNNING or self.pool.size() == 1 or not self.pool.any_connected():
+			return
+		event_nodes = self.pool.subscribed_with(session)
+		if event_nodes:
+			logging.warning("Session %s lost, moving %d subscriptions" %
+				(session.jid, len(event_nodes)))
+			self._move_subscriptions(event_nodes)
+
+	## Moves subscriptions back to a session that is established again
+	def _fail_back(self, session):
+		event_nodes = self.pool.displaced_from(session)
+		if event_nodes:
+			logging.warning("Session %s is back, moving %d subscriptions" %
+				(session.jid, len(event_nodes)))
+			self._move_subscriptions(event_nodes)
+
+	## Subscribes to the event nodes with the session that now handles them and
+	#  drops the previous subscription if its session is still connected
+	#  Runs on the SleekXMPP threads, so only asynchronous requests are used.
+	def _move_subscriptions(self, event_nodes):
+		for event_node in event_nodes:
+			old_client = self.pool.subscribed.get(event_node)
+
+			def on_done(future, event_node=event_node, old_client=old_client):
+				if future.exception() is not None:
+					logging.error("Could not move the subscription to %s" % event_node)
+					return
+				new_client = self.pool.subscribed.get(event_node)
+				old_sessions = [s for s in self.pool.sessions if s.client is old_client]
+				if old_client is not new_client and old_sessions and old_sessions[0].connected:
+					old_client['xep_0060'].unsubscribe(self.SERVER, event_node,
+						bare=False, block=False)
+
+			self.subscribe_async(event_node, self.pool.subscribed_bare(event_node)
+				).add_done_callback(on_done)
+
+	## Returns True while the session with the server is established
+	def is_connected(self):
+		return self.CONNECTED
+
+	## Routine executed when an item is published on a subscribed event node
+	#  A new meta item replaces the cached one, so it is parsed only once
+	def on_meta_published(self, msg):
+		item = msg['pubsub_event']['items']['item']
+		if item['id'] != "meta":
+			return
+		node = str(msg['pubsub_event']['items']['node'])
+		if item['payload'] is None:
+			self.meta_changed(node)
+		else:
+			self.meta_changed(node, self._meta_payload_to_dict(item['payload']))
+
+	## Routine executed when an item is retracted from a subscribed event node
+	def on_meta_retracted(self, msg):
+		items = msg['pubsub_event']['items']
+		if items['retract']['id'] == "meta":
+			self.meta_changed(str(items['node']))
+
+	## Records that the meta of event_node changed
+	#  The cached meta is replaced by meta, or dropped when meta is None, and
+	#  the node is kept for take_meta_changes.
+	def meta_changed(self, event_node, meta=None):
+		if meta is None:
+			self.meta_cache.invalidate(event_node)
+		else:
+			self.meta_cache.put(event_node, meta)
+		with self.meta_changes_lock:
+			self.meta_changes.add(event_node)
+
+	## Returns the set of event nodes whose meta changed since the last call
+	#  Only the changes made through this instance and the ones of subscribed
+	#  event nodes are known.
+	def take_meta_changes(self):
+		with self.meta_changes_lock:
+			changes = self.meta_changes
+			self.meta_changes = set()
+		return changes
+
+	## Gives back changes returned by take_meta_changes that were not handled
+	def restore_meta_changes(self, event_nodes):
+		with self.meta_changes_lock:
+			self.meta_changes.update(event_nodes)
 
 	## Routine executed when the Server socket cant be reached
-	def on_socket_error(self, event):
-		logging.error("Error Connecting to Server")
-
-		if self.SOCK_RETRY == 0 or self.sock_retry < self.SOCK_RETRY:
-			logging.error("Retrying "+str(self.sock_retry+1)+" ...")
-			self.sock_retry += 1
-		else:
-			sys.exit()
+	#  The session is reconnected by SleekXMPP, see ReconnectManager
+	def on_socket_error(self, event, session=None):
+		logging.error("Error Connecting to Server: %s" % event)
+		if session:
+			self.reconnect.on_socket_error(session)
 
 	## Routine executed when a stream socket is established with the server
-	def on_stream_negotiated(self, event):
+	def on_stream_negotiated(self, event, session=None):
 
 		# if waiting for pub_sub messages, resend the presence token
 		# fixes stream connection drops
 		if self.CLIENT_LISTENING:
-			self.CLIENT.send_presence()
+			if session:
+				session.client.send_presence()
+			else:
+				self.CLIENT.send_presence()
+
 
+	## Routine executed when the server rejects every authentication mechanism
+	def on_no_auth(self, event, session=None):
+		logging.error("Authentication failed for %s" %
+			(session.jid if session else self.USERNAME))
 
 	## Routine executed when an invalid certificate is found
 	def on_ssl_invalid_cert(self, event):
 		#Ignore certificate errors
 		pass
 
-	## Starts the SleekXMPP client
+	## Starts the SleekXMPP client of every session
+	#  The time spent connecting the sockets and then authenticating and
+	#  binding the sessions is kept in startup.
 	def start(self):
 		if not self.RUNNING:
 			self.CONNECTING = True
-			self.CLIENT.connect()
-			self.CLIENT.process(block=False)
-
-			#Wait for the session to be established
-			while not self.CLIENT.sessionstarted:
-				sleep(0.05)
+			started = monotonic()
+			for session in self.pool.sessions:
+				session.client.connect()
+				session.client.process(block=False)
+			connected = monotonic()
+
+			#Wait for the sessions to be established, in slices so that the
+			#main thread still handles signals
+			while not self.pool.wait_started(1.0):
+				pass
+			self.startup = [("connect", connected - started),
+				("auth", monotonic() - connected)]
 			self.RUNNING = True
 			self.CONNECTING = False
 
@@ -177,8 +401,10 @@ class MIO():
 			sleep(0.05)
 
 		if self.RUNNING:
-			self.CLIENT.disconnect(wait=True, send_close=True)
+			#Cleared first so that the sessions do not fail over to each other
 			self.RUNNING = False
+			for session in self.pool.sessions:
+				session.client.disconnect(wait=True, send_close=True)
 		else:
 			logging.error("XMPP Client is not running")
 
@@ -190,9 +416,10 @@ class MIO():
 		logging.info("acl_affiliations_query: Init")
 		result_lst = list()
 		try:
-			result = self.CLIENT['xep_0060'].get_node_affiliations(self.SERVER,
+			result = self._pubsub(event_node).get_node_affiliations(self.SERVER,
 				event_node, timeout=self.TIMEOUT)
-			logging.debug("RCV:"+parseString(str(result)).toprettyxml())
+			if self.TRACER.enabled:
+				self.TRACER.trace(RECV, "acl_affiliations_query", event_node, result)
 			if "pubsub_owner" in result.keys():
 				for x in result["pubsub_owner"]["affiliations"]:
 					result_lst.append(
@@ -219,7 +446,7 @@ class MIO():
 
 		new_aff = [[publisher_jid, AffiliationType.PUBLISHER.value]]
 		try:
-			self.CLIENT['xep_0060'].modify_affiliations(self.SERVER, event_node,
+			self._pubsub(event_node).modify_affiliations(self.SERVER, event_node,
 				affiliations=new_aff, timeout=self.TIMEOUT)
 		except IqError as e:
 			logging.error("Error adding affiliation to event node %s" %
@@ -238,7 +465,7 @@ class MIO():
 
 		aff_remove = [[publisher_jid, AffiliationType.NONE.value]]
 		try:
-			self.CLIENT['xep_0060'].modify_affiliations(self.SERVER, event_node,
+			self._pubsub(event_node).modify_affiliations(self.SERVER, event_node,
 				affiliations=aff_remove, timeout=self.TIMEOUT)
 		except IqError as e:
 			logging.error("Error adding affiliation to event node %s" %
@@ -286,7 +513,7 @@ class MIO():
 			value=parent_submission_value)
 
 		try:
-			self.CLIENT['xep_0060'].set_node_config(self.SERVER, child,
+			self._pubsub(child).set_node_config(self.SERVER, child,
 				config=child_form, timeout=self.TIMEOUT)
 		except IqError as e:
 			logging.error("Error adding collection to event node %s" % child)
@@ -298,7 +525,7 @@ class MIO():
 			return
 
 		try:
-			self.CLIENT['xep_0060'].set_node_config(self.SERVER, parent,
+			self._pubsub(parent).set_node_config(self.SERVER, parent,
 				config=parent_form, timeout=self.TIMEOUT)
 		except IqError as e:
 			logging.error("Error adding child to event node %s" % parent)
@@ -318,7 +545,7 @@ class MIO():
 		logging.info("collection_children_query: Init")
 		ret_list = list()
 		try:
-			result = self.CLIENT['xep_0060'].get_node_config(self.SERVER,
+			result = self._pubsub(collection_event).get_node_config(self.SERVER,
 				collection_event, timeout=self.TIMEOUT)
 
 			#logging.debug("SEND:"+parseString(str(result)).toprettyxml())
@@ -350,7 +577,7 @@ class MIO():
 		form = Form()
 		form.set_type("submit")
 		form.add_field("pubsub#title", value=collection_name)
-		self.CLIENT['xep_0060'].create_node(self.SERVER, collection_event,
+		self._pubsub(collection_event).create_node(self.SERVER, collection_event,
 			ntype="collection", config=form, timeout=self.TIMEOUT)
 
 		logging.info("collection_node_create: End")
@@ -360,10 +587,11 @@ class MIO():
 		logging.info("collection_parents_query: Init")
 		ret_list = list()
 		try:
-			result = self.CLIENT['xep_0060'].get_node_config(self.SERVER,
+			result = self._pubsub(event_node).get_node_config(self.SERVER,
 				event_node, timeout=self.TIMEOUT)
 
-			logging.debug("SEND:"+parseString(str(result)).toprettyxml())
+			if self.TRACER.enabled:
+				self.TRACER.trace(RECV, "collection_parents_query", event_node, result)
 			
 			if result:
 				fields = result["pubsub_owner"]["configure"]["form"]["fields"]
@@ -384,9 +612,10 @@ class MIO():
 
 	## @warning NotImplemented
 	def coll_query(self, event_node):
-		result = self.CLIENT['xep_0030'].get_info(self.SERVER, event_node,
+		result = self.pool.client_for(event_node)['xep_0030'].get_info(self.SERVER, event_node,
 			timeout=self.TIMEOUT)
-		logging.debug("RCV:"+parseString(str(result)).toprettyxml())
+		if self.TRACER.enabled:
+			self.TRACER.trace(RECV, "coll_query", event_node, result)
 
 	## @warning NotImplemented
 	def item_query(self):
@@ -410,12 +639,13 @@ class MIO():
 		item += ' xmlns="http://jabber.org/protocol/mio"'
 		item += ' />'
 
-		logging.debug("SEND:"+parseString(str(item)).toprettyxml())
+		if self.TRACER.enabled:
+			self.TRACER.trace(SEND, "meta_add", event_node, item)
 
 		payld = ET.fromstring(item)
 
 		try:
-			self.CLIENT['xep_0060'].publish(self.SERVER, event_node,
+			self._pubsub(event_node).publish(self.SERVER, event_node,
 				payload=payld, id="meta", timeout=self.TIMEOUT)
 		except IqError as e:
 			logging.error("Error adding meta to event node %s" % event_node)
@@ -426,41 +656,91 @@ class MIO():
 			logging.error("Timeout adding meta information to event node %s" %
 				event_node)
 			return
+		finally:
+			self.meta_changed(event_node)
 
 		logging.info("meta_add: End")
 
 	## Query the meta information of an event node
-	def meta_query(self, event_node):
+	#  The answer comes from the meta cache when possible. Callers that modify the
+	#  meta and publish it back must use use_cache=False.
+	def meta_query(self, event_node, use_cache=True):
 		logging.info("meta_query: Init")
 
+		if use_cache:
+			ret_dict = self.meta_cache.get(event_node)
+			if ret_dict is not None:
+				return ret_dict
+
 		xml = self.get_item(event_node, "meta")
 		if xml:
-			logging.debug("RCV:"+parseString(str(xml)).toprettyxml())
+			if self.TRACER.enabled:
+				self.TRACER.trace(RECV, "meta_query", event_node, xml)
 			ret_dict = self._meta_query_xml_to_dict(xml)
+			self.meta_cache.put(event_node, ret_dict)
 			return ret_dict
 		else:
 			return dict()
 
+	## Query the meta information of an event node without waiting for the reply
+	#  Returns an IqFuture of the meta dictionary. window limits the number of
+	#  outstanding requests instead of IQ_CONCURRENCY if given.
+	def meta_query_async(self, event_node, use_cache=True, window=None):
+		if use_cache:
+			ret_dict = self.meta_cache.get(event_node)
+			if ret_dict is not None:
+				future = IqFuture()
+				future.set_result(ret_dict)
+				return future
+
+		def to_dict(xml):
+			ret_dict = self._meta_query_xml_to_dict(xml)
+			self.meta_cache.put(event_node, ret_dict)
+			return ret_dict
+
+		return self.get_item_async(event_node, "meta", window=window).then(to_dict)
+
+	## Returns the hit and miss counters of the meta cache
+	def meta_cache_stats(self):
+		return self.meta_cache.stats()
+
+	## Query the meta information of several event nodes concurrently
+	#  Returns a dictionary of event node to meta dictionary, empty if the query
+	#  failed
+	def meta_query_many(self, event_nodes):
+		logging.info("meta_query_many: Init")
+
+		futures = dict((node, self.meta_query_async(node)) for node in event_nodes)
+		ret_dict = wait_all(futures, dict())
+
+		logging.info("meta_query_many: End")
+		return ret_dict
+
 	## Transforms an xml of Metadata into a Dictionary
 	def _meta_query_xml_to_dict(self, xml):
 		ret_dict = dict()
 
 		if xml and "item" in xml["pubsub"]["items"].keys():
-			meta = xml["pubsub"]["items"]["item"]["payload"]
-			meta_dict = dict(meta.items())
-			meta_xmlns = re.split('{|}',meta.tag)[1]
+			ret_dict = self._meta_payload_to_dict(
+				xml["pubsub"]["items"]["item"]["payload"])
+
+		return ret_dict
 
-			meta_dict["xmlns"] = meta_xmlns
-			ret_dict = meta_dict
-			children = meta.getchildren()
+	## Transforms a meta element into a Dictionary
+	def _meta_payload_to_dict(self, meta):
+		meta_dict = dict(meta.items())
+		meta_xmlns = re.split('{|}',meta.tag)[1]
 
-			if len(children) > 0:
-				meta_dict["children"] = list()
-				for child in children:
-					child_dict = self._meta_query_xml_child_to_dict(child)
-					meta_dict["children"].append(child_dict)
+		meta_dict["xmlns"] = meta_xmlns
+		children = meta.getchildren()
 
-		return ret_dict
+		if len(children) > 0:
+			meta_dict["children"] = list()
+			for child in children:
+				child_dict = self._meta_query_xml_child_to_dict(child)
+				meta_dict["children"].append(child_dict)
+
+		return meta_dict
 
 	## Transforms an xml of Metadata child into a Dictionary
 	def	_meta_query_xml_child_to_dict(self, child):
@@ -509,7 +789,7 @@ class MIO():
 		# Delete child meta
 		logging.debug("SEND: Null payload")
 		try:
-			self.CLIENT['xep_0060'].retract(self.SERVER, event_node, id="meta",
+			self._pubsub(event_node).retract(self.SERVER, event_node, id="meta",
 				timeout=self.TIMEOUT)
 		except IqError as e:
 			logging.error("Error removing meta from event node %s" % event_node)
@@ -519,6 +799,8 @@ class MIO():
 		except IqTimeout:
 			logging.error("Timeout removing meta from event node %s" %
 				event_node)
+		finally:
+			self.meta_changed(event_node)
 
 		logging.info("meta_remove: End")
 
@@ -622,7 +904,7 @@ class MIO():
 					
 			return old_transd
 
-		old_dict = self.meta_query(event_node)
+		old_dict = self.meta_query(event_node, use_cache=False)
 		if len(old_dict) == 0:
 			logging.error("Event node %s has no metadata" % event_node)
 			return
@@ -649,11 +931,12 @@ class MIO():
 			old_dict["children"].append(get_dict_from_values())
 
 		item = self._meta_dict_to_xml(old_dict)
-		logging.debug("SND:"+parseString(str(item)).toprettyxml())
+		if self.TRACER.enabled:
+			self.TRACER.trace(SEND, "meta_transducer_add", event_node, item)
 		payld = ET.fromstring(item)
 
 		try:
-			self.CLIENT['xep_0060'].publish(self.SERVER, event_node,
+			self._pubsub(event_node).publish(self.SERVER, event_node,
 				payload=payld, id="meta", timeout=self.TIMEOUT)
 		except IqError as e:
 			logging.error("Error adding transducer meta to event node %s" %
@@ -663,6 +946,8 @@ class MIO():
 		except IqTimeout:
 			logging.error("Timeout adding transducer meta info to node %s" %
 				event_node)
+		finally:
+			self.meta_changed(event_node)
 
 		logging.info("meta_transducer_add: End")
 
@@ -670,7 +955,7 @@ class MIO():
 	def meta_transducer_remove(self, event_node, name=None):
 		logging.info("meta_transducer_remove: Init")
 
-		old_dict = self.meta_query(event_node)
+		old_dict = self.meta_query(event_node, use_cache=False)
 		if len(old_dict) == 0 or "children" not in old_dict.keys():
 			logging.error("Event node %s has no transducers" % event_node)
 			return
@@ -685,11 +970,12 @@ class MIO():
 					break
 
 		item = self._meta_dict_to_xml(old_dict)
-		logging.debug("SND:"+parseString(str(item)).toprettyxml())
+		if self.TRACER.enabled:
+			self.TRACER.trace(SEND, "meta_transducer_remove", event_node, item)
 		payld = ET.fromstring(item)
 
 		try:
-			self.CLIENT['xep_0060'].publish(self.SERVER, event_node,
+			self._pubsub(event_node).publish(self.SERVER, event_node,
 				payload=payld, id="meta", timeout=self.TIMEOUT)
 		except IqError as e:
 			logging.error("Error removing transducer from event node %s" %
@@ -699,6 +985,8 @@ class MIO():
 		except IqTimeout:
 			logging.error("Timeout removing transducer from node %s" %
 				event_node)
+		finally:
+			self.meta_changed(event_node)
 
 		logging.info("meta_transducer_remove: End")
 
@@ -768,7 +1056,7 @@ class MIO():
 
 			return old_trd
 
-		old_dict = self.meta_query(event_node)
+		old_dict = self.meta_query(event_node, use_cache=False)
 		if len(old_dict) == 0:
 			logging.error("Event node %s has no metadata" % event_node)
 			return
@@ -820,11 +1108,12 @@ class MIO():
 				old_dict["children"].append(get_dict_from_values())
 
 		item = self._meta_dict_to_xml(old_dict)
-		logging.debug("SND:"+parseString(str(item)).toprettyxml())
+		if self.TRACER.enabled:
+			self.TRACER.trace(SEND, "meta_geoloc_add", event_node, item)
 		payld = ET.fromstring(item)
 
 		try:
-			self.CLIENT['xep_0060'].publish(self.SERVER, event_node,
+			self._pubsub(event_node).publish(self.SERVER, event_node,
 				payload=payld, id="meta", timeout=self.TIMEOUT)
 		except IqError as e:
 			logging.error("Error adding geolocation meta to event node %s" %
@@ -834,6 +1123,8 @@ class MIO():
 		except IqTimeout:
 			logging.error("Timeout adding geolocation meta info to node %s" %
 				event_node)
+		finally:
+			self.meta_changed(event_node)
 
 		logging.info("meta_geoloc_add: End")
 
@@ -841,7 +1132,7 @@ class MIO():
 	def meta_geoloc_remove(self, event_node, transducer_name=None):
 		logging.info("meta_transducer_remove: Init")
 
-		old_dict = self.meta_query(event_node)
+		old_dict = self.meta_query(event_node, use_cache=False)
 		if len(old_dict) == 0:
 			logging.error("Event node %s has no metadata" % event_node)
 			return
@@ -872,11 +1163,12 @@ class MIO():
 			return
 
 		item = self._meta_dict_to_xml(old_dict)
-		logging.debug("SND:"+parseString(str(item)).toprettyxml())
+		if self.TRACER.enabled:
+			self.TRACER.trace(SEND, "meta_geoloc_remove", event_node, item)
 		payld = ET.fromstring(item)
 
 		try:
-			self.CLIENT['xep_0060'].publish(self.SERVER, event_node,
+			self._pubsub(event_node).publish(self.SERVER, event_node,
 				payload=payld, id="meta", timeout=self.TIMEOUT)
 		except IqError as e:
 			logging.error("Error removing geolocation meta from event node %s" %
@@ -886,6 +1178,8 @@ class MIO():
 		except IqTimeout:
 			logging.error("Timeout removing geolocation meta from node %s" %
 				event_node)
+		finally:
+			self.meta_changed(event_node)
 
 		logging.info("meta_transducer_remove: End")
 
@@ -911,7 +1205,7 @@ class MIO():
 					"value": property_value}}
 				old_dict["children"].append(item)
 
-		old_dict = self.meta_query(event_node)
+		old_dict = self.meta_query(event_node, use_cache=False)
 		if len(old_dict) == 0:
 			logging.error("Event node %s has no metadata" % event_node)
 			return
@@ -940,11 +1234,12 @@ class MIO():
 			insert_or_update_values(old_dict)
 
 		item = self._meta_dict_to_xml(old_dict)
-		logging.debug("SND:"+parseString(str(item)).toprettyxml())
+		if self.TRACER.enabled:
+			self.TRACER.trace(SEND, "meta_property_add", event_node, item)
 		payld = ET.fromstring(item)
 
 		try:
-			self.CLIENT['xep_0060'].publish(self.SERVER, event_node,
+			self._pubsub(event_node).publish(self.SERVER, event_node,
 				payload=payld, id="meta", timeout=self.TIMEOUT)
 		except IqError as e:
 			logging.error("Error adding property meta to event node %s" %
@@ -954,6 +1249,8 @@ class MIO():
 		except IqTimeout:
 			logging.error("Timeout adding property meta info to node %s" %
 				event_node)
+		finally:
+			self.meta_changed(event_node)
 
 		logging.info("meta_property_add: End")
 
@@ -971,7 +1268,7 @@ class MIO():
 						del dictionary["children"]
 					break
 
-		old_dict = self.meta_query(event_node)
+		old_dict = self.meta_query(event_node, use_cache=False)
 		if len(old_dict) == 0:
 			logging.error("Event node %s has no metadata" % event_node)
 			return
@@ -996,11 +1293,12 @@ class MIO():
 			del_prop_from_dict(old_dict)
 
 		item = self._meta_dict_to_xml(old_dict)
-		logging.debug("SND:"+parseString(str(item)).toprettyxml())
+		if self.TRACER.enabled:
+			self.TRACER.trace(SEND, "meta_property_remove", event_node, item)
 		payld = ET.fromstring(item)
 
 		try:
-			self.CLIENT['xep_0060'].publish(self.SERVER, event_node,
+			self._pubsub(event_node).publish(self.SERVER, event_node,
 				payload=payld, id="meta", timeout=self.TIMEOUT)
 		except IqError as e:
 			logging.error("Error removing property meta from event node %s" %
@@ -1010,6 +1308,8 @@ class MIO():
 		except IqTimeout:
 			logging.error("Timeout removing property meta info from node %s" %
 				event_node)
+		finally:
+			self.meta_changed(event_node)
 
 		logging.info("meta_property_remove: Remove")
 
@@ -1022,7 +1322,7 @@ class MIO():
 		form.add_field(var="pubsub#max_items", value=str(self.MAX_ITEMS_DEFAULT))
 
 		try:
-			self.CLIENT['xep_0060'].create_node(self.SERVER, new_event_node,
+			self._pubsub(new_event_node).create_node(self.SERVER, new_event_node,
 				config=form, timeout=self.TIMEOUT)
 			logging.info("node_create: Created event node %s" % new_event_node)
 		except IqError as e:
@@ -1040,9 +1340,10 @@ class MIO():
 
 		ret_list = list()
 		try:
-			result = self.CLIENT['xep_0060'].get_nodes(self.SERVER, None,
+			result = self._pubsub(None).get_nodes(self.SERVER, None,
 				timeout=self.TIMEOUT)
-			logging.debug("RCV:"+parseString(str(result)).toprettyxml())
+			if self.TRACER.enabled:
+				self.TRACER.trace(RECV, "node_query", None, result)
 			logging.info("node_query: Query complete")
 			for item in result['disco_items']['items']:
 				ret_list.append(str(item[1]))
@@ -1058,7 +1359,7 @@ class MIO():
 		logging.info("node_delete: Init")
 
 		try:
-			self.CLIENT['xep_0060'].delete_node(self.SERVER, event_node,
+			self._pubsub(event_node).delete_node(self.SERVER, event_node,
 				timeout=self.TIMEOUT)
 			logging.info("node_delete: %s deleted " % event_node)
 		except IqError as e:
@@ -1102,12 +1403,13 @@ class MIO():
 		item += ' />'
 		item += '</references>'
 
-		logging.debug("SEND:"+parseString(str(item)).toprettyxml())
+		if self.TRACER.enabled:
+			self.TRACER.trace(SEND, "reference_child_add", parent, item)
 
 		payld = ET.fromstring(item)
 
 		try:
-			self.CLIENT['xep_0060'].publish(self.SERVER, parent, payload=payld,
+			self._pubsub(parent).publish(self.SERVER, parent, payload=payld,
 				id="references", timeout=self.TIMEOUT)
 		except IqTimeout:
 			logging.error("Timeout adding child reference to event node %s" %
@@ -1143,12 +1445,13 @@ class MIO():
 				item += ' />'
 		item += '</references>'
 
-		logging.debug("SEND:"+parseString(str(item)).toprettyxml())
+		if self.TRACER.enabled:
+			self.TRACER.trace(SEND, "reference_child_remove", parent, item)
 
 		payld = ET.fromstring(item)
 
 		try:
-			self.CLIENT['xep_0060'].publish(self.SERVER, child, payload=payld,
+			self._pubsub(child).publish(self.SERVER, child, payload=payld,
 				id="references", timeout=self.TIMEOUT)
 		except IqTimeout:
 			logging.error("Timeout removing parent from event node %s" % parent)
@@ -1170,12 +1473,13 @@ class MIO():
 				item += ' />'
 		item += '</references>'
 
-		logging.debug("SEND:"+parseString(str(item)).toprettyxml())
+		if self.TRACER.enabled:
+			self.TRACER.trace(SEND, "reference_child_remove", parent, item)
 
 		payld = ET.fromstring(item)
 
 		try:
-			self.CLIENT['xep_0060'].publish(self.SERVER, parent, payload=payld,
+			self._pubsub(parent).publish(self.SERVER, parent, payload=payld,
 				id="references", timeout=self.TIMEOUT)
 		except IqTimeout:
 			logging.error("Timeout removing child from event node %s" % parent)
@@ -1184,7 +1488,11 @@ class MIO():
 		logging.info("reference_child_remove: End")
 
 	## Query the event node about reference information
-	def reference_query(self, event_node):
+	#  The meta of all the children is fetched concurrently, each child gets its
+	#  parsed meta in "meta" and its type in "metaType". With resolve_types=False
+	#  the children are returned without them, resolve_reference_types adds them
+	#  later.
+	def reference_query(self, event_node, resolve_types=True):
 		logging.info("reference_query: Init")
 
 		ret_list = list()
@@ -1192,11 +1500,9 @@ class MIO():
 			result = self.get_item(event_node, "references")
 
 			if result:
-				logging.debug(parseString(str(result)).toprettyxml())
-
-			if result and "item" in result["pubsub"]["items"].keys():
-				for x in result["pubsub"]["items"]["item"]["payload"]:
-					ret_list.append(dict(x.items()))
+				if self.TRACER.enabled:
+					self.TRACER.trace(RECV, "reference_query", event_node, result)
+				ret_list = self.references_to_list(result)
 
 		except IqError as e:
 			logging.error("Error querying reference from event node %s" %
@@ -1207,18 +1513,87 @@ class MIO():
 			logging.error("Timeout querying reference from event node %s" %
 				event_node)
 
-		# Get the metaType of every child and update the return list
-		for child_ref in ret_list:
+		if resolve_types:
+			self.resolve_reference_types(ret_list)
+
+		logging.info("reference_query: End")
+		return ret_list
+
+	## Query the event node about reference information without waiting
+	#
+	#  Returns an IqFuture of the same list as reference_query. The meta of the
+	#  children is requested as soon as the references arrive, with window
+	#  limiting the number of outstanding requests if given. A failed query
+	#  gives an empty list, see resolve_reference_types_async for meta_query.
+	def reference_query_async(self, event_node, window=None, meta_query=None):
+		resolved = IqFuture()
+
+		def on_references(future):
+			ref_list = list()
+			try:
+				result = future.result()
+				if self.TRACER.enabled:
+					self.TRACER.trace(RECV, "reference_query", event_node, result)
+				ref_list = self.references_to_list(result)
+			except (IqError, IqTimeout) as e:
+				logging.error("Error querying reference from event node %s: %s" %
+					(event_node, repr(e)))
+			except Exception as e:
+				resolved.set_exception(e)
+				return
+			self.resolve_reference_types_async(ref_list, window,
+				meta_query).add_done_callback(
+					lambda types: self._copy_future(types, resolved))
+
+		self.get_item_async(event_node, "references",
+			window=window).add_done_callback(on_references)
+		return resolved
+
+	## Returns the children listed in the reply to a references item query
+	def references_to_list(self, result):
+		ret_list = list()
+		if "item" in result["pubsub"]["items"].keys():
+			for x in result["pubsub"]["items"]["item"]["payload"]:
+				ret_list.append(dict(x.items()))
+		return ret_list
+
+	## Adds the meta and metaType of every child of a reference_query result
+	#  without waiting
+	#  Returns an IqFuture of ref_list. meta_query replaces meta_query_async to
+	#  get the IqFuture of the meta of a child, a child whose meta can not be
+	#  fetched gets an empty meta.
+	def resolve_reference_types_async(self, ref_list, window=None,
+		meta_query=None):
+		if meta_query is None:
+			meta_query = lambda node: self.meta_query_async(node, window=window)
+
+		child_nodes = list(set(ref["node"] for ref in ref_list if ref["node"]))
+		metas = [meta_query(node) for node in child_nodes]
+
+		def set_types(results):
+			child_metas = dict((node, meta if isinstance(meta, dict) else dict())
+				for node, meta in zip(child_nodes, results))
+			return self._set_reference_types(ref_list, child_metas)
+
+		return gather(metas, return_exceptions=True).then(set_types)
+
+	## Adds the meta and metaType of every child of a reference_query result
+	def resolve_reference_types(self, ref_list):
+		child_nodes = set(ref["node"] for ref in ref_list if ref["node"])
+		return self._set_reference_types(ref_list,
+			self.meta_query_many(child_nodes))
+
+	def _set_reference_types(self, ref_list, child_metas):
+		for child_ref in ref_list:
 			if not child_ref["node"]:
 				continue
-			child_meta = self.meta_query(child_ref["node"])
+			child_meta = child_metas[child_ref["node"]]
+			child_ref["meta"] = child_meta
 			if "type" in child_meta.keys():
 				child_ref["metaType"] = child_meta["type"]
 			else:
 				child_ref["metaType"] = MetaType.UKNOWN.value
-
-		logging.info("reference_query: End")
-		return ret_list
+		return ref_list
 
 	## Adds a new schedule element or updates an existing with the same id
 	def schedule_event_add(self, event_node, transudcer_name, transducer_value,
@@ -1294,10 +1669,11 @@ class MIO():
 			item = self._schedule_event_dict_to_xml([event_zero])
 		
 		#Send the new modifications
-		logging.debug("SEND:"+parseString(str(item)).toprettyxml())
+		if self.TRACER.enabled:
+			self.TRACER.trace(SEND, "schedule_event_add", event_node, item)
 		payld = ET.fromstring(item)
 		try:
-			self.CLIENT['xep_0060'].publish(self.SERVER, event_node,
+			self._pubsub(event_node).publish(self.SERVER, event_node,
 				payload=payld, id="schedule", timeout=self.TIMEOUT)
 		except IqTimeout:
 			logging.error("Timeout adding schedule event to event node %s" %
@@ -1321,10 +1697,11 @@ class MIO():
 				new_event_list.append(event)
 
 		item = self._schedule_event_dict_to_xml(new_event_list)
-		logging.debug("SEND:"+parseString(str(item)).toprettyxml())
+		if self.TRACER.enabled:
+			self.TRACER.trace(SEND, "schedule_event_remove", event_node, item)
 		payld = ET.fromstring(item)
 		try:
-			self.CLIENT['xep_0060'].publish(self.SERVER, event_node,
+			self._pubsub(event_node).publish(self.SERVER, event_node,
 				payload=payld, id="schedule", timeout=self.TIMEOUT)
 		except IqTimeout:
 			logging.error("Timeout removing schedule event from event node %s" %
@@ -1340,7 +1717,8 @@ class MIO():
 		try:
 			result = self.get_item(event_node, "schedule")
 			if result:
-				logging.debug("RCV:"+parseString(str(result)).toprettyxml())
+				if self.TRACER.enabled:
+					self.TRACER.trace(RECV, "schedule_query", event_node, result)
 				
 				schedule = result["pubsub"]["items"]["item"]["payload"]
 				if schedule:
@@ -1415,12 +1793,18 @@ class MIO():
 		return item
 
 	## Subscribes to an event node
-	def subscribe(self, event_node):
+	#  With bare=False the subscription is made for the full JID, so events are
+	#  delivered only to this connection and not to every resource of the user.
+	#  With several sessions subscriptions are always made for the full JID of
+	#  the session of the node.
+	def subscribe(self, event_node, bare=True):
 		logging.info("subscribe: Init")
 
+		client = self.pool.client_for(event_node)
 		try:
-			self.CLIENT['xep_0060'].subscribe(self.SERVER, event_node,
-				timeout=self.TIMEOUT)
+			client['xep_0060'].subscribe(self.SERVER, event_node,
+				bare=self._subscription_bare(bare), timeout=self.TIMEOUT)
+			self.pool.set_subscribed(event_node, client, bare)
 			logging.info('Subscribed to node %s' % event_node)
 		except IqError as e:
 			logging.error("Error subscribing to event node %s" % event_node)
@@ -1431,15 +1815,69 @@ class MIO():
 
 		logging.info("subscribe: End")
 
+	## Returns the bare argument of a subscription
+	#  Every session would receive the events of a bare JID subscription
+	def _subscription_bare(self, bare):
+		return bare and self.pool.size() == 1
+
+	## Subscribes to an event node without waiting for the reply
+	#  Returns an IqFuture of the reply stanza
+	def subscribe_async(self, event_node, bare=True):
+		subscription_bare = self._subscription_bare(bare)
+		clients = list()
+
+		def send(client, callback, timeout):
+			clients.append(client)
+			return client['xep_0060'].subscribe(self.SERVER, event_node,
+				bare=subscription_bare, block=False, callback=callback,
+				timeout=timeout)
+
+		def subscribed(result):
+			self.pool.set_subscribed(event_node, clients[-1], bare)
+			return result
+
+		return self._send_iq_async(send, event_node=event_node).then(subscribed)
+
+	## Subscribes to several event nodes concurrently
+	#  Returns a dictionary of event node to True if the subscription succeeded
+	def subscribe_many(self, event_nodes, bare=True):
+		logging.info("subscribe_many: Init")
+
+		futures = dict((node, self.subscribe_async(node, bare).then(
+			lambda result: True)) for node in event_nodes)
+		ret_dict = wait_all(futures, False)
+
+		logging.info("subscribe_many: End")
+		return ret_dict
+
+	## Returns the set of event nodes the server delivers to a session
+	#  Bare JID subscriptions count for every session of the user. Returns None
+	#  if the subscriptions could not be listed.
+	def active_subscriptions(self, session):
+		client = session.client
+		jids = (client.boundjid.full, client.boundjid.bare)
+		try:
+			result = client['xep_0060'].get_subscriptions(self.SERVER,
+				timeout=self.TIMEOUT)
+		except (IqError, IqTimeout) as e:
+			logging.error("Could not list the subscriptions of %s: %s" %
+				(session.jid, repr(e)))
+			return None
+		if self.TRACER.enabled:
+			self.TRACER.trace(RECV, "active_subscriptions", None, result)
+		return set(str(sub['node']) for sub in result['pubsub']['subscriptions']
+			if str(sub['jid']) in jids and sub['subscription'] != 'none')
+
 	## List all current subscribers of a JID or event node
 	def subscriptions_query(self):
 		logging.info("subscriptions_query: Init")
 
 		sub_list = list()
 		try:
-			result = self.CLIENT['xep_0060'].get_subscriptions(self.SERVER,
+			result = self._pubsub(None).get_subscriptions(self.SERVER,
 				timeout=self.TIMEOUT)
-			logging.debug("RCV:"+parseString(str(result)).toprettyxml())
+			if self.TRACER.enabled:
+				self.TRACER.trace(RECV, "subscriptions_query", None, result)
 			for sub in result['pubsub']['subscriptions']:
 				sub_list.append({"Subscription": sub['node'],
 					"Sub ID": sub['subid']})
@@ -1453,9 +1891,12 @@ class MIO():
 	def unsubscribe(self, event_node, subid=None):
 		logging.info("unsubscribe: Init")
 
+		client = self.pool.subscribed.get(event_node) or \
+			self.pool.client_for(event_node)
 		try:
-			self.CLIENT['xep_0060'].unsubscribe(self.SERVER, event_node,
-				subid=subid, timeout=self.TIMEOUT)
+			client['xep_0060'].unsubscribe(self.SERVER, event_node, subid=subid,
+				bare=self._subscription_bare(True), timeout=self.TIMEOUT)
+			self.pool.clear_subscribed(event_node)
 			logging.info('Unsubscribed from node %s' % event_node)
 		except IqError as e:
 			logging.error("Error unsubscribing from event node %s" % event_node)
@@ -1483,26 +1924,22 @@ class MIO():
 		return self.CLIENT.authenticated
 
 	## Publishes transducer values to a specific event node
+	#  Returns True if the server acknowledged the publication
 	def publish_data(self, server, event_node, transducer_name, transducer_value,
 		transducer_raw_value=None):
 		logging.info("publish_data: Init")
 		
-		ts = datetime.now().isoformat()
-		data = 	'<transducerData'
-		data += ' name="'+str(transducer_name)+'"'
-		data += ' value="'+str(transducer_value)+'"'
-		data += ' timestamp="'+str(ts)+'"'
-		if transducer_raw_value:
-			data += ' raw_value="'+str(transducer_raw_value)+'"'
-		data += ' />'
-
-		logging.debug("SND:"+parseString(str(data)).toprettyxml())
-		payld = ET.fromstring(data)
+		payld = self._transducer_data_element(transducer_name,
+			transducer_value, transducer_raw_value)
+		if self.TRACER.enabled:
+			self.TRACER.trace(SEND, "publish_data", event_node, payld)
 		if not server:
 			server = self.SERVER
+		published = False
 		try:
-			self.CLIENT['xep_0060'].publish(server, event_node, 
+			self._pubsub(event_node).publish(server, event_node, 
 				payload=payld, id="_"+str(transducer_name), timeout=self.TIMEOUT)
+			published = True
 		except IqError as e:
 			logging.error("Error publishing values to event %s" % event_node)
 			logging.error("Error condition/type/text: %s/%s/%s" % (e.condition,
@@ -1511,14 +1948,224 @@ class MIO():
 			logging.error("Timeout publishing values to event %s" % event_node)
 
 		logging.info("publish_data: End")
+		return published
+
+	## Publishes several transducer values to an event node in one request
+	#
+	#  values is a list of (transducer_name, transducer_value) or
+	#  (transducer_name, transducer_value, transducer_raw_value) tuples, each one
+	#  becomes an item of a single publish IQ. Several items per publish request
+	#  were dropped from XEP-0060, the server has to accept them for the batch
+	#  to save requests. When a batch is rejected with an error about its
+	#  payload and the values are then accepted one at a time, the values are
+	#  published one at a time on that connection from then on.
+	#  Returns True if the server acknowledged all the values.
+	def publish_data_batch(self, server, event_node, values):
+		logging.info("publish_data_batch: Init")
+
+		if not server:
+			server = self.SERVER
+		session = self.pool.session_for(event_node)
+		if not self._batches(session, values):
+			published = [self.publish_data(server, event_node, *value)
+				for value in values]
+			return all(published)
+
+		iq = self._publish_batch_iq(session.client, server, event_node, values)
+		if self.TRACER.enabled:
+			self.TRACER.trace(SEND, "publish_data_batch", event_node, iq)
+		published = False
+		try:
+			iq.send(timeout=self.TIMEOUT)
+			published = True
+		except IqError as e:
+			if self._rejects_batch(e):
+				published = all([self.publish_data(server, event_node, *value)
+					for value in values])
+				if published:
+					self._stop_batching(session)
+				return published
+			logging.error("Error publishing values to event %s" % event_node)
+			logging.error("Error condition/type/text: %s/%s/%s" % (e.condition,
+				e.etype, e.text))
+		except IqTimeout:
+			logging.error("Timeout publishing values to event %s" % event_node)
+
+		logging.info("publish_data_batch: End")
+		return published
+
+	## Publishes transducer values without waiting for the acknowledgement
+	#
+	#  Returns an IqFuture completed with True once the server acknowledged the
+	#  publication, or with IqError or IqTimeout. Timed out publications are
+	#  sent again up to PUBLISH_RETRIES times. At most PUBLISH_WINDOW
+	#  publications are outstanding; when PUBLISH_MAX_WAITING more are waiting
+	#  the caller blocks, so it must not be a SleekXMPP event handler.
+	def publish_data_async(self, server, event_node, transducer_name,
+		transducer_value, transducer_raw_value=None):
+		if not server:
+			server = self.SERVER
+		return self._publish_async(self._publish_sender(server, event_node,
+			transducer_name, transducer_value, transducer_raw_value), event_node)
+
+	## Returns the send function of _publish_async for one transducer value
+	def _publish_sender(self, server, event_node, transducer_name,
+		transducer_value, transducer_raw_value=None):
+
+		def send(client, callback, timeout):
+			payld = self._transducer_data_element(transducer_name,
+				transducer_value, transducer_raw_value)
+			if self.TRACER.enabled:
+				self.TRACER.trace(SEND, "publish_data_async", event_node, payld)
+			return client['xep_0060'].publish(server, event_node,
+				payload=payld, id="_"+str(transducer_name), block=False,
+				callback=callback, timeout=timeout)
+
+		return send
+
+	## Publishes the values with one request each, the future is completed
+	#  once all of them are done
+	def _publish_each_async(self, server, event_node, values, wait):
+		return gather([self._publish_async(self._publish_sender(server,
+			event_node, *value), event_node, wait=wait) for value in values]).then(
+				lambda results: True)
+
+	## Publishes several transducer values to an event node in one request
+	#  without waiting for the acknowledgement, see publish_data_batch and
+	#  publish_data_async
+	def publish_data_batch_async(self, server, event_node, values):
+		if not server:
+			server = self.SERVER
+		if not self._batches(self.pool.current(event_node), values):
+			return self._publish_each_async(server, event_node, values, True)
+		clients = list()
+
+		def send(client, callback, timeout):
+			clients.append(client)
+			iq = self._publish_batch_iq(client, server, event_node, values)
+			if self.TRACER.enabled:
+				self.TRACER.trace(SEND, "publish_data_batch_async", event_node, iq)
+			return iq.send(block=False, callback=callback, timeout=timeout)
+
+		published = IqFuture()
+
+		def on_done(future):
+			e = future.exception()
+			if e is None:
+				published.set_result(True)
+			elif isinstance(e, IqError) and self._rejects_batch(e):
+				self._publish_each_async(server, event_node, values,
+					False).add_done_callback(on_retried)
+			else:
+				published.set_exception(e)
+
+		def on_retried(retry):
+			if retry.exception() is None:
+				self._stop_batching(self.pool.session_of(clients[-1]))
+			self._copy_future(retry, published)
+
+		self._publish_async(send, event_node).add_done_callback(on_done)
+		return published
+
+	## Returns True if values are published as one request with session
+	def _batches(self, session, values):
+		return self.BATCH_PUBLISH and len(values) > 1 and session.batch_publish
+
+	## Returns True if the error of a batch may mean that the server accepts
+	#  only one item per publish request
+	def _rejects_batch(self, e):
+		return str(e.condition) in ("bad-request", "not-acceptable",
+			"feature-not-implemented") and \
+			e.iq['error']['pubsub']['condition'] in ("", "invalid-payload",
+				"payload-too-big", "unsupported")
+
+	## Publishes one value per request on the connection of session
+	def _stop_batching(self, session):
+		with self.publish_lock:
+			if session is None or not session.batch_publish:
+				return
+			session.batch_publish = False
+		logging.warning("Server does not accept several items per publish request, publishing the values of %s one at a time" %
+			session.jid)
+
+	## Sends a publication with _send_iq_async and retries it on timeouts
+	#  wait must be False on the thread that processes the replies
+	def _publish_async(self, send, event_node, attempt=0, wait=True):
+		published = IqFuture()
+		if attempt == 0:
+			self._count_publish("published")
+
+		def on_done(future):
+			e = future.exception()
+			if e is None:
+				self._count_publish("acked")
+				published.set_result(True)
+			elif isinstance(e, IqTimeout) and attempt < self.PUBLISH_RETRIES:
+				self._count_publish("retries")
+				self._publish_async(send, event_node, attempt+1,
+					False).add_done_callback(
+					lambda retry: self._copy_future(retry, published))
+			else:
+				self._count_publish("timeouts" if isinstance(e, IqTimeout)
+					else "errors")
+				published.set_exception(e)
+
+		self._send_iq_async(send, self.publish_window, wait,
+			event_node).add_done_callback(on_done)
+		return published
+
+	def _copy_future(self, source, target):
+		e = source.exception()
+		if e is None:
+			target.set_result(source.result())
+		else:
+			target.set_exception(e)
+
+	def _count_publish(self, counter):
+		with self.publish_lock:
+			self.publish_counters[counter] += 1
+
+	## Returns the counters of the asynchronous publications
+	#  Every publication counts once in published and once in acked, errors or
+	#  timeouts when it is done.
+	def publish_stats(self):
+		with self.publish_lock:
+			stats = dict(self.publish_counters)
+		stats.update(self.publish_window.stats())
+		return stats
+
+	## Builds a publish IQ with one transducerData item per value
+	def _publish_batch_iq(self, client, server, event_node, values):
+		iq = client.Iq(sto=server, stype='set')
+		iq['pubsub']['publish']['node'] = event_node
+		for value in values:
+			item = Item()
+			item['id'] = "_"+str(value[0])
+			item['payload'] = self._transducer_data_element(*value)
+			iq['pubsub']['publish'].append(item)
+		return iq
+
+	## Builds the transducerData element of a publication
+	#  The element is created directly instead of parsing a string, which also
+	#  escapes the attribute values.
+	def _transducer_data_element(self, transducer_name, transducer_value,
+		transducer_raw_value=None):
+		data = ET.Element('transducerData')
+		data.set('name', str(transducer_name))
+		data.set('value', str(transducer_value))
+		data.set('timestamp', datetime.now().isoformat())
+		if transducer_raw_value:
+			data.set('raw_value', str(transducer_raw_value))
+		return data
 
 	## Listens for publish_data events and saves the values in a dictionary
 	def subscribe_listener(self):
 		logging.info("subscribe_listener: Init")
 		self.CLIENT_LISTENING = True
-		self.CLIENT.send_presence()
-		self.CLIENT.add_event_handler('pubsub_publish',
-			self._publish_received_to_cache)
+		for session in self.pool.sessions:
+			session.client.send_presence()
+			session.client.add_event_handler('pubsub_publish',
+				self._publish_received_to_cache)
 
 		logging.info("subscribe_listener: End")
 
@@ -1527,25 +2174,43 @@ class MIO():
 	def _publish_received_to_cache(self, msg):
 		if msg:
 			items = msg['pubsub_event']['items']
+			#Meta items are cached as well, on_meta_published only updates the
+			#meta cache
 			node = str(items['node'])
 			if node.endswith('_act'):
 				node = node[:-4]
 				logging.info("stripped node "+node)
-			i_dict = dict(items['item']['payload'].items())
-			self.CACHE_LOCK.acquire()
-			if node not in self.CACHE_VALUES.keys():
-				self.CACHE_VALUES[node] = list()
-			self.CACHE_VALUES[node].append(i_dict)
-			self.CACHE_LOCK.release()
-
-	## Returns the received object from subscription events
+			self._cache_sample(TransducerSample.from_element(node,
+				items['item']['payload']))
+
+	## Adds a sample to the cache and notifies the listeners
+	def _cache_sample(self, sample):
+		key = (sample.node, sample.name)
+		self.last_received[key] = sample.timestamp
+		self.CACHE_VALUES.put(key, sample)
+
+		for listener in self.cache_listeners:
+			listener(sample.node)
+
+	## Registers a callback executed every time a value is added to the cache
+	#  The callback receives the event node and runs on the SleekXMPP thread, so
+	#  it should only hand the work over to the consumer of the cache.
+	def add_cache_listener(self, callback):
+		self.cache_listeners.append(callback)
+
+	## Returns the received object from subscription events grouped by node
 	def grab_cache_values(self):
-		self.CACHE_LOCK.acquire()
-		ret_val = self.CACHE_VALUES
-		self.CACHE_VALUES = dict()
-		self.CACHE_LOCK.release()
+		ret_val = dict()
+		for (node, name), value in self.CACHE_VALUES.drain():
+			if node not in ret_val:
+				ret_val[node] = list()
+			ret_val[node].append(value)
 		return ret_val
 
+	## Returns the depth and drop counters of the cache
+	def cache_stats(self):
+		return self.CACHE_VALUES.stats()
+
 	## Gets a specific item from an event node
 	def get_item(self, event_node, item_type, server = None):
 		logging.info("get_item: Init")
@@ -1554,7 +2219,7 @@ class MIO():
 
 		result = None
 		try:
-			result = self.CLIENT['xep_0060'].get_item(server, event_node,
+			result = self._pubsub(event_node).get_item(server, event_node,
 				item_type, timeout=self.TIMEOUT)
 		except IqError as e:
 			logging.error("Error getting item from event node %s" % event_node)
@@ -1566,12 +2231,119 @@ class MIO():
 		logging.info("get_item: End")
 		return result
 
+	## Gets a specific item from an event node without waiting for the reply
+	#  Returns an IqFuture of the reply stanza
+	def get_item_async(self, event_node, item_type, server = None, window=None):
+		if not server:
+			server = self.SERVER
+
+		return self._send_iq_async(lambda client, callback, timeout:
+			client['xep_0060'].get_item(server, event_node, item_type,
+				block=False, callback=callback, timeout=timeout),
+			window=window, event_node=event_node)
+
+	## Gets the same item from several event nodes concurrently
+	#  Returns a dictionary of event node to IqFuture
+	def get_items_async(self, event_nodes, item_type, server = None):
+		return dict((node, self.get_item_async(node, item_type, server))
+			for node in event_nodes)
+
+	## Caches the values published on event nodes while they were not delivered
+	#
+	#  The items of the event nodes are fetched concurrently. A value is added
+	#  to the cache, as if it had been received, when it is newer than the last
+	#  value received for its transducer or, if none was received, when it was
+	#  published after since, in seconds since the epoch. Returns the number of values
+	#  added and the list of event nodes whose items could not be fetched.
+	def backfill(self, event_nodes, since):
+		futures = dict((node, self._send_iq_async(
+			lambda client, callback, timeout, node=node:
+				client['xep_0060'].get_items(self.SERVER, node, block=False,
+					callback=callback, timeout=timeout),
+			event_node=node)) for node in event_nodes)
+
+		added = 0
+		failed = list()
+		for event_node, future in futures.items():
+			try:
+				result = future.result()
+			except (IqError, IqTimeout) as e:
+				logging.error("Could not backfill %s: %s" % (event_node, repr(e)))
+				failed.append(event_node)
+				continue
+			if self.TRACER.enabled:
+				self.TRACER.trace(RECV, "backfill", event_node, result)
+
+			node = event_node[:-4] if event_node.endswith('_act') else event_node
+			for item in result['pubsub']['items']:
+				if item['id'] == "meta" or item['payload'] is None:
+					continue
+				sample = TransducerSample.from_element(node, item['payload'])
+				last = self.last_received.get((node, sample.name)) or since
+				if sample.timestamp is not None and sample.timestamp > last:
+					self._cache_sample(sample)
+					added += 1
+		return added, failed
+
+	## Sends an IQ without waiting for its reply
+	#
+	#  send is called with the client of the session of event_node, the reply
+	#  callback and the timeout. It must send the IQ with block=False and return
+	#  the name of the reply handler. Returns an IqFuture completed with the
+	#  reply stanza, or with IqError or IqTimeout. At most IQ_CONCURRENCY IQs
+	#  are outstanding, or the limit of window if given, the others are sent as
+	#  the replies arrive. The session is chosen when the IQ is sent, so queued
+	#  IQs fail over too. Do not wait for the future from a SleekXMPP event
+	#  handler, the reply would never be processed.
+	def _send_iq_async(self, send, window=None, wait=False, event_node=None):
+
+		def start(future):
+			client = self.pool.client_for(event_node)
+			timer = "IqFutureTimeout_%d" % next(self.iq_counter)
+			handler = list()
+
+			def on_reply(iq):
+				client.scheduler.remove(timer)
+				if iq['type'] == 'error':
+					future.set_exception(IqError(iq))
+				else:
+					future.set_result(iq)
+
+			#Callbacks do not time out, the handler is removed by a timer instead
+			def on_timeout():
+				if handler:
+					client.remove_handler(handler[0])
+				future.set_exception(IqTimeout(None))
+
+			client.schedule(timer, self.TIMEOUT, on_timeout)
+			handler.append(send(client, on_reply, self.TIMEOUT))
+
+		if window is None:
+			window = self.iq_window
+		return window.submit(start, wait)
+
+	## Returns the connection state and queue depths of every session
+	def session_stats(self):
+		return self.pool.stats()
+
+	## Returns the reconnection counters and recovery times of the sessions
+	def reconnect_stats(self):
+		return self.reconnect.stats()
+
+	## Returns the pubsub plugin of the session that handles event_node
+	def _pubsub(self, event_node):
+		return self.pool.client_for(event_node)['xep_0060']
+
+	## Returns the number of outstanding and waiting asynchronous IQs
+	def iq_stats(self):
+		return self.iq_window.stats()
+
 	## Verifies if the event_node exists
 	def node_exists(self, event_node):
 		logging.info("node_exists: Init")
 		res_bool = True
 		try:
-			self.CLIENT['xep_0060'].get_item(self.SERVER, event_node,"", timeout=self.TIMEOUT)
+			self._pubsub(event_node).get_item(self.SERVER, event_node,"", timeout=self.TIMEOUT)
 		except IqError as e:
 			if str(e.condition) == "item-not-found":
 				res_bool = False
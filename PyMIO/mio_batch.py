@@ -0,0 +1,119 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+################################################################################
+## @package mio_batch
+#  Mortar IO (MIO) Python2 Library
+#  Batching of transducer values published to several event nodes.
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+import logging
+from collections import OrderedDict
+from threading import Lock, Timer
+
+## Collects transducer values and publishes them with one request per node
+#
+#  Values are buffered per event node and published with
+#  MIO.publish_data_batch_async when max_items values are buffered or max_delay
+#  seconds after the first buffered value, whichever comes first. The requests
+#  of all the nodes are outstanding at the same time. Values that the server
+#  does not acknowledge are handed to on_failure(event_node, values) if given,
+#  and are otherwise dropped. Once values are acknowledged on_success is called
+#  if given, with the event node, the values and the received_at times passed
+#  to add for them.
+class PublishBatcher():
+
+	## The constructor.
+	def __init__(self, mio, max_items=50, max_delay=0.2, on_failure=None,
+		on_success=None):
+		self.mio = mio
+		self.max_items = max_items
+		self.max_delay = max_delay
+		self.on_failure = on_failure
+		self.on_success = on_success
+
+		self.values = OrderedDict()
+		self.received = dict()
+		self.count = 0
+		self.lock = Lock()
+		self.timer = None
+
+		#Statistics
+		self.added = 0
+		self.requests = 0
+		self.failed = 0
+
+	## Buffers values of event_node, a list of (name, value[, raw_value])
+	#  received_at is the monotonic time at which the values were received,
+	#  handed back to on_success
+	def add(self, event_node, values, received_at=None):
+		with self.lock:
+			self.values.setdefault(event_node, list()).extend(values)
+			if received_at is not None:
+				self.received.setdefault(event_node, list()).append(received_at)
+			self.count += len(values)
+			self.added += len(values)
+			full = self.count >= self.max_items
+			if not full and self.timer is None:
+				self.timer = Timer(self.max_delay, self.flush)
+				self.timer.daemon = True
+				self.timer.start()
+		if full:
+			self.flush()
+
+	## Publishes all the buffered values
+	def flush(self):
+		with self.lock:
+			batch = self.values
+			received = self.received
+			self.values = OrderedDict()
+			self.received = dict()
+			self.count = 0
+			if self.timer is not None:
+				self.timer.cancel()
+				self.timer = None
+
+		requests = [(event_node, values, self.mio.publish_data_batch_async(None,
+			event_node, values)) for event_node, values in batch.items()]
+		for event_node, values, request in requests:
+			self.requests += 1
+			if request.exception() is None:
+				if self.on_success:
+					self.on_success(event_node, values,
+						received.get(event_node, list()))
+				continue
+			self.failed += len(values)
+			if self.on_failure:
+				self.on_failure(event_node, values)
+			else:
+				logging.error("PublishBatcher: dropped %d values of %s" %
+					(len(values), event_node))
+
+	## Publishes the buffered values and stops the timer
+	def stop(self):
+		self.flush()
+
+	## Returns the batching counters
+	def stats(self):
+		with self.lock:
+			pending = self.count
+		return {"added": self.added,
+			"requests": self.requests,
+			"failed": self.failed,
+			"pending": pending}
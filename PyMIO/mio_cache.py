@@ -0,0 +1,102 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+################################################################################
+## @package mio_cache
+#  Mortar IO (MIO) Python2 Library
+#  Cache of the parsed meta information of event nodes.
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+from collections import OrderedDict
+from copy import deepcopy
+from threading import Lock
+
+from mio_types import monotonic
+
+## Thread safe LRU cache of meta dictionaries keyed by event node
+#
+#  Entries expire ttl seconds after they were stored. When the cache holds
+#  capacity entries the least recently used one is evicted. Values are copied
+#  on the way in and out, so callers are free to modify what they get.
+#  A capacity of zero disables the cache.
+class MetaCache():
+
+	## The constructor.
+	def __init__(self, capacity=1024, ttl=300):
+		self.capacity = capacity
+		self.ttl = ttl
+		self.entries = OrderedDict()
+		self.lock = Lock()
+
+		#Statistics
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.expirations = 0
+		self.invalidations = 0
+
+	## Returns a copy of the cached meta of event_node, None if not cached
+	def get(self, event_node):
+		with self.lock:
+			entry = self.entries.pop(event_node, None)
+			if entry is None:
+				self.misses += 1
+				return None
+			value, expires_at = entry
+			if self.ttl and monotonic() >= expires_at:
+				self.expirations += 1
+				self.misses += 1
+				return None
+			#Reinserted to mark it as the most recently used
+			self.entries[event_node] = entry
+			self.hits += 1
+		return deepcopy(value)
+
+	## Stores the meta of event_node
+	def put(self, event_node, value):
+		if not self.capacity:
+			return
+		value = deepcopy(value)
+		with self.lock:
+			self.entries.pop(event_node, None)
+			self.entries[event_node] = (value, monotonic() + self.ttl)
+			while len(self.entries) > self.capacity:
+				self.entries.popitem(last=False)
+				self.evictions += 1
+
+	## Removes the meta of event_node, it is fetched again on the next query
+	def invalidate(self, event_node):
+		with self.lock:
+			if self.entries.pop(event_node, None) is not None:
+				self.invalidations += 1
+
+	## Removes every entry
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+
+	## Returns the hit and miss counters of the cache
+	def stats(self):
+		with self.lock:
+			return {"size": len(self.entries),
+				"hits": self.hits,
+				"misses": self.misses,
+				"evictions": self.evictions,
+				"expirations": self.expirations,
+				"invalidations": self.invalidations}
@@ -0,0 +1,159 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+################################################################################
+## @package mio_catalog
+#  Mortar IO (MIO) Python2 Library
+#  On-disk catalog of the device nodes found by scanning the tree.
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+import json
+import re
+import sqlite3
+from datetime import datetime
+from itertools import groupby
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (uuid TEXT PRIMARY KEY, type TEXT);
+CREATE INDEX IF NOT EXISTS devices_type ON devices (type);
+CREATE TABLE IF NOT EXISTS paths (uuid TEXT NOT NULL, position INTEGER NOT NULL,
+	path TEXT NOT NULL, PRIMARY KEY (uuid, position));
+CREATE INDEX IF NOT EXISTS paths_path ON paths (path);
+CREATE TABLE IF NOT EXISTS nodes (node TEXT PRIMARY KEY, state TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+## SQLite catalog of devices keyed by uuid
+#
+#  Devices are stored with the same fields as the entries returned by a scan of
+#  the tree, {"node", "pathList", "tags": {"type"}}, and are read one at a time
+#  as they are needed. They can be selected by path prefix and by type, both
+#  are indexed. The catalog also keeps the node state used to refresh the scan
+#  incrementally. A scan replaces the whole content in one transaction, readers
+#  see either the previous or the new scan. For compatibility with the former
+#  dictionary the catalog supports len, in, [uuid], get and values. A catalog
+#  must be used from the thread that opened it.
+class DeviceCatalog():
+
+	## The constructor.
+	def __init__(self, path):
+		self.path = path
+		self.connection = sqlite3.connect(path)
+		self.connection.text_factory = str
+		#Paths are compared case sensitively, as they are on the server
+		self.connection.execute("PRAGMA case_sensitive_like = ON")
+		self.connection.executescript(_SCHEMA)
+
+	## Closes the database
+	def close(self):
+		self.connection.close()
+
+	## Returns True once a scan has been stored
+	def exists(self):
+		return self._info("scanned") is not None
+
+	## Returns the local ISO timestamp of the stored scan, None if there is none
+	def scanned_at(self):
+		return self._info("scanned")
+
+	def _info(self, key):
+		row = self.connection.execute("SELECT value FROM info WHERE key = ?",
+			(key,)).fetchone()
+		return row[0] if row else None
+
+	## Replaces the content of the catalog with the result of a scan
+	#  devices is a dictionary of uuid to device, nodes a dictionary of node
+	#  uuid to the state kept for incremental refreshes.
+	def replace(self, devices, nodes):
+		with self.connection:
+			self.connection.execute("DELETE FROM devices")
+			self.connection.execute("DELETE FROM paths")
+			self.connection.execute("DELETE FROM nodes")
+			self.connection.executemany("INSERT INTO devices VALUES (?, ?)",
+				((uuid, device["tags"].get("type"))
+					for uuid, device in devices.iteritems()))
+			self.connection.executemany("INSERT INTO paths VALUES (?, ?, ?)",
+				((uuid, position, path) for uuid, device in devices.iteritems()
+					for position, path in enumerate(device["pathList"])))
+			self.connection.executemany("INSERT INTO nodes VALUES (?, ?)",
+				((node, json.dumps(state)) for node, state in nodes.iteritems()))
+			self.connection.execute("INSERT OR REPLACE INTO info VALUES (?, ?)",
+				("scanned", datetime.now().isoformat()))
+
+	## Returns the device with uuid, None if it is not in the catalog
+	def get(self, uuid, default=None):
+		devices = list(self._select("d.uuid = ?", (uuid,)))
+		return devices[0] if devices else default
+
+	## Returns the devices, optionally only the ones with a path under
+	#  path_prefix and of type device_type
+	#  path_prefix matches whole path components, "B1" selects "B1" and
+	#  "B1/Room" but not "B10". Devices are read from the database while the
+	#  generator is consumed.
+	def iter_devices(self, path_prefix=None, device_type=None):
+		conditions = list()
+		arguments = list()
+		if path_prefix:
+			path_prefix = path_prefix.rstrip("/")
+			conditions.append("d.uuid IN (SELECT uuid FROM paths"
+				" WHERE path = ? OR path LIKE ? || '/%' ESCAPE '\\')")
+			arguments.extend((path_prefix,
+				re.sub(r"([%_\\])", r"\\\1", path_prefix)))
+		if device_type is not None:
+			conditions.append("d.type = ?")
+			arguments.append(device_type)
+		return self._select(" AND ".join(conditions) or "1", arguments)
+
+	def _select(self, condition, arguments):
+		rows = self.connection.execute("SELECT d.uuid, d.type, p.path"
+			" FROM devices d JOIN paths p ON p.uuid = d.uuid"
+			" WHERE " + condition + " ORDER BY d.uuid, p.position", arguments)
+		for (uuid, device_type), group in groupby(rows, lambda row: row[:2]):
+			yield {"node": uuid,
+				"pathList": [row[2] for row in group],
+				"tags": {"type": device_type}}
+
+	## Returns the uuids of the devices
+	def uuids(self):
+		for row in self.connection.execute("SELECT uuid FROM devices"):
+			yield row[0]
+
+	## Returns the node state of the stored scan, see mio_tree.ScanContext
+	def node_states(self):
+		return dict((node, json.loads(state)) for node, state in
+			self.connection.execute("SELECT node, state FROM nodes"))
+
+	def values(self):
+		return self.iter_devices()
+
+	def __iter__(self):
+		return self.uuids()
+
+	def __len__(self):
+		return self.connection.execute("SELECT COUNT(*) FROM devices").fetchone()[0]
+
+	def __contains__(self, uuid):
+		return self.connection.execute("SELECT 1 FROM devices WHERE uuid = ?",
+			(uuid,)).fetchone() is not None
+
+	def __getitem__(self, uuid):
+		device = self.get(uuid)
+		if device is None:
+			raise KeyError(uuid)
+		return device
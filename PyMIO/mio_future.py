@@ -0,0 +1,238 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+################################################################################
+## @package mio_future
+#  Mortar IO (MIO) Python2 Library
+#  Futures for IQs that are sent without waiting for their reply.
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+import logging
+from collections import deque
+from copy import copy
+from threading import Condition, Event, Lock
+
+from sleekxmpp.exceptions import IqTimeout
+
+## Result of an IQ that is still outstanding
+#
+#  The future is completed once, with either a result or an exception. Done
+#  callbacks run on the thread that completes it, usually the SleekXMPP event
+#  thread, so they must not block waiting for other futures.
+class IqFuture():
+
+	## The constructor.
+	def __init__(self):
+		self._done = Event()
+		self._lock = Lock()
+		self._result = None
+		self._exception = None
+		self._callbacks = list()
+
+	## Returns True once the future has a result or an exception
+	def done(self):
+		return self._done.is_set()
+
+	## Completes the future with a result
+	#  Returns False if the future was already completed
+	def set_result(self, result):
+		return self._complete(result, None)
+
+	## Completes the future with an exception
+	#  Returns False if the future was already completed
+	def set_exception(self, exception):
+		return self._complete(None, exception)
+
+	def _complete(self, result, exception):
+		with self._lock:
+			if self._done.is_set():
+				return False
+			self._result = result
+			self._exception = exception
+			self._done.set()
+			callbacks = self._callbacks
+			self._callbacks = list()
+
+		for callback in callbacks:
+			self._run_callback(callback)
+		return True
+
+	def _run_callback(self, callback):
+		try:
+			callback(self)
+		except Exception:
+			logging.exception("IqFuture: done callback failed")
+
+	## Calls callback with this future once it is completed
+	#  The callback runs immediately if the future is already completed.
+	def add_done_callback(self, callback):
+		with self._lock:
+			if not self._done.is_set():
+				self._callbacks.append(callback)
+				return
+		self._run_callback(callback)
+
+	## Waits for the future and returns its result
+	#  Raises the exception of the future, or IqTimeout if timeout expires first.
+	def result(self, timeout=None):
+		if not self._done.wait(timeout):
+			raise IqTimeout(None)
+		if self._exception is not None:
+			raise self._exception
+		return self._result
+
+	## Waits for the future and returns its exception, None if it succeeded
+	def exception(self, timeout=None):
+		if not self._done.wait(timeout):
+			raise IqTimeout(None)
+		return self._exception
+
+	## Returns a new future completed with function(result)
+	#  Exceptions of this future, or raised by function, are passed on.
+	def then(self, function):
+		chained = IqFuture()
+
+		def on_done(future):
+			if future._exception is not None:
+				chained.set_exception(future._exception)
+				return
+			try:
+				chained.set_result(function(future._result))
+			except Exception as e:
+				chained.set_exception(e)
+
+		self.add_done_callback(on_done)
+		return chained
+
+
+## Waits for all the futures of a dictionary and returns their results
+#  Futures that fail are logged and replaced by default.
+def wait_all(futures, default=None, timeout=None):
+	results = dict()
+	for key, future in futures.items():
+		try:
+			results[key] = future.result(timeout)
+		except Exception as e:
+			logging.error("Request for %s failed: %s" % (key, repr(e)))
+			results[key] = copy(default)
+	return results
+
+
+## Returns a future of the list of results of several futures
+#  It fails with the first exception of the futures once all of them are done,
+#  or with return_exceptions=True gets the exceptions in the list instead.
+def gather(futures, return_exceptions=False):
+	gathered = IqFuture()
+	remaining = [len(futures)]
+	lock = Lock()
+
+	def on_done(done):
+		with lock:
+			remaining[0] -= 1
+			if remaining[0]:
+				return
+		if not return_exceptions:
+			for future in futures:
+				if future._exception is not None:
+					gathered.set_exception(future._exception)
+					return
+		gathered.set_result([future._exception if future._exception is not None
+			else future._result for future in futures])
+
+	if not futures:
+		gathered.set_result(list())
+	for future in futures:
+		future.add_done_callback(on_done)
+	return gathered
+
+
+## Limits the number of IQs outstanding on a stream
+#
+#  Requests over the limit wait in a FIFO and are started as earlier ones
+#  complete. A limit of zero means unbounded. When max_waiting requests are
+#  already waiting, submit blocks the caller if asked to.
+class IqWindow():
+
+	## The constructor.
+	def __init__(self, limit=0, max_waiting=0):
+		self.limit = limit
+		self.max_waiting = max_waiting
+		self.pending = deque()
+		self.lock = Lock()
+		self.not_full = Condition(self.lock)
+		self.running = 0
+		self.starting = False
+
+		#Statistics
+		self.submitted = 0
+		self.high_watermark = 0
+
+	## Queues start to be called with a new IqFuture when a slot is free
+	#  start must send the IQ without blocking and complete the future when the
+	#  reply arrives. With wait=True the caller blocks while max_waiting requests
+	#  are waiting, it must not be the thread that processes the replies.
+	#  Returns the future.
+	def submit(self, start, wait=False):
+		future = IqFuture()
+		future.add_done_callback(self._release)
+		with self.lock:
+			while wait and self.max_waiting and len(self.pending) >= self.max_waiting:
+				self.not_full.wait()
+			self.pending.append((start, future))
+			self.submitted += 1
+		self._start_pending()
+		return future
+
+	def _release(self, future):
+		with self.lock:
+			self.running -= 1
+		self._start_pending()
+
+	## Starts pending requests while there are free slots
+	#  Only one thread runs the loop at a time, a request that fails while being
+	#  started releases its slot without recursing into the loop.
+	def _start_pending(self):
+		with self.lock:
+			if self.starting:
+				return
+			self.starting = True
+
+		while True:
+			with self.lock:
+				if not self.pending or (self.limit and self.running >= self.limit):
+					self.starting = False
+					return
+				start, future = self.pending.popleft()
+				self.not_full.notify()
+				self.running += 1
+				if self.running > self.high_watermark:
+					self.high_watermark = self.running
+
+			try:
+				start(future)
+			except Exception as e:
+				future.set_exception(e)
+
+	## Returns the number of outstanding and waiting requests
+	def stats(self):
+		with self.lock:
+			return {"outstanding": self.running,
+				"waiting": len(self.pending),
+				"submitted": self.submitted,
+				"high_watermark": self.high_watermark}
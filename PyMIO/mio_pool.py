@@ -0,0 +1,178 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+################################################################################
+## @package mio_pool
+#  Mortar IO (MIO) Python2 Library
+#  Pool of XMPP sessions used by one MIO instance.
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+import os
+from socket import gethostname
+from threading import Event, Lock
+from zlib import crc32
+
+from sleekxmpp import ClientXMPP
+
+from mio_types import monotonic
+
+## One authenticated XMPP stream of the pool
+class XmppSession():
+
+	## The constructor.
+	def __init__(self, index, jid, password):
+		self.index = index
+		self.jid = jid
+		self.connected = False
+		self.started = False
+		self.started_event = Event()
+		self.iqs = 0
+		#Cleared when the server of this connection rejects publish requests
+		#with several items
+		self.batch_publish = True
+
+		self.client = ClientXMPP(jid, password)
+		self.client.register_plugin('xep_0030')
+		self.client.register_plugin('xep_0059')
+		self.client.register_plugin('xep_0060')
+		self.client.ssl=False
+
+	## Returns the queue depths and counters of the session
+	def stats(self):
+		return {"jid": self.jid,
+			"connected": self.connected,
+			"send_queue": self.client.send_queue.qsize(),
+			"event_queue": self.client.event_queue.qsize(),
+			"iqs": self.iqs}
+
+
+## Spreads the requests of event nodes over several XMPP sessions
+#
+#  Every event node has a home session chosen by hashing its name, so the
+#  requests of a node are sent in order on one stream. While the home session
+#  is disconnected the node fails over to the next connected session.
+#  accounts is a list of (jid, password). Every session gets its own resource,
+#  which stays the same across reconnections so that full JID subscriptions,
+#  made by several sessions or by the shards of a bridge, keep being delivered.
+class SessionPool():
+
+	## The constructor.
+	def __init__(self, accounts):
+		self.sessions = list()
+		for index, (jid, password) in enumerate(accounts):
+			if "/" not in jid:
+				jid = "%s/mio-%s-%d-%d" % (jid, gethostname(), os.getpid(), index)
+			self.sessions.append(XmppSession(index, jid, password))
+		self.lock = Lock()
+
+		#Client used for the subscription of every event node, and whether the
+		#subscription was asked for the bare JID
+		self.subscribed = dict()
+		self.bare = dict()
+
+	## Returns the number of sessions
+	def size(self):
+		return len(self.sessions)
+
+	## Returns the session that always handles event_node when it is connected
+	def home(self, event_node):
+		if event_node is None or len(self.sessions) == 1:
+			return self.sessions[0]
+		return self.sessions[(crc32(str(event_node)) & 0xffffffff) % len(self.sessions)]
+
+	## Returns the session to use for a request about event_node
+	#  The home session, or the next connected one when it is down. If no
+	#  session is connected the home session is returned and the request fails
+	#  as it would with a single session.
+	def session_for(self, event_node):
+		session = self.current(event_node)
+		with self.lock:
+			session.iqs += 1
+		return session
+
+	## Returns the session session_for would return, without counting a request
+	def current(self, event_node):
+		home = self.home(event_node)
+		for offset in range(len(self.sessions)):
+			candidate = self.sessions[(home.index + offset) % len(self.sessions)]
+			if candidate.connected:
+				return candidate
+		return home
+
+	## Returns the session of a SleekXMPP client, None if it is not in the pool
+	def session_of(self, client):
+		for session in self.sessions:
+			if session.client is client:
+				return session
+		return None
+
+	## Returns the SleekXMPP client to use for a request about event_node
+	def client_for(self, event_node):
+		return self.session_for(event_node).client
+
+	## Returns True if at least one session is connected
+	def any_connected(self):
+		return any(session.connected for session in self.sessions)
+
+	## Waits until every session has been established
+	#  Returns False if timeout expires first
+	def wait_started(self, timeout=None):
+		deadline = monotonic() + timeout if timeout is not None else None
+		for session in self.sessions:
+			remaining = deadline - monotonic() if deadline is not None else None
+			if remaining is not None and remaining <= 0:
+				return session.started_event.is_set()
+			if not session.started_event.wait(remaining):
+				return False
+		return True
+
+	## Remembers that event_node is subscribed with client
+	#  bare is the bare argument the subscription was asked with, used again
+	#  when it is made once more after a reconnection or a failover.
+	def set_subscribed(self, event_node, client, bare=True):
+		with self.lock:
+			self.subscribed[event_node] = client
+			self.bare[event_node] = bare
+
+	## Forgets the subscription of event_node
+	def clear_subscribed(self, event_node):
+		with self.lock:
+			self.subscribed.pop(event_node, None)
+			self.bare.pop(event_node, None)
+
+	## Returns the bare argument event_node was subscribed with
+	def subscribed_bare(self, event_node):
+		with self.lock:
+			return self.bare.get(event_node, True)
+
+	## Returns the event nodes subscribed through the session
+	def subscribed_with(self, session):
+		with self.lock:
+			return [node for node, client in self.subscribed.items()
+				if client is session.client]
+
+	## Returns the event nodes of the session that are subscribed elsewhere
+	def displaced_from(self, session):
+		with self.lock:
+			return [node for node, client in self.subscribed.items()
+				if client is not session.client and self.home(node) is session]
+
+	## Returns the health of every session
+	def stats(self):
+		return [session.stats() for session in self.sessions]
@@ -0,0 +1,121 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+################################################################################
+## @package mio_queue
+#  Mortar IO (MIO) Python2 Library
+#  Bounded queue used to hand over received messages between threads.
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+from collections import deque
+from threading import Lock, Condition
+
+from mio_types import OverflowPolicy
+
+## Thread safe FIFO of (key, item) tuples with an optional maximum capacity
+#
+#  When the queue is full the OverflowPolicy decides what happens to a new item:
+#  - DROP_OLDEST: the oldest queued item is discarded
+#  - DROP_NEWEST: the new item is discarded
+#  - KEEP_LATEST: an older item with the same key is discarded, or the oldest
+#    item if there is none
+#  - BLOCK: the producer waits until the consumer drains the queue. If
+#    block_timeout expires first, the new item is discarded.
+class BoundedQueue():
+
+	## The constructor. A capacity of zero means unbounded.
+	def __init__(self, capacity=0, policy=OverflowPolicy.DROP_OLDEST,
+		block_timeout=None):
+		self.capacity = capacity
+		self.policy = policy
+		self.block_timeout = block_timeout
+
+		self.items = deque()
+		self.lock = Lock()
+		self.not_full = Condition(self.lock)
+
+		#Statistics
+		self.enqueued = 0
+		self.dropped = 0
+		self.blocked = 0
+		self.high_watermark = 0
+
+	## Adds an item to the queue
+	#  Returns False if the item was discarded because the queue is full
+	def put(self, key, item):
+		with self.lock:
+			if self.capacity and len(self.items) >= self.capacity:
+				if not self._make_room(key):
+					self.dropped += 1
+					return False
+
+			self.items.append((key, item))
+			self.enqueued += 1
+			if len(self.items) > self.high_watermark:
+				self.high_watermark = len(self.items)
+		return True
+
+	## Frees one slot according to the overflow policy, called with the lock held
+	#  Returns False if the new item has to be discarded instead
+	def _make_room(self, key):
+		if self.policy == OverflowPolicy.DROP_NEWEST:
+			return False
+
+		if self.policy == OverflowPolicy.BLOCK:
+			self.blocked += 1
+			if self.block_timeout is None:
+				while len(self.items) >= self.capacity:
+					self.not_full.wait()
+			else:
+				self.not_full.wait(self.block_timeout)
+			return len(self.items) < self.capacity
+
+		if self.policy == OverflowPolicy.KEEP_LATEST:
+			for index, (queued_key, queued_item) in enumerate(self.items):
+				if queued_key == key:
+					del self.items[index]
+					self.dropped += 1
+					return True
+
+		self.items.popleft()
+		self.dropped += 1
+		return True
+
+	## Removes and returns all queued (key, item) tuples in arrival order
+	def drain(self):
+		with self.lock:
+			ret_list = list(self.items)
+			self.items.clear()
+			self.not_full.notify_all()
+		return ret_list
+
+	## Number of items waiting in the queue
+	def depth(self):
+		return len(self.items)
+
+	## Returns the queue depth and the drop counters
+	def stats(self):
+		with self.lock:
+			return {"depth": len(self.items),
+				"capacity": self.capacity,
+				"policy": self.policy.value,
+				"enqueued": self.enqueued,
+				"dropped": self.dropped,
+				"blocked": self.blocked,
+				"high_watermark": self.high_watermark}
@@ -0,0 +1,212 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+################################################################################
+## @package mio_reconnect
+#  Mortar IO (MIO) Python2 Library
+#  Recovery of the XMPP sessions after the connection to the server is lost.
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+import logging
+import random
+from threading import Lock, Thread
+from time import sleep, time
+
+from mio_types import monotonic
+
+## Exponential backoff with jitter
+#
+#  The delay before attempt n is initial * factor ** n, capped at maximum, of
+#  which a random fraction of up to jitter is removed so that the clients that
+#  lost the same server do not all come back at the same time.
+class Backoff():
+
+	## The constructor.
+	def __init__(self, initial=1.0, maximum=30.0, factor=2.0, jitter=0.5):
+		self.initial = initial
+		self.maximum = maximum
+		self.factor = factor
+		self.jitter = jitter
+
+	## Returns the number of seconds to wait before attempt, starting at zero
+	def delay(self, attempt):
+		delay = min(self.initial * self.factor ** attempt, self.maximum)
+		return delay - random.uniform(0, delay * self.jitter)
+
+
+## Brings the subscriptions of a session back after it reconnects
+#
+#  SleekXMPP reconnects the stream on its own, with an exponential backoff and
+#  a random jitter, the manager caps the delay between two attempts at the
+#  maximum of its backoff. Once the session is established again the
+#  subscriptions the server still has are compared with the ones made through
+#  the session, the missing ones are made again concurrently and the latest
+#  items of the subscribed event nodes are fetched to fill the cache with the
+#  values published during the outage. The recovery is retried with the
+#  backoff until it succeeds or recovery_attempts are made, and its duration,
+#  from the disconnection to the end of the backfill, is recorded.
+class ReconnectManager():
+
+	## The constructor.
+	def __init__(self, mio, backoff=None, recovery_attempts=5):
+		self.mio = mio
+		self.backoff = backoff or Backoff()
+		self.recovery_attempts = recovery_attempts
+		self.lock = Lock()
+
+		#Monotonic time and epoch time of the disconnection of every session
+		#that is not recovered yet, by session index
+		self.outages = dict()
+
+		#Statistics
+		self.disconnections = 0
+		self.socket_errors = 0
+		self.connection_failures = 0
+		self.recovering = 0
+		self.recoveries = 0
+		self.failed_recoveries = 0
+		self.resubscribed = 0
+		self.backfilled = 0
+		self.last_recovery = 0.0
+		self.max_recovery = 0.0
+
+	## Sets the reconnection policy of the stream of a session
+	#  max_attempts is the number of reconnection attempts before SleekXMPP
+	#  gives up on the server, None for infinity.
+	def configure(self, session, max_attempts=None):
+		client = session.client
+		client.auto_reconnect = True
+		client.reconnect_max_delay = self.backoff.maximum
+		client.reconnect_max_attempts = max_attempts
+		client.add_event_handler("connection_failed",
+			lambda event: self.on_connection_failed(session))
+
+	## Routine executed when the stream of a session is lost
+	def on_disconnected(self, session):
+		if not self.mio.RUNNING:
+			return
+		with self.lock:
+			if session.index in self.outages:
+				return
+			self.outages[session.index] = (monotonic(), time())
+			self.disconnections += 1
+		logging.warning("Session %s lost, reconnecting" % session.jid)
+
+	## Routine executed when the socket of a session fails
+	def on_socket_error(self, session):
+		with self.lock:
+			self.socket_errors += 1
+
+	## Routine executed when SleekXMPP stops trying to reconnect a session
+	def on_connection_failed(self, session):
+		with self.lock:
+			self.connection_failures += 1
+		logging.error("Giving up reconnecting session %s" % session.jid)
+
+	## Routine executed when a session is established
+	#  The recovery of a session that was lost runs on its own thread, it waits
+	#  for replies that are processed by the SleekXMPP threads.
+	def on_session_start(self, session):
+		with self.lock:
+			outage = self.outages.pop(session.index, None)
+		if outage is None or not self.mio.RUNNING:
+			return
+		thread = Thread(target=self._recover, args=(session, outage),
+			name="MIO-recover-%d" % session.index)
+		thread.daemon = True
+		thread.start()
+
+	def _recover(self, session, outage):
+		disconnected_at, since = outage
+		with self.lock:
+			self.recovering += 1
+		try:
+			recovered = False
+			for attempt in range(self.recovery_attempts):
+				if not self.mio.RUNNING or not session.connected:
+					return
+				if self._recover_once(session, since):
+					recovered = True
+					break
+				sleep(self.backoff.delay(attempt))
+		except Exception:
+			logging.exception("Recovery of session %s failed" % session.jid)
+			recovered = False
+		finally:
+			with self.lock:
+				self.recovering -= 1
+
+		elapsed = monotonic() - disconnected_at
+		with self.lock:
+			if recovered:
+				self.recoveries += 1
+				self.last_recovery = elapsed
+				self.max_recovery = max(self.max_recovery, elapsed)
+			else:
+				self.failed_recoveries += 1
+		if recovered:
+			logging.warning("Session %s recovered in %.1f seconds" %
+				(session.jid, elapsed))
+		else:
+			logging.error("Could not recover the subscriptions of session %s" %
+				session.jid)
+
+	## Resubscribes the missing event nodes of the session and backfills them
+	#  Returns True if every request succeeded
+	def _recover_once(self, session, since):
+		pool = self.mio.pool
+		expected = set(pool.subscribed_with(session))
+		active = self.mio.active_subscriptions(session)
+		if active is None:
+			return False
+
+		missing = expected - active
+		if missing:
+			logging.warning("Session %s lost %d subscriptions, resubscribing" %
+				(session.jid, len(missing)))
+		#Shards subscribe with their full JID, each node is subscribed again the
+		#way it was first
+		subscribed = dict()
+		for bare in (True, False):
+			event_nodes = [node for node in missing if pool.subscribed_bare(node) == bare]
+			if event_nodes:
+				subscribed.update(self.mio.subscribe_many(event_nodes, bare))
+		resubscribed = [node for node, done in subscribed.items() if done]
+
+		backfilled, failed = self.mio.backfill(
+			expected | set(pool.displaced_from(session)), since)
+		with self.lock:
+			self.resubscribed += len(resubscribed)
+			self.backfilled += backfilled
+		return len(resubscribed) == len(missing) and not failed
+
+	## Returns the reconnection counters and recovery times in seconds
+	def stats(self):
+		with self.lock:
+			return {"disconnected": len(self.outages),
+				"disconnections": self.disconnections,
+				"socket_errors": self.socket_errors,
+				"connection_failures": self.connection_failures,
+				"recovering": self.recovering,
+				"recoveries": self.recoveries,
+				"failed_recoveries": self.failed_recoveries,
+				"resubscribed": self.resubscribed,
+				"backfilled": self.backfilled,
+				"last_recovery": self.last_recovery,
+				"max_recovery": self.max_recovery}
@@ -0,0 +1,137 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+################################################################################
+## @package mio_trace
+#  Mortar IO (MIO) Python2 Library
+#  Wire tracing of the stanzas sent and received by MIO.
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+import logging
+import random
+import signal
+from collections import deque
+from datetime import datetime
+from threading import Lock
+from xml.etree import ElementTree
+
+## Direction of a traced stanza
+SEND = "SEND"
+RECV = "RECV"
+
+## Keeps the last stanzas sent and received by MIO
+#
+#  Tracing is off by default. Callers check the enabled attribute before
+#  calling trace, so a disabled tracer costs a single attribute lookup and the
+#  stanza is never serialized. When enabled, only the stanzas of the selected
+#  nodes and operations are kept, optionally sampled, in a ring buffer of the
+#  last capacity stanzas. Every traced stanza is also logged at debug level.
+class WireTracer():
+
+	## The constructor.
+	def __init__(self, capacity=256):
+		self.enabled = False
+		self.nodes = None
+		self.operations = None
+		self.sample_rate = 1.0
+		self.buffer = deque(maxlen=capacity)
+		self.lock = Lock()
+
+		#Statistics
+		self.traced = 0
+		self.skipped = 0
+
+	## Starts tracing
+	#  nodes and operations are lists of the event nodes and MIO methods to
+	#  trace, None for all of them. sample_rate is the fraction of the matching
+	#  stanzas that are kept.
+	def enable(self, nodes=None, operations=None, sample_rate=1.0):
+		self.nodes = set(nodes) if nodes is not None else None
+		self.operations = set(operations) if operations is not None else None
+		self.sample_rate = sample_rate
+		self.enabled = True
+		logging.warning("WireTracer: tracing enabled")
+
+	## Stops tracing, the ring buffer is kept for dump
+	def disable(self):
+		self.enabled = False
+		logging.warning("WireTracer: tracing disabled")
+
+	## Switches tracing on or off
+	def toggle(self):
+		if self.enabled:
+			self.disable()
+		else:
+			self.enable(self.nodes, self.operations, self.sample_rate)
+
+	## Records a stanza sent or received by operation on event_node
+	#  stanza can be a SleekXMPP stanza, an ElementTree element or a string.
+	def trace(self, direction, operation, event_node, stanza):
+		if self.nodes is not None and event_node not in self.nodes:
+			return
+		if self.operations is not None and operation not in self.operations:
+			return
+		if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+			self.skipped += 1
+			return
+
+		if isinstance(stanza, basestring):
+			raw = stanza
+		elif hasattr(stanza, 'xml'):
+			raw = str(stanza)
+		else:
+			raw = ElementTree.tostring(stanza)
+
+		with self.lock:
+			self.buffer.append((datetime.now().isoformat(), direction,
+				operation, event_node, raw))
+			self.traced += 1
+		logging.debug("%s %s %s: %s" % (direction, operation, event_node, raw))
+
+	## Returns the traced stanzas, oldest first, as
+	#  (timestamp, direction, operation, event node, raw stanza) tuples
+	def entries(self):
+		with self.lock:
+			return list(self.buffer)
+
+	## Writes the traced stanzas to the log
+	def dump(self):
+		entries = self.entries()
+		logging.warning("WireTracer: dumping %d stanzas" % len(entries))
+		for entry in entries:
+			logging.warning("%s %s %s %s: %s" % entry)
+
+	## Returns the trace counters
+	def stats(self):
+		return {"enabled": self.enabled,
+			"traced": self.traced,
+			"skipped": self.skipped,
+			"buffered": len(self.buffer)}
+
+	## Lets operators control the tracer of a running process
+	#  toggle_signal switches tracing on and off, dump_signal writes the ring
+	#  buffer to the log. Must be called from the main thread.
+	def install_signal_handlers(self, toggle_signal=signal.SIGUSR1,
+		dump_signal=signal.SIGUSR2):
+		signal.signal(toggle_signal, lambda signum, frame: self.toggle())
+		signal.signal(dump_signal, lambda signum, frame: self.dump())
+
+
+## Tracer shared by all the MIO instances of the process
+TRACER = WireTracer()
@@ -34,12 +34,29 @@ import sys
 import logging
 import json
 import os
+import fcntl
+import hashlib
+from contextlib import contextmanager
+from threading import Lock
 import mio_meta_utils
 from mio import MIO
-from mio_types import MetaType, ReferenceType
+from mio_types import MetaType, ReferenceType, monotonic
+from mio_future import IqFuture, IqWindow
+from mio_catalog import DeviceCatalog
+
+from sleekxmpp.exceptions import IqError, IqTimeout
 
 #Constants
+CATALOG_FILE_NAME='mio_devices_tree.db'
+# Directory of the catalogs when none is given, MIO_CACHE_DIR overrides it
+CATALOG_DIR=os.environ.get('MIO_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'mio')
+# JSON cache file written by earlier versions next to this module, imported into the
+# catalog when found
 CACHE_FILE_NAME='mio_devices_tree.json'
+# Format of the cache file that kept the state of every node for incremental refreshes
+CACHE_FILE_VERSION=2
+# Number of reference and meta requests outstanding while scanning the tree
+SCAN_CONCURRENCY=64
 
 # This method replaces all white spaces with underscore in node.name and appends it to path.
 # So for path="root.Location" and node.name ="Floor 2", this method returns root.Location.Floor_2
@@ -50,80 +67,312 @@ def generate_path_name(path, node):
 		new_path = path+"/"+node["node"]
 	return new_path
 
-# A recursive function that iterates through the tree to find nodes with metaType = DEVICE
-# and adds them to the devices dictionary object. The pathList entry for each device contains
-# the path from root to the device node. 	
-				
-def get_device_nodes(mio, devices, parent_node, path): 
-	if parent_node == 'root':
-		return
-	
-	child_nodes = mio.reference_query(parent_node)
-        for child in child_nodes:
-		if not child["node"]:
-			continue
-		if child["type"] == ReferenceType.PARENT.value:
-			continue
-		newPath = generate_path_name(path, child)
-		if child["metaType"] == MetaType.LOCATION.value:
-			get_device_nodes(mio, devices, child["node"], newPath)
-                elif child["metaType"] == MetaType.DEVICE.value:					
-			uuid = child["node"]
-			if uuid not in devices:
-				node_meta = mio.meta_query(uuid)
-                                if not node_meta:
-                                        print "Child node " + uuid + "," + newPath + " does not have a meta. Skipping this node"
+# Adds the device nodes found under the roots to the devices dictionary object. roots is
+# a list of (node, path) tuples. The pathList entry for each device contains the paths
+# from root to the device node, in the order the walk finds them, shortest first.
+#
+# The tree is walked breadth-first: the references of all the nodes of a level, and the
+# meta of their children, are fetched concurrently with at most concurrency requests
+# outstanding, then the next level is built from the results.
+def get_device_nodes(mio, devices, parent_node, path, concurrency=SCAN_CONCURRENCY):
+	scan_devices(mio, devices, [(parent_node, path)], concurrency)
+
+# Returns the fingerprint of the children listed in a references item
+def references_fingerprint(ref_list):
+	return hashlib.sha1(json.dumps(ref_list, sort_keys=True)).hexdigest()
+
+# Returns the part of a resolved child reference used to walk the tree
+def child_record(child):
+	record = dict()
+	record["node"] = child["node"]
+	if "name" in child:
+		record["name"] = child["name"]
+	record["metaType"] = child["metaType"]
+	record["hasMeta"] = bool(child["meta"])
+	if child["metaType"] == MetaType.DEVICE.value and child["meta"]:
+		record["deviceType"] = mio_meta_utils.get_type_property_from_meta(child["meta"])
+	return record
+
+# Memoizes the reference and meta fetches of one scan by node uuid. Nodes reached through
+# several paths, and devices shared by several locations, are fetched only once.
+#
+# previous is the node state of an earlier scan, see nodes. When it is given the scan is
+# a refresh: the references of every node are fetched again, and the meta of the children
+# of a location or a device is only fetched again when the fingerprint of its references
+# changed. A location whose references can not be fetched keeps its
+# earlier children.
+#
+# changed holds the nodes whose meta changed since the earlier scan, see
+# MIO.take_meta_changes. The earlier state of these nodes, and of the nodes having one of
+# them as child, is not reused. Changes are only known for subscribed nodes, so nodes with
+# a child of unknown metaType are always resolved again.
+class ScanContext():
+
+	def __init__(self, mio, concurrency=SCAN_CONCURRENCY, previous=None, changed=()):
+		self.mio = mio
+		self.window = IqWindow(concurrency)
+		changed = set(changed)
+		self.previous = dict((node, state) for node, state in (previous or dict()).iteritems()
+			if node not in changed and not any(child["node"] in changed or
+				child["metaType"] not in (MetaType.DEVICE.value, MetaType.LOCATION.value)
+				for child in state["children"]))
+		self.stale = len(previous or dict()) - len(self.previous)
+		# Node uuid -> fingerprint, metaType and child records of every node walked
+		self.nodes = dict()
+		self.children = dict()
+		self.metas = dict()
+		self.lock = Lock()
+		self.reference_fetches = 0
+		self.meta_fetches = 0
+		self.saved = 0
+		self.unchanged = 0
+
+	# Returns an IqFuture of the child records of node, whose metaType is meta_type
+	def child_query(self, node, meta_type=None):
+		with self.lock:
+			future = self.children.get(node)
+			if future is not None:
+				self.saved += 1
+				return future
+			future = self.children[node] = IqFuture()
+			self.reference_fetches += 1
+
+		self.mio.get_item_async(node, "references", window=self.window).add_done_callback(
+			lambda reply: self._on_references(node, meta_type, reply, future))
+		return future
+
+	def _on_references(self, node, meta_type, reply, future):
+		previous = self.previous.get(node)
+		try:
+			ref_list = self.mio.references_to_list(reply.result())
+		except IqError as e:
+			if str(e.condition) != "item-not-found":
+				logging.error("Error querying reference from event node %s" % node)
+				if previous is not None:
+					return self._set_node(node, previous, future)
+			ref_list = list()
+		except IqTimeout:
+			logging.error("Timeout querying reference from event node %s" % node)
+			if previous is not None:
+				return self._set_node(node, previous, future)
+			ref_list = list()
+		except Exception as e:
+			return future.set_exception(e)
+
+		ref_list = [ref for ref in ref_list if ref.get("node") and
+			ref.get("type") != ReferenceType.PARENT.value]
+		fingerprint = references_fingerprint(ref_list)
+		if previous is not None and previous["fingerprint"] == fingerprint:
+			with self.lock:
+				self.unchanged += 1
+			return self._set_node(node, dict(previous, metaType=meta_type), future)
+
+		def on_types(resolved):
+			try:
+				records = [child_record(child) for child in resolved.result()]
+			except Exception as e:
+				return future.set_exception(e)
+			self._set_node(node, {"fingerprint": fingerprint, "metaType": meta_type,
+				"children": records}, future)
+
+		self.mio.resolve_reference_types_async(ref_list, self.window,
+			self.meta_query).add_done_callback(on_types)
+
+	def _set_node(self, node, state, future):
+		with self.lock:
+			self.nodes[node] = state
+		future.set_result(state["children"])
+
+	# Returns an IqFuture of the meta of node. Called from the SleekXMPP threads.
+	def meta_query(self, node):
+		with self.lock:
+			future = self.metas.get(node)
+			if future is not None:
+				self.saved += 1
+				return future
+			self.meta_fetches += 1
+			future = self.metas[node] = self.mio.meta_query_async(node, window=self.window)
+		return future
+
+	def stats(self):
+		with self.lock:
+			return {"reference_fetches": self.reference_fetches,
+				"meta_fetches": self.meta_fetches,
+				"saved": self.saved,
+				"unchanged": self.unchanged,
+				"stale": self.stale}
+
+def scan_devices(mio, devices, roots, concurrency=SCAN_CONCURRENCY, previous=None, changed=()):
+	context = ScanContext(mio, concurrency, previous, changed)
+	for device in walk_devices(context, devices, roots):
+		pass
+	return context
+
+# Walks the tree from roots with context, adding the devices found to devices. Generator of
+# every device, as {"node", "pathList", "tags"} with the path where it was first found, yielded
+# as soon as its parent is resolved while the walk goes on. That path stays the first of
+# its pathList, which is complete once the generator is exhausted.
+def walk_devices(context, devices, roots):
+	# Entries are (node, path, ancestors, metaType)
+	level = [(node, path, (node,), None) for node, path in roots if node != 'root']
+	started = monotonic()
+	scanned = 0
+	depth = 0
+
+	while level:
+		futures = dict((node, context.child_query(node, meta_type))
+			for node, path, ancestors, meta_type in level)
+
+		next_level = list()
+		for parent_node, path, ancestors, meta_type in level:
+			child_nodes = futures[parent_node].result()
+			scanned += 1
+			for child in child_nodes:
+				if child["node"] in ancestors:
+					# A reference back to a node of the path would be walked forever
 					continue
-				
-				devices[uuid] = dict()
-				devices[uuid]["node"] = uuid
-				devices[uuid]["pathList"] = list()
-				devices[uuid]["tags"] = dict()
-				devices[uuid]["tags"]["type"] = mio_meta_utils.get_type_property_from_meta(node_meta)
-
-			devices[uuid]["pathList"].append(newPath)
-			get_device_nodes(mio, devices, child["node"], newPath)
-		else:
-			# metaType is UNKNOWN, checking if there is a transducer definition in meta 
-			node_meta = mio.meta_query(child["node"])
-			if len(node_meta) == 0:
-				print "Node " + child["node"]+ "," + newPath + " has unknown metaType and has no meta. Skipping this node"
-			else:
-				print node_meta	#TODO: read meta 
-			get_device_nodes(mio, devices, child["node"], newPath)
+				newPath = generate_path_name(path, child)
+				child_entry = (child["node"], newPath, ancestors + (child["node"],),
+					child["metaType"])
+				if child["metaType"] == MetaType.DEVICE.value:
+					uuid = child["node"]
+					if uuid not in devices:
+						if not child["hasMeta"]:
+							print "Child node " + uuid + "," + newPath + " does not have a meta. Skipping this node"
+							continue
+
+						devices[uuid] = dict()
+						devices[uuid]["node"] = uuid
+						devices[uuid]["pathList"] = list()
+						devices[uuid]["tags"] = dict()
+						devices[uuid]["tags"]["type"] = child["deviceType"]
+						yield {"node": uuid, "pathList": [newPath],
+							"tags": dict(devices[uuid]["tags"])}
+
+					devices[uuid]["pathList"].append(newPath)
+				elif child["metaType"] != MetaType.LOCATION.value:
+					# metaType is UNKNOWN, its children are walked anyway
+					if not child["hasMeta"]:
+						print "Node " + child["node"]+ "," + newPath + " has unknown metaType and has no meta. Skipping this node"
+					else:
+						print "Node " + child["node"]+ "," + newPath + " has unknown metaType"	#TODO: read meta
+				next_level.append(child_entry)
+
+		depth += 1
+		elapsed = max(monotonic() - started, 1e-6)
+		print "Scanned level %d: %d nodes, %d devices, %.0f nodes/s" % (depth,
+			scanned, len(devices), scanned / elapsed)
+		level = next_level
+
+	stats = context.stats()
+	print "Scan fetched the references of %d nodes and the meta of %d nodes, %d fetches saved, %d nodes unchanged, %d nodes stale" % (
+		stats["reference_fetches"], stats["meta_fetches"], stats["saved"],
+		stats["unchanged"], stats["stale"])
 
 def scan_root(mio):
-    scan_node(mio,"root","") 
+    return scan_node(mio,"root","")
 
-def scan_node(mio, uuid, path):
-    cache_exists = False
-    cache_file = uuid+"_"+CACHE_FILE_NAME
-    cache_file_path = os.path.dirname(os.path.abspath(__file__)) +"/"+cache_file
-    try:
-        with open(cache_file_path,'r') as cache_file:
-            devices = json.load(cache_file)
-            print "Returning devices data from cache file " + CACHE_FILE_NAME + ". To rescan tree, delete the cache file and run the script again."
-            cache_exists = True
-    except IOError:
-        print "Could not find cache file. Scanning tree. This will take a while ~ 15-20 minutes.."
-
-    if cache_exists:
-        return devices
+# Returns the DeviceCatalog of the devices under the node uuid, stored in a SQLite file
+# of cache_dir, CATALOG_DIR by default. The tree is only scanned when the catalog is empty. With
+# refresh=True the tree is walked again and the catalog replaced, only the nodes
+# whose references changed since the stored scan and the new nodes are resolved again.
+# The catalog must be used from the calling thread and closed once done.
+def scan_node(mio, uuid, path, concurrency=SCAN_CONCURRENCY, refresh=False, cache_dir=None):
+    with catalog_lock(uuid, cache_dir) as catalog_path:
+        catalog = DeviceCatalog(catalog_path)
+        try:
+            for device in _scan_node(mio, uuid, path, catalog, concurrency, refresh, False):
+                pass
+        except:
+            catalog.close()
+            raise
+        return catalog
+
+# Generator of the devices under the node uuid, yielded while the tree is walked as
+# walk_devices does, so the caller can use every device as soon as it is found. When the
+# catalog holds a scan and refresh is False its devices are yielded instead. The catalog is
+# replaced once the walk is over, read it with scan_node for the complete pathLists.
+def iter_devices(mio, uuid, path, concurrency=SCAN_CONCURRENCY, refresh=False, cache_dir=None):
+    with catalog_lock(uuid, cache_dir) as catalog_path:
+        catalog = DeviceCatalog(catalog_path)
+        try:
+            for device in _scan_node(mio, uuid, path, catalog, concurrency, refresh):
+                yield device
+        finally:
+            catalog.close()
+
+# Several bridge processes may start at the same time. Only one of them scans the
+# tree, the others wait for it and then read the catalog. Yields the catalog path.
+@contextmanager
+def catalog_lock(uuid, cache_dir=None):
+    cache_dir = cache_dir or CATALOG_DIR
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # Created meanwhile by another process
+            if not os.path.isdir(cache_dir):
+                raise
+    catalog_path = os.path.join(cache_dir, uuid+"_"+CATALOG_FILE_NAME)
+    with open(catalog_path+".lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield catalog_path
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+# Returns the devices and the node state stored in a cache file. Files written before the
+# node state was kept only hold the devices.
+def read_cache_file(cache_file_path):
+    with open(cache_file_path,'r') as cache_file:
+        cached = json.load(cache_file)
+    if cached.get("version") != CACHE_FILE_VERSION:
+        return cached, None
+    return cached["devices"], cached["nodes"]
+
+# Generator of the devices found by the walk, and of the stored ones when the catalog is
+# returned as it is and stored is True
+def _scan_node(mio, uuid, path, catalog, concurrency, refresh, stored=True):
+    exists = catalog.exists()
+    if not exists:
+        cache_file_path = os.path.dirname(os.path.abspath(__file__))+"/"+uuid+"_"+CACHE_FILE_NAME
+        try:
+            devices, nodes = read_cache_file(cache_file_path)
+            catalog.replace(devices, nodes or dict())
+            print "Imported cache file " + cache_file_path + " into " + catalog.path
+            exists = True
+        except IOError:
+            print "Could not find device catalog. Scanning tree.."
+
+    if exists and not refresh:
+        print "Returning devices data from catalog " + catalog.path + ". To rescan tree, delete the catalog and run the script again."
+        if stored:
+            for device in catalog.iter_devices():
+                yield device
+        return
+
+    if exists:
+        print "Refreshing devices data of catalog " + catalog.path
+    if uuid == "root":
+        root_refs = mio.reference_query("root")
+        for child in root_refs:
+            if child["name"] == "Location" :
+                location_node = child["node"]
+            if child["name"] == "Gateways" :
+                gateway_node = child["node"]
+        roots = [(location_node, "root.Location"), (gateway_node, "root.Gateways")]
     else:
-        devices = dict()
-        if uuid == "root":
-            root_refs = mio.reference_query("root")
-            for child in root_refs:
-                if child["name"] == "Location" :
-                    location_node = child["node"]
-                if child["name"] == "Gateways" :
-                    gateway_node = child["node"]
-            get_device_nodes(mio, devices, location_node,"root.Location")	
-            get_device_nodes(mio, devices, gateway_node,"root.Gateways")
-        else:
-            get_device_nodes(mio, devices, uuid, path)
-		# Cache the tree to a file
-        devices_json = json.dumps(devices, indent = 3)
-        with open(cache_file_path, 'w') as cache_file:
-            print >> cache_file, devices_json
-        return devices
+        roots = [(uuid, path)]
+    devices = dict()
+    # Meta changes not handled by a completed walk are given back to the next refresh
+    changed = mio.take_meta_changes()
+    replaced = False
+    try:
+        context = ScanContext(mio, concurrency, catalog.node_states(), changed)
+        for device in walk_devices(context, devices, roots):
+            yield device
+        catalog.replace(devices, context.nodes)
+        replaced = True
+    finally:
+        if not replaced:
+            mio.restore_meta_changes(changed)
@@ -23,8 +23,42 @@
 #  Artur Balanuta 		artur[dot]balanuta[at]tecnico[dot]pt
 ################################################################################
 
+import os
+import re
+import sys
+from calendar import timegm
+from datetime import datetime
+from time import mktime
+
 from enum import Enum
 
+try:
+	from time import monotonic
+except ImportError:
+	#Python 2 has no monotonic clock in time, CLOCK_MONOTONIC is read through
+	#ctypes. time.time would jump with the wall clock.
+	import ctypes
+	import ctypes.util
+
+	class _Timespec(ctypes.Structure):
+		_fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+	_librt = ctypes.CDLL(ctypes.util.find_library("rt") or
+		ctypes.util.find_library("c"), use_errno=True)
+	_clock_gettime = _librt.clock_gettime
+	_clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+	_CLOCK_MONOTONIC = 6 if sys.platform == "darwin" else 1
+
+	## Returns the seconds elapsed on a clock that never goes backwards
+	#  Only differences between two values are meaningful. Every module uses
+	#  this function to stamp and measure times.
+	def monotonic():
+		timespec = _Timespec()
+		if _clock_gettime(_CLOCK_MONOTONIC, ctypes.byref(timespec)) != 0:
+			errno = ctypes.get_errno()
+			raise OSError(errno, os.strerror(errno))
+		return timespec.tv_sec + timespec.tv_nsec * 1e-9
+
 ## Enum class used to describe Meta Types
 class MetaType(Enum):
 
@@ -126,3 +160,131 @@ class AffiliationType(Enum):
 	PUBLISH_ONLY	= "publish_only"
 	OUTCAST			= "outcast"
 	UKNOWN 			= "unknown"
+
+## Enum class used to describe what a bounded queue does when it is full
+class OverflowPolicy(Enum):
+
+	DROP_OLDEST		= "drop_oldest"
+	DROP_NEWEST		= "drop_newest"
+	KEEP_LATEST		= "keep_latest"
+	BLOCK			= "block"
+
+## Returns a float for the text of a plain number, the text otherwise
+#  Only numbers that format back to the same text are converted, so that
+#  format_number(parse_number(text)) always gives back the published text.
+def parse_number(text):
+	try:
+		number = float(text)
+	except (TypeError, ValueError):
+		return text
+	if format_number(number) != text:
+		return text
+	return number
+
+## Returns the text of a value parsed by parse_number
+def format_number(value):
+	if not isinstance(value, float):
+		return value
+	if value.is_integer() and abs(value) < 1e16:
+		return "%d" % value
+	return repr(value)
+
+_ISO_TIMESTAMP = re.compile(
+	r"^(\d{4}-\d{2}-\d{2})[T ](\d{2}:\d{2}:\d{2})(\.\d+)?(Z|[+-]\d{2}:?\d{2})?$")
+
+## Returns the seconds since the epoch of an ISO 8601 timestamp
+#  Timestamps without an offset are in local time, like the ones published by
+#  MIO. Returns None if text is not a timestamp.
+def parse_timestamp(text):
+	match = _ISO_TIMESTAMP.match(text or "")
+	if match is None:
+		return None
+	date, time_of_day, fraction, offset = match.groups()
+	try:
+		parsed = datetime.strptime(date+"T"+time_of_day, "%Y-%m-%dT%H:%M:%S")
+	except ValueError:
+		return None
+	seconds = float(fraction) if fraction else 0.0
+
+	if offset is None:
+		return mktime(parsed.timetuple()) + seconds
+	if offset == "Z":
+		shift = 0
+	else:
+		shift = int(offset[1:3]) * 3600 + int(offset[-2:]) * 60
+		if offset[0] == "-":
+			shift = -shift
+	return timegm(parsed.timetuple()) - shift + seconds
+
+## Returns the local ISO 8601 timestamp of seconds since the epoch
+def format_timestamp(seconds):
+	if seconds is None:
+		return None
+	return datetime.fromtimestamp(seconds).isoformat()
+
+#Attributes of a transducerData element parsed by TransducerSample
+_SAMPLE_ATTRIBUTES = frozenset(('name', 'value', 'raw_value', 'timestamp'))
+
+## Transducer value received from a subscription
+#
+#  Parsed once when it is received. value is a float when the published text
+#  is a plain number and the text otherwise, raw_value is kept as published
+#  and timestamp is in seconds since the epoch, None if it is missing or not a
+#  timestamp. The published timestamp text is kept as well, with its UTC
+#  offset, so that the sample is passed on unchanged. received_at is the monotonic time at which the sample was added
+#  to the cache. The names of nodes and transducers are interned, so queued
+#  samples share them. Other published attributes, such as the ones of a meta
+#  item, are kept as they are in attributes.
+class TransducerSample(object):
+
+	__slots__ = ('node', 'name', 'value', 'raw_value', 'timestamp',
+		'timestamp_text', 'received_at', 'attributes')
+
+	## The constructor.
+	#  timestamp_text defaults to the local ISO 8601 text of timestamp
+	def __init__(self, node, name, value, raw_value=None, timestamp=None,
+		timestamp_text=None, attributes=None):
+		self.node = node
+		self.attributes = attributes
+		self.name = name
+		self.value = value
+		self.raw_value = raw_value
+		self.timestamp = timestamp
+		self.timestamp_text = timestamp_text
+		if timestamp_text is None:
+			self.timestamp_text = format_timestamp(timestamp)
+		self.received_at = monotonic()
+
+	## Builds a sample of node from a transducerData element
+	@classmethod
+	def from_element(cls, node, element):
+		name = element.get('name')
+		if isinstance(name, str):
+			name = intern(name)
+		if isinstance(node, str):
+			node = intern(node)
+		timestamp = element.get('timestamp')
+		attributes = dict((key, value) for key, value in element.items()
+			if key not in _SAMPLE_ATTRIBUTES) or None
+		return cls(node, name, parse_number(element.get('value')),
+			element.get('raw_value'), parse_timestamp(timestamp), timestamp,
+			attributes)
+
+	## Returns the published text of the value
+	def text_value(self):
+		return format_number(self.value)
+
+	## Returns the attributes of the sample as they were published
+	def to_dict(self):
+		attributes = dict(self.attributes or ())
+		attributes["name"] = self.name
+		if self.value is not None:
+			attributes["value"] = self.text_value()
+		if self.raw_value is not None:
+			attributes["raw_value"] = self.raw_value
+		if self.timestamp_text is not None:
+			attributes["timestamp"] = self.timestamp_text
+		return attributes
+
+	def __repr__(self):
+		return "TransducerSample(%r, %r)" % (self.node, self.to_dict())
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+
+################################################################################
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+import logging
+import os
+import signal
+import time
+import Queue
+from multiprocessing import Process
+from multiprocessing import Queue as ProcessQueue
+
+from sharding import Shard
+
+# Statistics that can not be added up, the highest value of all workers is kept
+MAX_STATS = ['p50', 'p90', 'p99', 'max', 'avg', 'ack_latency_avg', 'ack_latency_max', 'high_watermark', 'last_recovery', 'max_recovery']
+
+def merge_stats(total, stats):
+    # Adds the counters of one worker to the combined statistics
+    for key, value in stats.items():
+        if key in MAX_STATS:
+            total[key] = max(total.get(key, value), value)
+        elif isinstance(value, dict):
+            merge_stats(total.setdefault(key, dict()), value)
+        elif isinstance(value, bool):
+            total[key] = value
+        elif isinstance(value, (int, long, float)):
+            total[key] = total.get(key, 0) + value
+        elif isinstance(value, list):
+            total[key] = total.get(key, list()) + value
+        else:
+            total.setdefault(key, value)
+    return total
+
+
+class ShardLink():
+    # Used inside a worker process to talk to the supervisor
+
+    def __init__(self, shard_id, members, control_queue, metrics_queue, stats_interval):
+        self.shard_id = shard_id
+        self.members = members
+        self.control_queue = control_queue
+        self.metrics_queue = metrics_queue
+        self.stats_interval = stats_interval
+        self.last_stats = 0
+
+    def create_shard(self):
+        return Shard(self.shard_id, self.members)
+
+    def poll(self, bridge, defer=None):
+        # Called periodically from the worker's main loop, defer is passed to rebalance
+        while True:
+            try:
+                members = self.control_queue.get_nowait()
+            except Queue.Empty:
+                break
+            logging.info('Shard '+str(self.shard_id)+' : members changed to '+str(members))
+            bridge.rebalance(members, defer)
+
+        now = time.time()
+        if self.stats_interval > 0 and now - self.last_stats >= self.stats_interval:
+            self.last_stats = now
+            self.metrics_queue.put((self.shard_id, bridge.get_stats()))
+
+
+class BridgeSupervisor():
+    # Starts one bridge worker process per shard. Every worker handles the bindings that
+    # the consistent hash ring assigns to it. A worker that dies is restarted, and if it
+    # keeps dying its shard is removed from the ring so that the remaining workers take
+    # over its bindings.
+
+    def __init__(self, num_shards, worker_target, opts, max_restarts=5, restart_window=300):
+        self.worker_target = worker_target
+        self.opts = opts
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.members = range(num_shards)
+        self.workers = dict()
+        self.control_queues = dict()
+        self.restarts = dict()
+        self.shard_stats = dict()
+        self.metrics_queue = ProcessQueue()
+        self.running = False
+
+    def start_worker(self, shard_id):
+        control_queue = ProcessQueue()
+        link = ShardLink(shard_id, list(self.members), control_queue, self.metrics_queue, self.opts.stats_interval)
+        worker = Process(target=self.worker_target, args=(self.opts, link), name='bridge-shard-'+str(shard_id))
+        worker.start()
+        logging.info('BridgeSupervisor : started shard '+str(shard_id)+' with pid '+str(worker.pid))
+        self.workers[shard_id] = worker
+        self.control_queues[shard_id] = control_queue
+
+    def check_workers(self):
+        for shard_id, worker in self.workers.items():
+            if worker.is_alive():
+                continue
+            logging.error('BridgeSupervisor : shard '+str(shard_id)+' exited with code '+str(worker.exitcode))
+            del self.workers[shard_id]
+            del self.control_queues[shard_id]
+
+            now = time.time()
+            restarts = [t for t in self.restarts.get(shard_id, list()) if now - t < self.restart_window]
+            if len(restarts) < self.max_restarts:
+                restarts.append(now)
+                self.restarts[shard_id] = restarts
+                self.start_worker(shard_id)
+            else:
+                logging.error('BridgeSupervisor : shard '+str(shard_id)+' keeps failing, moving its bindings to the other shards')
+                self.members.remove(shard_id)
+                self.shard_stats.pop(shard_id, None)
+                for control_queue in self.control_queues.values():
+                    control_queue.put(list(self.members))
+
+        if not self.workers:
+            logging.error('BridgeSupervisor : no shards left, stopping')
+            self.running = False
+
+    def collect_metrics(self, timeout):
+        try:
+            shard_id, stats = self.metrics_queue.get(timeout=timeout)
+            self.shard_stats[shard_id] = stats
+        except (Queue.Empty, IOError):
+            # IOError is raised when a signal interrupts the wait
+            pass
+
+    def get_stats(self):
+        total = dict()
+        for stats in self.shard_stats.values():
+            merge_stats(total, stats)
+        total['shards'] = len(self.members)
+        return total
+
+    def log_stats(self):
+        for name, values in sorted(self.get_stats().items()):
+            logging.info('BridgeSupervisor stats: '+name+' '+str(values))
+
+    def stop(self, signum=None, frame=None):
+        self.running = False
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        self.running = True
+        for shard_id in self.members:
+            self.start_worker(shard_id)
+
+        last_log = time.time()
+        while self.running:
+            self.collect_metrics(1.0)
+            if not self.running:
+                break
+            self.check_workers()
+            if self.opts.stats_interval > 0 and time.time() - last_log >= self.opts.stats_interval:
+                last_log = time.time()
+                self.log_stats()
+
+        print 'Stopping bridge shards...'
+        for worker in self.workers.values():
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGINT)
+        for worker in self.workers.values():
+            worker.join(30)
+            if worker.is_alive():
+                worker.terminate()
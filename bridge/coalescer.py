@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+
+################################################################################
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+from collections import OrderedDict
+from threading import Lock
+
+class LastValueCoalescer():
+    # Keeps only the newest sample per (node, transducer name) until it is flushed.
+    # Meant for consumers that only look at the retained value of a topic, where older
+    # samples of a burst would be overwritten on the broker anyway.
+
+    def __init__(self):
+        self.values = OrderedDict()
+        self.lock = Lock()
+        self.received = 0
+        self.dropped = 0
+
+    def add(self, messages):
+        # messages is a dict of node -> list of TransducerSample, as returned by MIO.grab_cache_values
+        with self.lock:
+            for node, msgList in messages.items():
+                for msg in msgList:
+                    key = (node, msg.name)
+                    self.received += 1
+                    if key in self.values:
+                        # Re-inserted so that samples leave in the order of their latest update
+                        del self.values[key]
+                        self.dropped += 1
+                    self.values[key] = msg
+
+    def flush(self):
+        with self.lock:
+            values = self.values
+            self.values = OrderedDict()
+        messages = dict()
+        for (node, name), msg in values.items():
+            if node not in messages:
+                messages[node] = list()
+            messages[node].append(msg)
+        return messages
+
+    def stats(self):
+        stats = dict()
+        stats['received'] = self.received
+        stats['dropped'] = self.dropped
+        stats['pending'] = len(self.values)
+        return stats
@@ -27,7 +27,29 @@
 from optparse import OptionParser
 import ConfigParser
 import os 
+import sys
+import signal
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+'/../PyMIO/')
+from mio_types import OverflowPolicy
+from metrics import StartupTimer
+from xmpp_mqtt_bridge import XmppMqttBridge
+from bridge_supervisor import BridgeSupervisor
+from paho_reactor import PahoReactorDriver
+from data_holders import Server
+
+from twisted.internet import task
+from twisted.internet import reactor
+from twisted.internet import threads
+from twisted.python.failure import Failure
+
 CONFIG_FILE = os.path.dirname(os.path.abspath(__file__)) +"/bridge.conf"
+SPOOL_SEGMENT_BYTES = 4*1024*1024
+
+# Returns the value of an optional entry in the config file, or the default when it is missing
+def get_config(config, option, default):
+    if config.has_option('Config', option):
+        return config.get('Config', option)
+    return default
 
 def parse_arguments():
     config = ConfigParser.ConfigParser()
@@ -39,10 +61,33 @@ def parse_arguments():
     #TODO: Check if there is a concept of home folder for user so that the node field is not required
     optp.add_option('-e','--node', dest='xmpp_node', help='UUID of bridge node on xmpp server', default = config.get('Config','node'))
     optp.add_option('-t','--path', dest='path', help='Path of bridge node on xmpp server', default = config.get('Config','path'))
-#    optp.add_option('-l','--lora_host', dest='lora_host', help='LoRa REST endpoint host', default = config.get('Config','lora_host'))
+    optp.add_option('-l','--lora_host', dest='lora_host', help='LoRa REST endpoint host, used by the LoRa bridge', default = get_config(config, 'lora_host', None))
     optp.add_option('-m','--mqtt_broker', dest='mqtt_broker', help='MQTT Broker', default = config.get('Config', 'mqtt_broker'))
     optp.add_option('-u','--mqtt_broker_user', dest='mqtt_broker_user', help='MQTT Broker User', default = config.get('Config', 'mqtt_broker_user'))
     optp.add_option('-s','--mqtt_broker_pass', dest='mqtt_broker_password', help='MQTT Broker User Password', default = config.get('Config', 'mqtt_broker_password'))
+    optp.add_option('-q','--queue_capacity', dest='queue_capacity', type='int', help='Maximum number of messages buffered in each direction, 0 for unbounded', default = int(get_config(config, 'queue_capacity', '10000')))
+    optp.add_option('-o','--queue_policy', dest='queue_policy', type='choice', choices=[policy.value for policy in OverflowPolicy], help='What to do when a message queue is full: drop_oldest, drop_newest, keep_latest or block. xmpp values wait at most a second for room when blocked', default = get_config(config, 'queue_policy', OverflowPolicy.DROP_OLDEST.value))
+    optp.add_option('--stats_interval', dest='stats_interval', type='int', help='Seconds between logging of queue statistics, 0 to disable', default = int(get_config(config, 'stats_interval', '60')))
+    optp.add_option('-w','--workers', dest='workers', type='int', help='Number of threads processing messages in parallel, 0 to process them on the main loop', default = int(get_config(config, 'workers', '4')))
+    optp.add_option('-n','--shards', dest='shards', type='int', help='Number of bridge processes sharing the bindings, 1 to run a single process', default = int(get_config(config, 'shards', '1')))
+    optp.add_option('--spool_dir', dest='spool_dir', help='Directory where undeliverable messages are spooled, empty to disable spooling', default = get_config(config, 'spool_dir', ''))
+    optp.add_option('--spool_rate', dest='spool_rate', type='int', help='Number of spooled messages replayed per second in each direction, raised to twice the rate of the messages spooled meanwhile', default = int(get_config(config, 'spool_rate', '100')))
+    optp.add_option('--spool_max_mb', dest='spool_max_mb', type='int', help='Maximum size of the spool of each direction in megabytes', default = int(get_config(config, 'spool_max_mb', '256')))
+    optp.add_option('--mqtt_qos', dest='mqtt_qos', type='choice', choices=['0', '1', '2'], help='Default QoS of messages published to the MQTT broker', default = get_config(config, 'mqtt_qos', '0'))
+    optp.add_option('--mqtt_inflight', dest='mqtt_inflight', type='int', help='Maximum number of MQTT messages waiting for an acknowledgement', default = int(get_config(config, 'mqtt_inflight', '100')))
+    optp.add_option('--mqtt_ack_timeout', dest='mqtt_ack_timeout', type='int', help='Seconds to wait for an MQTT acknowledgement before publishing a QoS 0 message again, QoS 1 and 2 messages are retransmitted by paho', default = int(get_config(config, 'mqtt_ack_timeout', '10')))
+    optp.add_option('--mqtt_max_retries', dest='mqtt_max_retries', type='int', help='Number of times an unacknowledged QoS 0 MQTT message is published again', default = int(get_config(config, 'mqtt_max_retries', '3')))
+    optp.add_option('--coalesce', dest='coalesce', type='choice', choices=['off', 'cycle', 'window'], help='Forward only the newest xmpp sample per node and transducer. cycle: within one dispatch, window: within coalesce_window seconds', default = get_config(config, 'coalesce', 'off'))
+    optp.add_option('--coalesce_window', dest='coalesce_window', type='float', help='Seconds during which samples are coalesced when coalesce is window', default = float(get_config(config, 'coalesce_window', '1.0')))
+    optp.add_option('--mqtt_loop', dest='mqtt_loop', type='choice', choices=['thread', 'reactor'], help='thread: paho runs its network loop on its own thread, reactor: the mqtt socket is driven by the twisted reactor. Only the mqtt loop moves, the xmpp sessions and the workers keep their threads', default = get_config(config, 'mqtt_loop', 'thread'))
+    optp.add_option('--xmpp_sessions', dest='xmpp_sessions', type='int', help='Number of xmpp sessions opened by each bridge process, the requests of a node always use the same session', default = int(get_config(config, 'xmpp_sessions', '1')))
+    optp.add_option('--xmpp_publish', dest='xmpp_publish', type='choice', choices=['sync', 'async'], help='sync: wait for the xmpp server to acknowledge every publication, async: keep many publications outstanding', default = get_config(config, 'xmpp_publish', 'sync'))
+    optp.add_option('--xmpp_batch_size', dest='xmpp_batch_size', type='int', help='Number of values after which batched xmpp publications are sent', default = int(get_config(config, 'xmpp_batch_size', '50')))
+    optp.add_option('--xmpp_batch_delay', dest='xmpp_batch_delay', type='float', help='Seconds values are collected before they are published to xmpp, 0 to publish them immediately', default = float(get_config(config, 'xmpp_batch_delay', '0')))
+    optp.add_option('--wire_trace', dest='wire_trace', type='choice', choices=['off', 'on'], help='Keep the last xmpp stanzas for debugging, SIGUSR1 toggles the trace and SIGUSR2 dumps it', default = get_config(config, 'wire_trace', 'off'))
+    optp.add_option('--tree_refresh', dest='tree_refresh', type='int', help='Seconds between refreshes of the device tree, only the nodes whose references or meta changed are resolved again, 0 to disable', default = int(get_config(config, 'tree_refresh', '3600')))
+    optp.add_option('--cache_dir', dest='cache_dir', help='Directory of the device tree catalog, empty for the default of mio_tree', default = get_config(config, 'cache_dir', ''))
+    optp.add_option('-d','--dispatch', dest='dispatch', type='choice', choices=['event', 'poll'], help='event: process messages as soon as they arrive, poll: process messages once a second', default = get_config(config, 'dispatch', 'event'))
    
     opts, args = optp.parse_args()
 
@@ -59,5 +104,152 @@ def parse_arguments():
         optp.print_help()
         exit()
 
-    return opts    
-   
+    opts.queue_policy = OverflowPolicy(opts.queue_policy)
+    opts.mqtt_qos = int(opts.mqtt_qos)
+
+    return opts
+
+
+class BridgeDaemon():
+    # Sets up and runs a bridge process, or a supervisor and one bridge process per shard.
+    # The daemon of every kind of bridge derives from this class and creates its clients.
+
+    # With False the bindings are generated on a thread once the reactor runs, so the
+    # messages of the bindings made so far are already forwarded
+    bind_on_init = True
+    # Refresh the bindings every tree_refresh seconds
+    refresh_bindings = False
+
+    def __init__(self, startup=None):
+        # startup is the StartupTimer created before the imports of the daemon
+        self.startup = startup or StartupTimer()
+        self.bridge = None
+
+    def create_xmpp_client(self, opts, xmpp_server):
+        # Derived class should override this method to return its XmppClient
+        pass
+
+    def create_mqtt_client(self, opts, mqtt_server, loop_driver):
+        # Derived class should override this method to return its MqttClient
+        pass
+
+    def run(self):
+        opts = parse_arguments()
+        signal.signal(signal.SIGINT, self.signal_handler)
+
+        if opts.shards > 1:
+            # Every shard is a separate bridge process handling a slice of the bindings
+            supervisor = BridgeSupervisor(opts.shards, self.run_shard, opts)
+            supervisor.run()
+        else:
+            self.run_bridge(opts)
+
+    def run_shard(self, opts, link):
+        # Runs in the worker process started by the supervisor
+        signal.signal(signal.SIGINT, self.signal_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        self.run_bridge(opts, link)
+
+    def signal_handler(self, signum, frame):
+        print 'Stopping Xmpp Mqtt Bridge...'
+        if self.bridge:
+            reactor.stop()
+            self.bridge.stop()
+
+    def run_bridge(self, opts, link=None):
+        if link:
+            # Shard processes are started after the imports of the supervisor
+            timer = StartupTimer()
+        else:
+            timer = self.startup
+            timer.mark('import')
+
+        xmpp_user = opts.jid.split('@')[0]
+        xmpp_host = opts.jid.split('@')[1]
+
+        xmpp_server = Server(xmpp_host,'5222', xmpp_user, opts.xmpp_user_pass)
+        mqtt_server = Server(opts.mqtt_broker, '1883', opts.mqtt_broker_user, opts.mqtt_broker_password)
+        
+        xmppClient = self.create_xmpp_client(opts, xmpp_server)
+        timer.extend(xmppClient.mio.startup)
+        loop_driver = None
+        if opts.mqtt_loop == 'reactor':
+            # The mqtt network loop, its callbacks and the bridge dispatch share the reactor thread
+            loop_driver = PahoReactorDriver(reactor)
+        mqttClient = self.create_mqtt_client(opts, mqtt_server, loop_driver)
+        # SIGUSR1 switches the xmpp wire trace on and off, SIGUSR2 dumps the last stanzas
+        xmppClient.mio.TRACER.install_signal_handlers()
+        if opts.wire_trace == 'on':
+            xmppClient.mio.TRACER.enable()
+        mqttClient.configure_publishing(opts.mqtt_qos, opts.mqtt_inflight, opts.mqtt_ack_timeout, opts.mqtt_max_retries)
+
+        timer.mark('mqtt')
+        shard = None
+        if link:
+            shard = link.create_shard()
+        bridge = XmppMqttBridge(xmppClient, mqttClient, shard, timer, self.bind_on_init)
+        self.bridge = bridge
+        bridge.enable_workers(opts.workers)
+
+        if opts.coalesce == 'cycle':
+            bridge.enable_coalescing(0)
+        elif opts.coalesce == 'window':
+            bridge.enable_coalescing(opts.coalesce_window)
+            coalesceTask = task.LoopingCall(bridge.flush_coalesced)
+            coalesceTask.start(opts.coalesce_window, now=False)
+
+        if opts.xmpp_publish == 'async':
+            xmppClient.enable_async_publish()
+        if opts.xmpp_batch_delay > 0:
+            xmppClient.enable_batching(opts.xmpp_batch_size, opts.xmpp_batch_delay)
+
+        if opts.spool_dir:
+            spool_dir = opts.spool_dir
+            if link:
+                spool_dir = os.path.join(spool_dir, 'shard'+str(link.shard_id))
+            bridge.enable_spool(spool_dir, SPOOL_SEGMENT_BYTES, opts.spool_max_mb*1024*1024)
+            # Replayed on a thread because publishing to xmpp blocks until the server answers.
+            # LoopingCall waits for the previous replay to finish before starting the next one.
+            replayTask = task.LoopingCall(threads.deferToThread, bridge.replay_spools, opts.spool_rate)
+            replayTask.start(1.0, now=False)
+    
+        if opts.dispatch == 'poll':
+            loopTask = task.LoopingCall(bridge.process_messages)
+            loopDeferred = loopTask.start(1.0) #call every second
+            loopDeferred.addErrback(self.handle_error)
+        else:
+            # Messages are processed on the reactor thread as soon as they are received
+            bridge.enable_event_dispatch(reactor.callFromThread, self.handle_dispatch_error)
+
+        if not self.bind_on_init:
+            # The bindings are made on a thread, while the reactor already forwards the
+            # messages of the ones made so far
+            reactor.callWhenRunning(lambda: threads.deferToThread(bridge.generate_bindings).addErrback(self.handle_error))
+
+        if self.refresh_bindings and opts.tree_refresh > 0:
+            # Walked on a thread because it waits for the xmpp server, only the nodes
+            # that changed since the last scan are resolved again
+            refreshTask = task.LoopingCall(threads.deferToThread, bridge.refresh_bindings)
+            refreshTask.start(opts.tree_refresh, now=False)
+
+        ackTask = task.LoopingCall(mqttClient.check_inflight)
+        ackTask.start(1.0, now=False)
+
+        if link:
+            # Membership changes and statistics are exchanged with the supervisor
+            # The bindings of a rebalance are generated on a thread, like a refresh
+            linkTask = task.LoopingCall(link.poll, bridge, threads.deferToThread)
+            linkTask.start(1.0, now=False)
+        elif opts.stats_interval > 0:
+            statsTask = task.LoopingCall(bridge.log_stats)
+            statsTask.start(opts.stats_interval, now=False)
+
+        reactor.run() #Keeps the process running forever
+
+    def handle_error(self, failure):
+        print(failure.getBriefTraceback())
+        reactor.stop()
+        self.bridge.stop()
+
+    def handle_dispatch_error(self):
+        self.handle_error(Failure())
@@ -29,5 +29,6 @@ from collections import namedtuple
 #Data Holders
 Server = namedtuple('Server', ['host', 'port','user','password'])
 LoraID = namedtuple('LoraID', ['appEUI', 'devEUI'])
+TopicRoute = namedtuple('TopicRoute', ['pattern', 'handler', 'key_fields'])
 
 
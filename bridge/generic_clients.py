@@ -28,30 +28,93 @@ import logging
 import sys
 import os
 import json
+from threading import Lock
 sys.path.append(os.path.dirname(os.path.abspath(__file__))+'/../PyMIO/')
 from mio import MIO
 import mio_tree
+from mio_types import OverflowPolicy
 from xmpp_mqtt_bridge import MqttClient, XmppClient
+from metrics import monotonic, XMPP_TO_MQTT, STAGE_TRANSFORM
 
 class GenericXmppClient(XmppClient):
 
-    def __init__(self, xmpp_server, node_uuid, path):
-        self.init(xmpp_server, node_uuid) 
+    binding_type = 'generic'
+
+    def __init__(self, xmpp_server, node_uuid, path, queue_capacity=0, queue_policy=OverflowPolicy.DROP_OLDEST, sessions=1, cache_dir=None):
+        self.init(xmpp_server, node_uuid, queue_capacity, queue_policy, sessions) 
         self.node_path = path
+        # Directory of the device catalog, the default of mio_tree when None
+        self.cache_dir = cache_dir
+        # generate_bindings runs on the startup, refresh and rebalance threads
+        self.bindings_lock = Lock()
     
-    def generate_bindings(self):
-        devices = mio_tree.scan_node(self.mio, self.node_uuid, self.node_path) 
-        for device in devices.values():
-            uuid = device["node"]
-            topic = "mio/"+ device["pathList"][0]+"/"+uuid
-            logging.info("Subscribing to node :" +uuid)
-            self.mio.subscribe(uuid)
-            logging.info("Adding topic for node : "+uuid +" , topic : "+topic)
-            self.parent.xmppMqttBindings.update({uuid : topic})
+    def generate_bindings(self, refresh=False):
+        # Devices are bound and subscribed as the walk of the tree finds them, so their data
+        # is forwarded before the walk is over. The stored catalog then adds the devices that
+        # were not streamed and drops the ones that left the tree.
+        with self.bindings_lock:
+            bare = self.parent.shard is None
+            subscriptions = dict()
+            for device in mio_tree.iter_devices(self.mio, self.node_uuid, self.node_path, refresh=refresh, cache_dir=self.cache_dir):
+                uuid = self.bind(device)
+                if uuid is None:
+                    continue
+                if not subscriptions:
+                    self.parent.startup.mark('first_binding')
+                subscriptions[uuid] = self.mio.subscribe_async(uuid, bare = bare)
+            self.parent.startup.mark('bindings')
+
+            devices = mio_tree.scan_node(self.mio, self.node_uuid, self.node_path, cache_dir=self.cache_dir)
+            try:
+                if refresh:
+                    self.remove_bindings([node for node in self.parent.xmppMqttBindings.keys() if node not in devices])
+                uuids = [node for node in (self.bind(device) for device in devices.iter_devices())
+                         if node is not None]
+            finally:
+                devices.close()
+
+            # The subscriptions are sent concurrently instead of waiting for each reply.
+            # Shards share the jid, so each one subscribes with its full jid to receive
+            # only the events of its own nodes
+            logging.info("Subscribing to "+str(len(subscriptions) + len(uuids))+" nodes")
+            subscribed = self.mio.subscribe_many(uuids, bare = bare)
+            for uuid, future in subscriptions.items():
+                subscribed[uuid] = future.exception() is None
+            for uuid, done in subscribed.items():
+                if not done:
+                    logging.error("Could not subscribe to node : "+uuid)
+            self.parent.startup.mark('subscribe')
+
+    def bind(self, device):
+        # Binds the device to its topic, returns its uuid if it was not bound yet
+        uuid = device["node"]
+        if not self.parent.owns(uuid):
+            return None
+        topics = ["mio/"+ path +"/"+uuid for path in device["pathList"]]
+        topic = topics[0]
+        if uuid in self.parent.xmppMqttBindings:
+            # A device reachable from several locations keeps its topic, and the messages
+            # retained on it, until that path leaves the tree
+            if self.parent.xmppMqttBindings[uuid] not in topics:
+                self.parent.xmppMqttBindings[uuid] = topic
+            return None
+        logging.info("Adding topic for node : "+uuid +" , topic : "+topic)
+        self.parent.xmppMqttBindings.update({uuid : topic})
+        return uuid
+
+    def refresh_bindings(self):
+        # Picks up the devices added to or removed from the tree since the last scan
+        self.generate_bindings(refresh=True)
+
+    def remove_bindings(self, uuids):
+        for uuid in uuids:
+            logging.info("Removing topic for node : "+uuid)
+            self.parent.xmppMqttBindings.pop(uuid, None)
+            self.mio.unsubscribe(uuid)
 
     def convert_to_json_format(self, msg):
         logging.info("Received message on xmpp subscribe listener "+ str(msg))
-        return json.dumps(msg)
+        return json.dumps(msg.to_dict())
 
 
     def process_message(self, node, msgList):
@@ -62,12 +125,15 @@ class GenericXmppClient(XmppClient):
         topic  = self.parent.xmppMqttBindings[node]
 
         for msg in msgList:
-            if not msg:
+            if msg.name is None and msg.value is None:
                 logging.warning('Empty message received on XMPP listener..Ignoring..')
                 continue
+            started = monotonic()
             json_msg = dict()
             json_msg['message'] = self.convert_to_json_format(msg)
             json_msg['topic'] = topic
+            self.parent.record(XMPP_TO_MQTT, STAGE_TRANSFORM, started)
+            json_msg['received_at'] = msg.received_at
             self.parent.mqttClient.publish(json_msg) 
     
     def handle_publish(self, msg):
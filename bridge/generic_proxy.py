@@ -24,57 +24,26 @@
 #
 ################################################################################
 
-import logging
-import sys
-import signal
+# Created before the other imports so that their time is part of the startup breakdown
+from metrics import StartupTimer
+startup = StartupTimer()
 
 from generic_clients import GenericXmppClient, GenericMqttClient
-from xmpp_mqtt_bridge import XmppMqttBridge
-from data_holders import Server
 
 import common
 
-from twisted.internet import task
-from twisted.internet import reactor
+class BridgeDaemon(common.BridgeDaemon):
+    # The devices are subscribed as the walk of the tree finds them
+    bind_on_init = False
+    refresh_bindings = True
 
-#Define stop action
-def signal_handler(signal, frame):
-    print 'Stopping Xmpp Mqtt Bridge...'
-    if "bridge" in globals():
-        reactor.stop()
-        bridge.stop()
+    def create_xmpp_client(self, opts, xmpp_server):
+        return GenericXmppClient(xmpp_server, opts.xmpp_node, opts.path, opts.queue_capacity, opts.queue_policy, opts.xmpp_sessions, opts.cache_dir or None)
 
-signal.signal(signal.SIGINT, signal_handler)
-
-class BridgeDaemon():
-    def run(self):
-        opts = common.parse_arguments()
-
-        xmpp_user = opts.jid.split('@')[0]
-        xmpp_host = opts.jid.split('@')[1]
-
-        xmpp_server = Server(xmpp_host,'5222', xmpp_user, opts.xmpp_user_pass)
-        mqtt_server = Server(opts.mqtt_broker, '1883', opts.mqtt_broker_user, opts.mqtt_broker_password)
-        
-        xmppClient = GenericXmppClient(xmpp_server, opts.xmpp_node, opts.path)
-        mqttClient = GenericMqttClient(mqtt_server)
-        
-        global bridge
-        bridge = XmppMqttBridge(xmppClient, mqttClient)
-    
-        loopTask = task.LoopingCall(bridge.process_messages)
-        loopDeferred = loopTask.start(1.0) #call every second
-        loopDeferred.addErrback(self.handle_error)
-
-        reactor.run() #Keeps the process running forever
-
-    def handle_error(self, failure):
-        print(failure.getBriefTraceback())
-        reactor.stop()
-        bridge.stop()
+    def create_mqtt_client(self, opts, mqtt_server, loop_driver):
+        return GenericMqttClient(mqtt_server, opts.queue_capacity, opts.queue_policy, loop_driver)
 
 
 if __name__ == '__main__':
-    daemon = BridgeDaemon()
+    daemon = BridgeDaemon(startup)
     daemon.run()
-
@@ -34,38 +34,57 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__))+'/../PyMIO')
 from mio import MIO
 import mio_meta_utils
-from mio_types import MetaType, ReferenceType
+from mio_types import MetaType, ReferenceType, OverflowPolicy
 from data_holders import Server, LoraID
 from xmpp_mqtt_bridge import MqttClient, XmppClient
+from metrics import monotonic, XMPP_TO_MQTT, STAGE_TRANSFORM
 
 class LoraSaXmppClient(XmppClient):
 
-    def __init__(self, xmpp_server, node_uuid, lora_server):
-        self.init(xmpp_server, node_uuid) 
+    binding_type = 'lora_sa'
+
+    def __init__(self, xmpp_server, node_uuid, lora_server, queue_capacity=0, queue_policy=OverflowPolicy.DROP_OLDEST, sessions=1):
+        self.init(xmpp_server, node_uuid, queue_capacity, queue_policy, sessions) 
         self.lora_server = lora_server
     
     def generate_bindings(self):
         child_nodes = self.mio.reference_query(self.node_uuid)
+        self.parent.startup.mark('bindings')
         for child in child_nodes:
             if not child["node"]:
                 continue
             if child["type"] == ReferenceType.PARENT.value:
                 continue
-            if child["metaType"] == MetaType.DEVICE.value:
-                uuid = child["node"] 
-                node_meta = self.mio.meta_query(uuid)
-                if not node_meta:
-                    logging.warning('Meta not found for node '+uuid)
-                    continue
-                appEUI= mio_meta_utils.get_property_value_from_meta(node_meta,'appEUI')
-                devEUI = mio_meta_utils.get_property_value_from_meta(node_meta,'devEUI')
-                if not appEUI:
-                    logging.error('Node '+uuid+' does not have an appEUI in its meta. Exiting..')
-                    sys.exit(0)
-                if not devEUI:
-                    logging.error('Node '+uuid+' does not have a devEUI in its meta. Exiting..')
-                    sys.exit(0)
-                self.update_cache(uuid, appEUI, devEUI)
+            if child["metaType"] != MetaType.DEVICE.value:
+                continue
+            uuid = child["node"]
+            if not self.parent.owns(uuid):
+                continue
+            # reference_query already fetched the meta of every child
+            node_meta = child["meta"]
+            if not node_meta:
+                logging.warning('Meta not found for node '+uuid)
+                continue
+            appEUI= mio_meta_utils.get_property_value_from_meta(node_meta,'appEUI')
+            devEUI = mio_meta_utils.get_property_value_from_meta(node_meta,'devEUI')
+            if not appEUI:
+                logging.error('Node '+uuid+' does not have an appEUI in its meta. Exiting..')
+                sys.exit(0)
+            if not devEUI:
+                logging.error('Node '+uuid+' does not have a devEUI in its meta. Exiting..')
+                sys.exit(0)
+            self.update_cache(uuid, appEUI, devEUI)
+            self.set_binding_qos(node_meta, appEUI, devEUI)
+
+    def set_binding_qos(self, node_meta, appEUI, devEUI):
+        # A node can ask for a different QoS than the default with an mqttQos property
+        qos = mio_meta_utils.get_property_value_from_meta(node_meta,'mqttQos')
+        if qos:
+            self.parent.mqttClient.set_topic_qos(self.get_tx_topic(LoraID(appEUI, devEUI)), int(qos))
+
+    def get_tx_topic(self, loraId):
+        #TODO: Fix the topic hardcoding
+        return 'application/'+loraId.appEUI+'/node/'+loraId.devEUI+'/tx'
 
     def update_cache(self, xmpp_node_uuid, appEUI, devEUI):
         self.parent.xmppMqttBindings.update({xmpp_node_uuid : LoraID(appEUI, devEUI)})
@@ -74,7 +93,7 @@ class LoraSaXmppClient(XmppClient):
 
     def convert_to_lora_format(self, loraId, msg):
         logging.info("Received message on xmpp subscribe listener "+ str(msg))
-        data = base64.b64encode(msg["value"])
+        data = base64.b64encode(msg.text_value())
         #TODO: Hackish.. fix the constants
         return '{"reference": "abcd1234","confirmed": true,"devEUI": "'+loraId.devEUI+'","fPort": 20,"data": "'+data+'"}'
 
@@ -124,6 +143,7 @@ class LoraSaXmppClient(XmppClient):
 
 
         self.update_cache(node, appEUI, devEUI)
+        self.set_binding_qos(node_meta, appEUI, devEUI)
         result = self.invoke_loraserver_api_to_add_node(node, appEUI, devEUI, appKey)
         if not result:
             return False
@@ -139,6 +159,8 @@ class LoraSaXmppClient(XmppClient):
         return True
 
     def process_message(self, node, msgList):
+        if not self.parent.owns(node):
+            return
         if node not in self.parent.xmppMqttBindings:
             #handle join flow
             logging.info('New device found. Loading its meta to find its LoraID(AppEUI,DevEUI) tuple')
@@ -149,46 +171,45 @@ class LoraSaXmppClient(XmppClient):
                 
         loraId = self.parent.xmppMqttBindings[node]
 
-        #TODO: Fix the topic hardcoding
-        topic = 'application/'+loraId.appEUI+'/node/'+loraId.devEUI+'/tx'
+        topic = self.get_tx_topic(loraId)
         for msg in msgList:
-            if 'value' not in msg:
+            if msg.value is None:
                 logging.warning('XMPP message does not have a value. Ignoring..'+ str(msg))
                 continue
+            started = monotonic()
             json_msg = dict()
             json_msg['message'] = self.convert_to_lora_format(loraId, msg)
             json_msg['topic'] = topic
+            self.parent.record(XMPP_TO_MQTT, STAGE_TRANSFORM, started)
+            json_msg['received_at'] = msg.received_at
             self.parent.mqttClient.publish(json_msg)
     
     def handle_publish(self, msg):
         lora_id = msg['lora_id']
         if lora_id not in self.parent.mqttXmppBindings :
+            if self.parent.shard:
+                # Every shard receives all lora messages, this one belongs to another shard
+                return
             logging.info('Ignoring message from lora_id '+ lora_id+ ' because no xmpp node found for this lora_id. To accept messages from this lora node, register this node in sensor andrew portal.')
             return
         xmpp_node_uuid = self.parent.mqttXmppBindings[lora_id]
         payload = msg['value']
         payload_json = json.loads(payload)
         #TODO: fix the transducer name constants
-        self.mio.publish_data(xmpp_node_uuid, 'Raw Value', payload_json["data"])
-        self.mio.publish_data(xmpp_node_uuid, 'rssi', payload_json["rssi"])
+        # Both values are published with a single request
+        self.publish_values(xmpp_node_uuid, [('Raw Value', payload_json["data"]), ('rssi', payload_json["rssi"])])
 
 
 
 class LoraSaMqttClient(MqttClient):
 
-       
-    def get_topics(self):
-        topics = list()
-        topics.append('application/+/node/+/rx')
-        return topics
+    def register_topics(self):
+        # Messages of one lora node are processed in order
+        self.router.add_route('application/{appEUI}/node/{devEUI}/rx', self.handle_rx, key_fields=('appEUI', 'devEUI'))
         
-    def process_message(self, msg):
-        topic = msg.topic
-        words = topic.split('/')
-        appEUI= words[1]
-        devEUI = words[3]
+    def handle_rx(self, msg, fields):
         xmpp_msg = dict()
-        xmpp_msg['lora_id'] = appEUI+'_'+devEUI
+        xmpp_msg['lora_id'] = fields['appEUI']+'_'+fields['devEUI']
         xmpp_msg['value'] = msg.payload
         return xmpp_msg
 
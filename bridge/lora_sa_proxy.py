@@ -24,58 +24,25 @@
 #
 ################################################################################
 
-import logging
-import sys
-import signal
+# Created before the other imports so that their time is part of the startup breakdown
+from metrics import StartupTimer
+startup = StartupTimer()
 
 from lora_sa_clients import LoraSaXmppClient, LoraSaMqttClient
-from xmpp_mqtt_bridge import XmppMqttBridge
 from data_holders import Server
 
 import common
 
-from twisted.internet import task
-from twisted.internet import reactor
+class BridgeDaemon(common.BridgeDaemon):
 
-#Define stop action
-def signal_handler(signal, frame):
-    print 'Stopping Xmpp Mqtt Bridge...'
-    if "bridge" in globals():
-        reactor.stop()
-        bridge.stop()
-
-signal.signal(signal.SIGINT, signal_handler)
-
-class BridgeDaemon():
-    def run(self):
-        opts = common2.parse_arguments()
-
-        xmpp_user = opts.jid.split('@')[0]
-        xmpp_host = opts.jid.split('@')[1]
-
-        xmpp_server = Server(xmpp_host,'5222', xmpp_user, opts.xmpp_user_pass)
+    def create_xmpp_client(self, opts, xmpp_server):
         lora_server = Server(opts.lora_host, '8000',"", "")
-        mqtt_server = Server(opts.mqtt_broker, '1883', opts.mqtt_broker_user, opts.mqtt_broker_password)
-        
-        xmppClient = LoraSaXmppClient(xmpp_server, opts.xmpp_node, lora_server)
-        mqttClient = LoraSaMqttClient(mqtt_server)
-        
-        global bridge
-        bridge = XmppMqttBridge(xmppClient, mqttClient)
-    
-        loopTask = task.LoopingCall(bridge.process_messages)
-        loopDeferred = loopTask.start(1.0) #call every second
-        loopDeferred.addErrback(self.handle_error)
-
-        reactor.run() #Keeps the process running forever
+        return LoraSaXmppClient(xmpp_server, opts.xmpp_node, lora_server, opts.queue_capacity, opts.queue_policy, opts.xmpp_sessions)
 
-    def handle_error(failure):
-        print(failure.getBriefTraceback())
-        bridge.stop()
-        reactor.stop()
+    def create_mqtt_client(self, opts, mqtt_server, loop_driver):
+        return LoraSaMqttClient(mqtt_server, opts.queue_capacity, opts.queue_policy, loop_driver)
 
 
 if __name__ == '__main__':
-    daemon = BridgeDaemon()
+    daemon = BridgeDaemon(startup)
     daemon.run()
-
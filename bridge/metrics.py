@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+
+################################################################################
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+import bisect
+import logging
+from threading import Lock
+
+# Same clock as the one used by MIO to stamp received values
+from mio_types import monotonic
+
+#Directions of a bridged message
+MQTT_TO_XMPP = 'mqtt_to_xmpp'
+XMPP_TO_MQTT = 'xmpp_to_mqtt'
+
+#Stages of a bridged message
+STAGE_QUEUE = 'queue'
+STAGE_TRANSFORM = 'transform'
+STAGE_PUBLISH = 'publish'
+STAGE_TOTAL = 'total'
+
+# Bucket upper bounds in seconds, from 100us to ~105s doubling each time
+BUCKETS = [0.0001 * 2 ** i for i in range(21)]
+
+class LatencyHistogram():
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the requested fraction of the samples
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                if index < len(BUCKETS):
+                    return min(BUCKETS[index], self.max)
+                return self.max
+        return self.max
+
+    def summary(self):
+        summary = dict()
+        summary['count'] = self.count
+        summary['avg'] = self.total / max(self.count, 1)
+        summary['p50'] = self.percentile(0.5)
+        summary['p90'] = self.percentile(0.9)
+        summary['p99'] = self.percentile(0.99)
+        summary['max'] = self.max
+        return summary
+
+
+class LatencyRecorder():
+    # Latency histograms per direction, binding type and stage
+
+    def __init__(self):
+        self.histograms = dict()
+        self.lock = Lock()
+
+    def observe(self, direction, binding_type, stage, seconds):
+        key = direction+'.'+binding_type+'.'+stage
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if not histogram:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def stats(self):
+        with self.lock:
+            return dict((key, histogram.summary()) for key, histogram in self.histograms.items())
+
+
+class StartupTimer():
+    # Seconds spent in the stages of the start of a bridge process, in the order they ran.
+    # Stages are marked until finish is called, later marks are ignored.
+
+    def __init__(self, started=None):
+        self.started = monotonic() if started is None else started
+        self.last = self.started
+        self.stages = list()
+        self.finished = False
+
+    def mark(self, stage):
+        # Closes the stage that started at the previous mark
+        if self.finished:
+            return
+        now = monotonic()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+    def extend(self, stages):
+        # Records stages measured elsewhere, as (stage, seconds), that ended now
+        if self.finished:
+            return
+        self.stages.extend(stages)
+        self.last = monotonic()
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        logging.info('Startup: '+', '.join('%s %.2fs' % stage for stage in self.stages)+
+                     ', total %.2fs' % (self.last - self.started))
+
+    def stats(self):
+        stats = dict(self.stages)
+        stats['total'] = self.last - self.started
+        return stats
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+
+################################################################################
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+import logging
+import paho.mqtt.client as mqtt
+from zope.interface import implementer
+from twisted.internet import task
+from twisted.internet.interfaces import IReadWriteDescriptor
+from twisted.python.threadable import isInIOThread
+
+@implementer(IReadWriteDescriptor)
+class PahoReactorDriver():
+    # Runs the paho network loop on the Twisted reactor instead of the thread started by
+    # loop_start(). The paho socket is registered with the reactor through the
+    # on_socket_* callbacks, so reads, writes and the mqtt callbacks (on_message,
+    # on_publish, ...) all happen on the reactor thread. Publishes made from other
+    # threads have to go through call(), paho writes to the socket right away when
+    # it publishes and is not thread safe without its loop thread. Only the mqtt side
+    # moves to the reactor, sleekxmpp and the worker pool keep running on their threads.
+
+    def __init__(self, reactor, reconnect_delay=1, max_reconnect_delay=60):
+        self.reactor = reactor
+        self.client = None
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.next_delay = reconnect_delay
+        self.miscTask = None
+        self.reconnectCall = None
+        self.stopped = False
+
+    def attach(self, client):
+        # Must be called before client.connect()
+        self.client = client
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def start(self):
+        # Keepalive pings and QoS retries are handled by loop_misc
+        self.miscTask = task.LoopingCall(self.loop_misc)
+        self.miscTask.start(1.0, now=False)
+
+    def stop(self):
+        self.stopped = True
+        if self.miscTask and self.miscTask.running:
+            self.miscTask.stop()
+        if self.reconnectCall and self.reconnectCall.active():
+            self.reconnectCall.cancel()
+        self.client.disconnect()
+
+    def call(self, function, *args):
+        # Runs function on the reactor thread, right away when the caller is already on it
+        if isInIOThread():
+            function(*args)
+        else:
+            self.reactor.callFromThread(function, *args)
+
+    # paho may call these from any thread that publishes, the reactor is only touched
+    # from its own thread
+    def on_socket_open(self, client, userdata, sock):
+        self.reactor.callFromThread(self.reactor.addReader, self)
+
+    def on_socket_close(self, client, userdata, sock):
+        self.reactor.callFromThread(self.remove, sock)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.reactor.callFromThread(self.reactor.addWriter, self)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.reactor.callFromThread(self.reactor.removeWriter, self)
+
+    def remove(self, sock):
+        self.reactor.removeReader(self)
+        self.reactor.removeWriter(self)
+
+    def loop_misc(self):
+        if self.client.loop_misc() == mqtt.MQTT_ERR_NO_CONN and not self.stopped:
+            self.schedule_reconnect()
+
+    def schedule_reconnect(self):
+        if self.reconnectCall and self.reconnectCall.active():
+            return
+        logging.info('PahoReactorDriver: reconnecting to the mqtt broker in '+str(self.next_delay)+' seconds')
+        self.reconnectCall = self.reactor.callLater(self.next_delay, self.reconnect)
+        self.next_delay = min(self.next_delay * 2, self.max_reconnect_delay)
+
+    def reconnect(self):
+        try:
+            self.client.reconnect()
+            self.next_delay = self.reconnect_delay
+        except (IOError, OSError) as e:
+            logging.warning('PahoReactorDriver: reconnect failed '+str(e))
+
+    # IReadWriteDescriptor
+    def fileno(self):
+        sock = self.client.socket()
+        if not sock:
+            return -1
+        return sock.fileno()
+
+    def doRead(self):
+        self.client.loop_read()
+
+    def doWrite(self):
+        self.client.loop_write()
+
+    def connectionLost(self, reason):
+        self.remove(None)
+
+    def logPrefix(self):
+        return 'paho-mqtt'
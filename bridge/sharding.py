@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+
+################################################################################
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+import bisect
+import hashlib
+
+def hash_key(key):
+    return int(hashlib.md5(str(key)).hexdigest()[:8], 16)
+
+class HashRing():
+    # Consistent hash ring. Every member is placed on the ring several times so that keys
+    # are spread evenly, and removing a member only moves the keys that it owned.
+
+    def __init__(self, members, replicas=64):
+        self.replicas = replicas
+        self.set_members(members)
+
+    def set_members(self, members):
+        ring = list()
+        for member in members:
+            for replica in range(self.replicas):
+                ring.append((hash_key(str(member)+'-'+str(replica)), member))
+        ring.sort()
+        self.members = list(members)
+        self.ring = ring
+        self.hashes = [point for point, member in ring]
+
+    def get_member(self, key):
+        if not self.ring:
+            return None
+        index = bisect.bisect(self.hashes, hash_key(key)) % len(self.ring)
+        return self.ring[index][1]
+
+
+class Shard():
+    # The slice of the bindings handled by one bridge worker process
+
+    def __init__(self, shard_id, members):
+        self.shard_id = shard_id
+        self.ring = HashRing(members)
+
+    def owns(self, key):
+        return self.ring.get_member(key) == self.shard_id
+
+    def update(self, members):
+        self.ring.set_members(members)
+
+    def get_members(self):
+        return self.ring.members
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+
+
+################################################################################
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+import logging
+import json
+import os
+from threading import Lock
+
+SEGMENT_SUFFIX = '.spool'
+CURSOR_FILE_NAME = 'cursor'
+
+class DiskSpool():
+    # Append-only store for messages that could not be delivered downstream.
+    # Records are written as json lines into numbered segment files. The cursor file
+    # remembers the next record to replay, so the spool survives a restart of the bridge.
+    # Segments are deleted once they have been replayed, and the oldest segments are
+    # dropped when the spool grows beyond max_bytes.
+
+    def __init__(self, directory, segment_bytes=4*1024*1024, max_bytes=256*1024*1024):
+        logging.info('DiskSpool : Init in '+directory)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.write_file = None
+
+        #Statistics
+        self.appended = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.corrupt = 0
+        # appended at the previous replay
+        self.replay_appended = 0
+
+        self.segments = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+        self.sizes = dict()
+        self.records = dict()
+        for segment in self.segments:
+            self.sizes[segment] = os.path.getsize(self.segment_path(segment))
+            with open(self.segment_path(segment), 'r') as segment_file:
+                self.records[segment] = sum(1 for line in segment_file)
+        self.read_cursor()
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, '%012d%s' % (segment, SEGMENT_SUFFIX))
+
+    def read_cursor(self):
+        self.cursor_segment = self.segments[0] if self.segments else 0
+        self.cursor_offset = 0
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE_NAME), 'r') as cursor_file:
+                segment, offset = cursor_file.read().split()
+                if int(segment) in self.sizes:
+                    self.cursor_segment = int(segment)
+                    self.cursor_offset = int(offset)
+        except (IOError, ValueError):
+            pass
+
+        # Records before the cursor have already been replayed
+        if self.cursor_offset and self.cursor_segment in self.records:
+            with open(self.segment_path(self.cursor_segment), 'r') as segment_file:
+                self.records[self.cursor_segment] -= segment_file.read(self.cursor_offset).count('\n')
+
+    def write_cursor(self):
+        path = os.path.join(self.directory, CURSOR_FILE_NAME)
+        with open(path+'.tmp', 'w') as cursor_file:
+            cursor_file.write(str(self.cursor_segment)+' '+str(self.cursor_offset))
+        os.rename(path+'.tmp', path)
+
+    def pending(self):
+        return sum(self.records.values())
+
+    def total_bytes(self):
+        return sum(self.sizes.values())
+
+    def append(self, record):
+        line = json.dumps(record)+'\n'
+        with self.lock:
+            if not self.write_file or self.sizes[self.segments[-1]] + len(line) > self.segment_bytes:
+                self.open_segment()
+            self.write_file.write(line)
+            self.write_file.flush()
+            segment = self.segments[-1]
+            self.sizes[segment] += len(line)
+            self.records[segment] += 1
+            self.appended += 1
+            self.enforce_cap()
+
+    def open_segment(self):
+        # Called with the lock held. A new segment is started after every restart so that
+        # a partially written line never gets appended to.
+        if self.write_file:
+            self.write_file.close()
+        segment = self.segments[-1] + 1 if self.segments else 0
+        self.write_file = open(self.segment_path(segment), 'a')
+        self.segments.append(segment)
+        self.sizes[segment] = 0
+        self.records[segment] = 0
+
+    def enforce_cap(self):
+        # Called with the lock held
+        while self.total_bytes() > self.max_bytes and len(self.segments) > 1:
+            segment = self.segments[0]
+            logging.warning('DiskSpool : size cap reached, dropping '+str(self.records[segment])+' spooled records')
+            self.dropped += self.records[segment]
+            self.remove_segment(segment)
+
+    def remove_segment(self, segment):
+        # Called with the lock held
+        self.segments.remove(segment)
+        del self.sizes[segment]
+        del self.records[segment]
+        os.remove(self.segment_path(segment))
+        if segment == self.cursor_segment:
+            self.cursor_segment = self.segments[0]
+            self.cursor_offset = 0
+            self.write_cursor()
+
+    def read_batch(self, max_records):
+        # Returns up to max_records (record, segment, end offset) tuples starting at the cursor
+        batch = list()
+        with self.lock:
+            segment = self.cursor_segment
+            offset = self.cursor_offset
+            while len(batch) < max_records and segment in self.sizes:
+                with open(self.segment_path(segment), 'r') as segment_file:
+                    segment_file.seek(offset)
+                    while len(batch) < max_records:
+                        line = segment_file.readline()
+                        if not line:
+                            break
+                        offset += len(line)
+                        try:
+                            batch.append((json.loads(line), segment, offset))
+                        except ValueError:
+                            self.corrupt += 1
+                            batch.append((None, segment, offset))
+                if len(batch) < max_records:
+                    index = self.segments.index(segment) + 1
+                    if index >= len(self.segments):
+                        break
+                    segment = self.segments[index]
+                    offset = 0
+        return batch
+
+    def advance(self, segment, offset):
+        # Moves the cursor past a replayed record and deletes fully replayed segments
+        with self.lock:
+            if segment not in self.sizes:
+                # Dropped by the size cap while the record was being replayed
+                return
+            while self.cursor_segment != segment:
+                self.remove_segment(self.cursor_segment)
+            self.records[segment] -= 1
+            self.cursor_offset = offset
+            if segment != self.segments[-1] and offset >= self.sizes[segment]:
+                self.remove_segment(segment)
+
+    def replay(self, handler, max_records):
+        # Hands spooled records to handler in order until it returns False or max_records
+        # have been replayed. Returns the number of replayed records.
+        # New messages are appended behind the spooled ones while the spool is not empty,
+        # so max_records is raised to twice the records appended since the previous
+        # replay. The spool then drains even when messages arrive faster than max_records.
+        appended = self.appended
+        max_records = max(max_records, 2 * (appended - self.replay_appended))
+        self.replay_appended = appended
+        replayed = 0
+        batch = self.read_batch(max_records)
+        for record, segment, offset in batch:
+            if record is not None and not handler(record):
+                break
+            self.advance(segment, offset)
+            replayed += 1
+        if batch:
+            with self.lock:
+                self.write_cursor()
+        self.replayed += replayed
+        return replayed
+
+    def stats(self):
+        stats = dict()
+        stats['pending'] = self.pending()
+        stats['bytes'] = self.total_bytes()
+        stats['segments'] = len(self.segments)
+        stats['appended'] = self.appended
+        stats['replayed'] = self.replayed
+        stats['dropped'] = self.dropped
+        stats['corrupt'] = self.corrupt
+        return stats
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+
+################################################################################
+#
+#  Copyright (C) 2016, Carnegie Mellon University
+#  All rights reserved.
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, version 2.0 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+import logging
+import zlib
+import Queue
+from threading import Thread
+
+class KeyedWorkerPool():
+    # Runs tasks on a fixed set of worker threads. Every key is always handled by the
+    # same worker, so tasks submitted with the same key (e.g. a device id) run in the
+    # order they were submitted while tasks for different keys run concurrently.
+
+    def __init__(self, num_workers, queue_size=1000):
+        logging.info('KeyedWorkerPool : Init with '+str(num_workers)+' workers')
+        self.queues = list()
+        self.threads = list()
+        self.processed = [0] * num_workers
+        self.failed = [0] * num_workers
+        for index in range(num_workers):
+            # A full worker queue blocks submit, which in turn stops the bridge from
+            # draining its bounded message queues
+            queue = Queue.Queue(queue_size)
+            thread = Thread(target=self.run_worker, args=(index, queue), name='bridge-worker-'+str(index))
+            thread.daemon = True
+            self.queues.append(queue)
+            self.threads.append(thread)
+            thread.start()
+
+    def worker_index(self, key):
+        # crc32 instead of hash() so that the key to worker mapping does not depend on
+        # the python build
+        return (zlib.crc32(str(key)) & 0xffffffff) % len(self.queues)
+
+    def submit(self, key, function, *args):
+        self.queues[self.worker_index(key)].put((function, args))
+
+    def run_worker(self, index, queue):
+        while True:
+            task = queue.get()
+            if task is None:
+                break
+            function, args = task
+            try:
+                function(*args)
+                self.processed[index] += 1
+            except Exception:
+                self.failed[index] += 1
+                logging.exception('KeyedWorkerPool : task failed on worker '+str(index))
+
+    def stats(self):
+        stats = dict()
+        stats['workers'] = len(self.queues)
+        stats['depth'] = [queue.qsize() for queue in self.queues]
+        stats['processed'] = sum(self.processed)
+        stats['failed'] = sum(self.failed)
+        return stats
+
+    def stop(self):
+        logging.info('Stopping KeyedWorkerPool')
+        for queue in self.queues:
+            queue.put(None)
+        for thread in self.threads:
+            thread.join()
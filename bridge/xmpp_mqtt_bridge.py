@@ -24,7 +24,8 @@
 #
 ################################################################################
 
-from threading import Lock
+from threading import Lock, RLock, local
+from collections import deque
 import ssl
 import paho.mqtt.client as mqtt
 
@@ -34,109 +35,608 @@ import signal
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__))+'/../PyMIO/')
 from mio import MIO
+from mio_queue import BoundedQueue
+from mio_types import OverflowPolicy
+from mio_batch import PublishBatcher
 import mio_meta_utils
-from data_holders import Server
+from data_holders import Server, TopicRoute
+from worker_pool import KeyedWorkerPool
+from spool import DiskSpool
+from coalescer import LastValueCoalescer
+from metrics import LatencyRecorder, StartupTimer, monotonic
+from metrics import MQTT_TO_XMPP, XMPP_TO_MQTT, STAGE_QUEUE, STAGE_TRANSFORM, STAGE_PUBLISH, STAGE_TOTAL
 
 class XmppMqttBridge():
     
     xmppMqttBindings = dict()
     mqttXmppBindings = dict()
 
-    def __init__(self, xmppClient, mqttClient):
+    def __init__(self, xmppClient, mqttClient, shard=None, startup=None, bind_on_init=True):
         logging.info('XmppMqttBridge: Init')
         
+        # When the bridge runs as one of several processes, shard decides which
+        # bindings belong to this process
+        self.shard = shard
         self.xmppClient = xmppClient
         self.mqttClient = mqttClient
+        self.dispatcher = None
+        self.error_handler = None
+        self.dispatch_pending = False
+        self.dispatch_lock = Lock()
+        self.workers = None
+        self.latency = LatencyRecorder()
         self.xmppClient.parent = self
         self.mqttClient.parent = self
-        self.xmppClient.generate_bindings() 
+        # Stages of the start of the process, generate_bindings marks its own stages
+        self.startup = startup or StartupTimer()
+        # With bind_on_init=False the caller runs generate_bindings once the messages
+        # are dispatched, so the devices bound while the tree is walked are forwarded
+        if bind_on_init:
+            self.generate_bindings()
+
+    def generate_bindings(self):
+        self.xmppClient.generate_bindings()
+        self.startup.finish()
      
     def process_messages(self):
         self.mqttClient.process_messages()
         self.xmppClient.process_messages()
 
+    def record(self, direction, stage, started):
+        # Records the time spent in a stage of a bridged message, started is a monotonic() time
+        self.latency.observe(direction, self.xmppClient.binding_type, stage, monotonic() - started)
+
+    def owns(self, key):
+        # Returns True if the binding with this key is handled by this bridge process
+        if not self.shard:
+            return True
+        return self.shard.owns(key)
+
+    def rebalance(self, members, defer=None):
+        # Called when the supervisor changes the set of shards. This process takes over
+        # the bindings of the removed shards. The bindings wait for the xmpp server, with
+        # defer, e.g. threads.deferToThread, they are generated off the calling thread.
+        self.shard.update(members)
+        if defer:
+            defer(self.xmppClient.generate_bindings).addErrback(
+                lambda failure: logging.error('Rebalance failed: '+failure.getBriefTraceback()))
+        else:
+            self.xmppClient.generate_bindings()
+
+    def refresh_bindings(self):
+        # Called periodically to pick up the changes of the bindings on the xmpp side
+        self.xmppClient.refresh_bindings()
+
+    def enable_workers(self, num_workers):
+        # Messages are processed on a pool of threads partitioned by device key instead of
+        # serially on the main loop. Messages of one device keep their order.
+        if num_workers > 0:
+            self.workers = KeyedWorkerPool(num_workers)
+
+    def submit(self, key, function, *args):
+        if self.workers:
+            self.workers.submit(key, function, *args)
+        else:
+            function(*args)
+
+    def enable_spool(self, directory, segment_bytes, max_bytes):
+        # Messages that can not be delivered because the broker or the xmpp server is
+        # unavailable are written to disk and replayed once the connection is back
+        self.mqttClient.spool = DiskSpool(os.path.join(directory, 'mqtt'), segment_bytes, max_bytes)
+        self.xmppClient.spool = DiskSpool(os.path.join(directory, 'xmpp'), segment_bytes, max_bytes)
+
+    def replay_spools(self, max_records):
+        self.mqttClient.replay_spool(max_records)
+        self.xmppClient.replay_spool(max_records)
+
+    def enable_coalescing(self, window):
+        # Only the newest xmpp sample per node and transducer is forwarded to mqtt. With a
+        # window of 0 samples are coalesced within one dispatch, otherwise flush_coalesced
+        # has to be called every window seconds.
+        self.xmppClient.coalescer = LastValueCoalescer()
+        self.xmppClient.coalesce_window = window
+
+    def flush_coalesced(self):
+        self.xmppClient.flush_coalesced()
+
+    def enable_event_dispatch(self, dispatcher, error_handler=None):
+        # dispatcher is a thread safe callable that runs the function passed to it on the
+        # main loop (e.g. reactor.callFromThread). Once it is set, the clients wake up the
+        # bridge as soon as a message arrives instead of waiting for the next poll.
+        logging.info('XmppMqttBridge: Event dispatch enabled')
+        self.dispatcher = dispatcher
+        self.error_handler = error_handler
+        # Drain whatever was received before dispatch was enabled
+        self.notify()
+
+    def notify(self):
+        # Called from the mqtt and xmpp client threads when a message is received.
+        # Only one dispatch is scheduled at a time, messages that arrive until it runs
+        # are processed together in the same batch.
+        if not self.dispatcher:
+            return
+        with self.dispatch_lock:
+            if self.dispatch_pending:
+                return
+            self.dispatch_pending = True
+        self.dispatcher(self.dispatch)
+
+    def dispatch(self):
+        # Clear the flag before processing so that messages arriving meanwhile schedule
+        # another dispatch
+        with self.dispatch_lock:
+            self.dispatch_pending = False
+        try:
+            self.process_messages()
+        except Exception:
+            if not self.error_handler:
+                raise
+            self.error_handler()
+
+    def get_stats(self):
+        stats = dict()
+        stats['mqtt_queue'] = self.mqttClient.queue_stats()
+        stats['xmpp_queue'] = self.xmppClient.queue_stats()
+        stats['xmpp_meta_cache'] = self.xmppClient.mio.meta_cache_stats()
+        stats['xmpp_sessions'] = self.xmppClient.mio.session_stats()
+        stats['xmpp_reconnect'] = self.xmppClient.mio.reconnect_stats()
+        if self.workers:
+            stats['workers'] = self.workers.stats()
+        stats['mqtt_publish'] = self.mqttClient.publish_stats()
+        stats['latency'] = self.latency.stats()
+        if self.xmppClient.coalescer:
+            stats['xmpp_coalescer'] = self.xmppClient.coalescer.stats()
+        if self.mqttClient.spool:
+            stats['mqtt_spool'] = self.mqttClient.spool.stats()
+        if self.xmppClient.spool:
+            stats['xmpp_spool'] = self.xmppClient.spool.stats()
+        if self.xmppClient.batcher:
+            stats['xmpp_batcher'] = self.xmppClient.batcher.stats()
+        if self.xmppClient.async_publish or self.xmppClient.batcher:
+            stats['xmpp_publish'] = self.xmppClient.mio.publish_stats()
+        return stats
+
+    def log_stats(self):
+        for name, values in sorted(self.get_stats().items()):
+            logging.info('XmppMqttBridge stats: '+name+' '+str(values))
+
     def stop(self):    
         self.mqttClient.stop()
+        if self.workers:
+            self.workers.stop()
         self.xmppClient.stop()
 
 
 
+class TopicNode():
+    # One level of the topic trie
+
+    def __init__(self):
+        self.literals = dict()
+        self.capture = None
+        self.capture_name = None
+        self.multi_level = None
+        self.route = None
+
+
+class TopicRouter():
+    # Dispatches mqtt topics to handlers. Patterns are topic filters whose levels can be
+    # literals, '+', '#' or named captures like {devEUI}, e.g.
+    # 'application/{appEUI}/node/{devEUI}/rx'. A topic is matched by walking the trie one
+    # level at a time, so the cost depends on the topic depth and not on the number of
+    # registered patterns. Literal levels take precedence over captures and '#'.
+
+    def __init__(self):
+        self.root = TopicNode()
+        self.routes = list()
+
+    def add_route(self, pattern, handler, key_fields=None):
+        route = TopicRoute(pattern, handler, key_fields)
+        node = self.root
+        levels = pattern.split('/')
+        for index, level in enumerate(levels):
+            if level == '#':
+                if index != len(levels) - 1:
+                    raise ValueError('# must be the last level of topic pattern '+pattern)
+                node.multi_level = route
+                break
+            if level == '+' or (level.startswith('{') and level.endswith('}')):
+                if not node.capture:
+                    node.capture = TopicNode()
+                    node.capture_name = level[1:-1] if level != '+' else None
+                elif node.capture_name != (level[1:-1] if level != '+' else None):
+                    raise ValueError('Conflicting capture names at level '+str(index)+' of topic pattern '+pattern)
+                node = node.capture
+            else:
+                node = node.literals.setdefault(level, TopicNode())
+        else:
+            node.route = route
+        self.routes.append(route)
+
+    def match(self, topic):
+        # Returns (route, fields) for the best matching pattern or None
+        fields = dict()
+        route = self.match_levels(self.root, topic.split('/'), 0, fields)
+        if not route:
+            return None
+        return route, fields
+
+    def match_levels(self, node, levels, index, fields):
+        if index == len(levels):
+            if node.route:
+                return node.route
+            return node.multi_level
+        level = levels[index]
+        child = node.literals.get(level)
+        if child:
+            route = self.match_levels(child, levels, index + 1, fields)
+            if route:
+                return route
+        if node.capture:
+            route = self.match_levels(node.capture, levels, index + 1, fields)
+            if route:
+                if node.capture_name:
+                    fields[node.capture_name] = level
+                return route
+        return node.multi_level
+
+    def subscriptions(self):
+        # Topic filters to subscribe to on the broker
+        topics = list()
+        for route in self.routes:
+            levels = route.pattern.split('/')
+            topics.append('/'.join('+' if level.startswith('{') else level for level in levels))
+        return topics
+
+
 class MqttClient():
     
-    mqttMessageBuffer = list()
-    mqtt_message_buffer_lock = Lock()
+    parent = None
+    spool = None
+    connected = False
+    # Publishing defaults, changed with configure_publishing
+    default_qos = 0
+    inflight_window = 100
+    backlog_capacity = 10000
+    ack_timeout = 10
+    max_retries = 3
 
     def on_connect(self, client, userdata, flags, rc):
         logging.info('Connected to mqtt broker with result code '+str(rc))
+        self.connected = (rc == 0)
         topics = self.get_topics()
         for topic in topics:
             logging.info('Subscibing to mqtt topic ' + topic)
             client.subscribe(topic)
 
+    def on_disconnect(self, client, userdata, rc):
+        logging.warning('Disconnected from mqtt broker with result code '+str(rc))
+        self.connected = False
+
+    def on_publish(self, client, userdata, mid):
+        # Called by paho when the broker acknowledged a message (QoS 1 and 2) or when the
+        # message was written to the socket (QoS 0). paho holds its own message lock here.
+        with self.inflight_lock:
+            entry = self.inflight.pop(mid, None)
+            if not entry:
+                # paho can call this before publish() has returned the mid
+                self.early_acks.add(mid)
+                return
+            self.record_ack(entry[0], entry[1])
+        self.send_backlog()
+
     def on_message(self, client, userdata, msg):
         logging.info('Received message on mqtt client ' +msg.topic+' '+str(msg.payload))
-        self.mqttMessageBuffer.append(msg)
+        self.mqttMessageBuffer.put(msg.topic, (monotonic(), msg))
+        if self.parent:
+            self.parent.notify()
 
-    def __init__(self, mqtt_server):  
+    def __init__(self, mqtt_server, queue_capacity=0, queue_policy=OverflowPolicy.DROP_OLDEST, loop_driver=None):  
         logging.info('MqttClient : Init')
+        # Without a loop driver paho runs its network loop on its own thread
+        self.loop_driver = loop_driver
+        if self.loop_driver and queue_policy == OverflowPolicy.BLOCK:
+            # on_message runs on the reactor thread, which is also the one draining the
+            # buffer, so waiting for room would stall the bridge for good
+            logging.warning('MqttClient : the block queue policy can not be used with the reactor mqtt loop, new messages are dropped when the buffer is full')
+            queue_policy = OverflowPolicy.DROP_NEWEST
+        # Messages received from the broker wait here until the bridge processes them
+        self.mqttMessageBuffer = BoundedQueue(queue_capacity, queue_policy)
+        self.router = TopicRouter()
+        self.register_topics()
+        # Published messages that have not been acknowledged, by paho message id
+        self.inflight = dict()
+        # Number of messages being handed to paho, they hold a slot of the in-flight window
+        self.sending = 0
+        self.backlog = deque()
+        self.early_acks = set()
+        self.inflight_lock = RLock()
+        self.topic_qos = dict()
+        self.published = 0
+        self.acked = 0
+        self.retried = 0
+        self.failed = 0
+        self.ack_latency_total = 0.0
+        self.ack_latency_max = 0.0
+        self.last_stats = (monotonic(), 0)
         self.client = mqtt.Client()
         self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_publish = self.on_publish
         self.client.on_message = self.on_message
         self.client.username_pw_set(mqtt_server.user, mqtt_server.password)
         self.client.tls_set('/etc/ssl/certs/ca-certificates.crt', tls_version=ssl.PROTOCOL_TLSv1)
+        if self.loop_driver:
+            self.loop_driver.attach(self.client)
         self.client.connect(mqtt_server.host, mqtt_server.port, 60)
-        self.client.loop_start()
+        if self.loop_driver:
+            self.loop_driver.start()
+        else:
+            self.client.loop_start()
     
     def grab_cached_messages(self):
-        self.mqtt_message_buffer_lock.acquire()
-        messages = self.mqttMessageBuffer
-        self.mqttMessageBuffer = list()
-        self.mqtt_message_buffer_lock.release()
-        return messages
+        return [msg for topic, (received_at, msg) in self.mqttMessageBuffer.drain()]
+
+    def queue_stats(self):
+        return self.mqttMessageBuffer.stats()
         
     def process_messages(self):
-        messages = self.grab_cached_messages()
-        for msg in messages:
-            logging.info('Processing message in mqtt client ' +str(msg))
+        for topic, (received_at, msg) in self.mqttMessageBuffer.drain():
+            # The topic is matched once, the route also tells which device sent the message
+            match = self.router.match(msg.topic)
+            if match and match[0].key_fields:
+                route, fields = match
+                key = '_'.join(fields[name] for name in route.key_fields)
+            else:
+                key = self.get_message_key(msg)
+            self.parent.submit(key, self.handle_message, msg, match, received_at)
+
+    def handle_message(self, msg, match=None, received_at=None):
+        logging.info('Processing message in mqtt client ' +str(msg))
+        if received_at is not None:
+            self.parent.record(MQTT_TO_XMPP, STAGE_QUEUE, received_at)
+        started = monotonic()
+        if match:
+            route, fields = match
+            xmpp_message = route.handler(msg, fields)
+        else:
             xmpp_message = self.process_message(msg)
-            if xmpp_message:
-                self.parent.xmppClient.publish(xmpp_message)
+        self.parent.record(MQTT_TO_XMPP, STAGE_TRANSFORM, started)
+        if xmpp_message:
+            # The total is recorded once the xmpp server acknowledges the values
+            self.parent.xmppClient.publish(xmpp_message, received_at)
+
+    def get_message_key(self, msg):
+        # Messages with the same key are processed in order. The derived class can
+        # override this method to return the id of the device that sent the message.
+        return msg.topic
     
     
+    def configure_publishing(self, qos, inflight_window, ack_timeout, max_retries):
+        self.default_qos = int(qos)
+        self.inflight_window = inflight_window
+        self.ack_timeout = ack_timeout
+        self.max_retries = max_retries
+        # The bridge keeps the in-flight window itself, paho sends every message right away
+        self.client.max_inflight_messages_set(0)
+
+    def set_topic_qos(self, topic, qos):
+        # Overrides the default QoS for the messages published to one binding
+        self.topic_qos[topic] = qos
+
     def publish(self, msg):
-        logging.info('MqttClient: publishing message '+str(msg))
-        self.client.publish(msg["topic"], msg["message"], retain = True) 
+        if self.loop_driver:
+            # Called from the worker threads, paho is only used from the reactor thread
+            self.loop_driver.call(self.publish_message, msg)
+        else:
+            self.publish_message(msg)
+
+    def publish_message(self, msg):
+        logging.debug('MqttClient: publishing message '+str(msg))
+        if self.spool and (self.spool.pending() or not self.connected):
+            # Messages go through the spool until it is replayed so that they stay in order
+            self.spool_message(msg)
+            return
+        if not self.publish_now(msg) and self.spool:
+            self.spool_message(msg)
+
+    def spool_message(self, msg):
+        # The receive time is only meaningful within this process
+        msg.pop("received_at", None)
+        self.spool.append(msg)
+
+    def publish_now(self, msg):
+        # Messages beyond the in-flight window wait in the backlog until acks come in.
+        # Returns False if the message could not be handed to paho.
+        dropped = None
+        with self.inflight_lock:
+            if self.window_full():
+                if len(self.backlog) >= self.backlog_capacity:
+                    dropped = self.backlog.popleft()
+                self.backlog.append(msg)
+                msg = None
+            else:
+                self.sending += 1
+        if dropped is not None:
+            self.fail(dropped)
+        return msg is None or self.send(msg, 1)
+
+    def window_full(self):
+        # Called with the inflight lock held
+        return len(self.inflight) + self.sending >= self.inflight_window
+
+    def get_qos(self, msg):
+        return self.topic_qos.get(msg["topic"], self.default_qos)
+
+    def send(self, msg, attempt):
+        # Called without the inflight lock, once a slot of the window was reserved for msg.
+        # paho takes its message lock in publish() and calls on_publish with it held, so
+        # calling paho with the inflight lock held would deadlock with its network thread.
+        result = self.client.publish(msg["topic"], msg["message"], qos = self.get_qos(msg), retain = True) 
+        with self.inflight_lock:
+            self.sending -= 1
+            if result[0] != mqtt.MQTT_ERR_SUCCESS:
+                return False
+            mid = result[1]
+            self.published += 1
+            if mid in self.early_acks:
+                self.early_acks.discard(mid)
+                self.record_ack(msg, monotonic())
+            else:
+                self.inflight[mid] = (msg, monotonic(), attempt)
+        return True
+
+    def send_backlog(self):
+        # Called without the inflight lock, sends backlog messages while the window has room
+        while True:
+            with self.inflight_lock:
+                if not self.backlog or self.window_full():
+                    return
+                msg = self.backlog.popleft()
+                self.sending += 1
+            if not self.send(msg, 1):
+                self.fail(msg)
+
+    def record_ack(self, msg, sent_at):
+        latency = monotonic() - sent_at
+        if self.parent:
+            self.parent.record(XMPP_TO_MQTT, STAGE_PUBLISH, sent_at)
+            if "received_at" in msg:
+                self.parent.record(XMPP_TO_MQTT, STAGE_TOTAL, msg["received_at"])
+        self.acked += 1
+        self.ack_latency_total += latency
+        if latency > self.ack_latency_max:
+            self.ack_latency_max = latency
+
+    def fail(self, msg):
+        # The message could not be delivered, keep it in the spool if there is one
+        with self.inflight_lock:
+            self.failed += 1
+        if self.spool:
+            self.spool_message(msg)
+
+    def check_inflight(self):
+        # Called periodically. QoS 0 messages that were not sent within ack_timeout are
+        # published again, up to max_retries times. paho itself retransmits QoS 1 and 2
+        # messages until the broker acknowledges them, publishing them again would deliver
+        # them twice, so they stay in flight and are only reported every ack_timeout.
+        now = monotonic()
+        resend = list()
+        failed = list()
+        with self.inflight_lock:
+            for mid, (msg, sent_at, attempt) in self.inflight.items():
+                if self.get_qos(msg) > 0:
+                    if now - sent_at >= self.ack_timeout * attempt:
+                        logging.warning('MqttClient: message to '+msg["topic"]+' not acknowledged by the broker after %d seconds' % (now - sent_at))
+                        self.inflight[mid] = (msg, sent_at, attempt + 1)
+                    continue
+                if now - sent_at < self.ack_timeout:
+                    continue
+                del self.inflight[mid]
+                if attempt > self.max_retries:
+                    failed.append(msg)
+                else:
+                    # The slot of the timed out message is kept for the new attempt
+                    self.sending += 1
+                    resend.append((msg, attempt + 1))
+        # paho is called once the inflight lock is released, see send
+        for msg, attempt in resend:
+            if self.send(msg, attempt):
+                with self.inflight_lock:
+                    self.retried += 1
+            else:
+                failed.append(msg)
+        for msg in failed:
+            logging.warning('MqttClient: message to '+msg["topic"]+' was not acknowledged by the broker')
+            self.fail(msg)
+        self.send_backlog()
+
+    def publish_stats(self):
+        with self.inflight_lock:
+            now = monotonic()
+            last_time, last_acked = self.last_stats
+            self.last_stats = (now, self.acked)
+            stats = dict()
+            stats['published'] = self.published
+            stats['acked'] = self.acked
+            stats['retried'] = self.retried
+            stats['failed'] = self.failed
+            stats['inflight'] = len(self.inflight)
+            stats['backlog'] = len(self.backlog)
+            stats['acks_per_second'] = (self.acked - last_acked) / max(now - last_time, 0.001)
+            stats['ack_latency_avg'] = self.ack_latency_total / max(self.acked, 1)
+            stats['ack_latency_max'] = self.ack_latency_max
+            return stats
+
+    def replay_spool(self, max_records):
+        if not self.spool or not self.connected:
+            return 0
+        if self.loop_driver:
+            self.loop_driver.call(self.spool.replay, self.publish_now, max_records)
+            return 0
+        return self.spool.replay(self.publish_now, max_records)
     
     def stop(self):
         logging.info('Disconnecting MqttClient')
-        self.client.loop_stop()
+        if self.loop_driver:
+            self.loop_driver.stop()
+        else:
+            self.client.loop_stop()
 
     def process_message(self, msg):
         # The derived class should override this method and do the conversion of mqtt message
         # to xmpp format so that the message can be published to xmpp side.
         pass
 
-    def get_topics(self):    
-        # The derived class should override this method and return a list of topics
-        #that this mqtt client should subscribe to.
+    def register_topics(self):
+        # The derived class should override this method and register the topic patterns it
+        # handles with self.router.add_route(pattern, handler, key_fields). The handler is
+        # called with the message and the captured fields and returns the xmpp message.
         pass
 
+    def get_topics(self):    
+        # Returns the list of topics that this mqtt client should subscribe to. By default
+        # these are the patterns registered with the router.
+        return self.router.subscriptions()
+
 
 class XmppClient():
 
+    parent = None
+    # Name of the kind of bindings created by the derived class, used in the statistics
+    binding_type = 'xmpp'
+    spool = None
+    coalescer = None
+    coalesce_window = 0
+    batcher = None
+    async_publish = False
+
     def __init__(self, xmpp_server, node_uuid):
         # Derived class does the initialization and calls init method in this class
         pass
 
-    def init(self, xmpp_server, node_uuid):    
+    def init(self, xmpp_server, node_uuid, queue_capacity=0, queue_policy=OverflowPolicy.DROP_OLDEST, sessions=1):    
         logging.info('XmppClient : init')
         self.node_uuid = node_uuid
-        self.mio = MIO(xmpp_server.user, xmpp_server.host, xmpp_server.password, logging.INFO)
+        # Time at which the mqtt message published by the current thread was received
+        self.publishing = local()
+        self.mio = MIO(xmpp_server.user, xmpp_server.host, xmpp_server.password, logging.INFO,
+                       cache_capacity=queue_capacity, cache_policy=queue_policy, sessions=sessions)
+        self.mio.add_cache_listener(self.on_cache_update)
         self.mio.subscribe_listener() #Starts a non-blocking listener thread
+
+    def on_cache_update(self, node):
+        # Called from the sleekxmpp thread every time a value is received from a subscribed node
+        if self.parent:
+            self.parent.notify()
     
     def generate_bindings(self):
         # Derived class should override this method to generate the bindings.
         pass
+
+    def refresh_bindings(self):
+        # Derived class can override this method to update the bindings more cheaply
+        self.generate_bindings()
         
     def process_message(self, node, msgList):
         #Derived class should override this method
@@ -148,15 +648,112 @@ class XmppClient():
 
     def process_messages(self):
         messages = self.mio.grab_cache_values()
+        if self.coalescer:
+            self.coalescer.add(messages)
+            if self.coalesce_window:
+                return
+            messages = self.coalescer.flush()
+        self.submit_messages(messages)
+
+    def flush_coalesced(self):
+        self.submit_messages(self.coalescer.flush())
+
+    def submit_messages(self, messages):
         for node, msgList in messages.items():
-            self.process_message(node, msgList)
+            self.parent.submit(node, self.handle_messages, node, msgList)
+
+    def handle_messages(self, node, msgList):
+        for msg in msgList:
+            received_at = getattr(msg, 'received_at', None)
+            if received_at is not None:
+                self.parent.record(XMPP_TO_MQTT, STAGE_QUEUE, received_at)
+        self.process_message(node, msgList)
             
-    def publish(self, msg):
+    def publish(self, msg, received_at=None):
         logging.info('XmppClient : publishing message '+ str(msg))
-        self.handle_publish(msg)
+        # The values published by handle_publish are attributed to the mqtt message
+        self.publishing.received_at = received_at
+        try:
+            self.handle_publish(msg)
+        finally:
+            self.publishing.received_at = None
+
+    def enable_batching(self, max_items, max_delay):
+        # Values of several nodes are collected and published with one request per node
+        self.batcher = PublishBatcher(self.mio, max_items, max_delay, self.spool_values, self.on_batch_published)
+
+    def enable_async_publish(self):
+        # Publications do not wait for the server, acknowledgements are tracked by MIO
+        self.async_publish = True
+
+    def publish_data(self, node, transducer_name, value):
+        self.publish_values(node, [(transducer_name, value)])
+
+    def publish_values(self, node, values):
+        # Used by the derived class to publish transducer values, a list of (name, value).
+        # All the values of a node go in one request. They are spooled to disk if the
+        # xmpp server is not reachable or does not acknowledge them in time.
+        received_at = getattr(self.publishing, 'received_at', None)
+        if self.spool and (self.spool.pending() or not self.mio.is_connected()):
+            self.spool_values(node, values)
+            return
+        if self.batcher:
+            self.batcher.add(node, values, received_at)
+            return
+        if self.async_publish:
+            started = monotonic()
+            request = self.mio.publish_data_batch_async(None, node, values)
+            request.add_done_callback(lambda request: self.on_published(request, node, values, started, received_at))
+            return
+        if not self.publish_record({'node': node, 'values': values}, received_at):
+            self.spool_values(node, values)
+
+    def on_published(self, request, node, values, started, received_at=None):
+        # Called from the sleekxmpp thread when an asynchronous publication is done
+        if request.exception() is not None:
+            self.spool_values(node, values)
+        elif self.parent:
+            self.parent.record(MQTT_TO_XMPP, STAGE_PUBLISH, started)
+            if received_at is not None:
+                self.parent.record(MQTT_TO_XMPP, STAGE_TOTAL, received_at)
+
+    def on_batch_published(self, node, values, received):
+        # Called by the batcher once the values of a node are acknowledged
+        if self.parent:
+            for received_at in received:
+                self.parent.record(MQTT_TO_XMPP, STAGE_TOTAL, received_at)
+
+    def spool_values(self, node, values):
+        if self.spool:
+            self.spool.append({'node': node, 'values': values})
+
+    def publish_record(self, record, received_at=None):
+        # Spooled records have no received_at, the time they spent in the spool is not
+        # part of the total
+        started = monotonic()
+        if 'values' in record:
+            published = self.mio.publish_data_batch(None, record['node'], record['values'])
+        else:
+            # Spooled by an older version of the bridge
+            published = self.mio.publish_data(None, record['node'], record['name'], record['value'])
+        if self.parent:
+            self.parent.record(MQTT_TO_XMPP, STAGE_PUBLISH, started)
+            if published and received_at is not None:
+                self.parent.record(MQTT_TO_XMPP, STAGE_TOTAL, received_at)
+        return published
+
+    def replay_spool(self, max_records):
+        if not self.spool or not self.mio.is_connected():
+            return 0
+        return self.spool.replay(self.publish_record, max_records)
+
+    def queue_stats(self):
+        return self.mio.cache_stats()
         
     def stop(self):
         logging.info('Disconnecting XmppClient')
+        if self.batcher:
+            self.batcher.stop()
         self.mio.stop()
 
 